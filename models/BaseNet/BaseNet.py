@@ -1,9 +1,20 @@
 from abc import abstractmethod
 from os.path import exists
-
-from torch.nn import Module
-
+from itertools import chain
+from collections import OrderedDict
+
+from numpy import asarray, array
+from torch import is_grad_enabled, is_tensor
+from torch.nn import Module, Sequential, Conv2d, BatchNorm2d
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from models.modules.TracedPaths import TracedPaths
+from models.modules.Path import Path, PathPlan
+from models.modules.BudgetSampler import BudgetSampler
+from models.modules.FlopsDistribution import FlopsDistribution
 from utils.HtmlLogger import HtmlLogger
+from utils.device import memoryFormat, defaultMemoryFormat
+from utils.flopsCache import architectureFingerprint, hostFingerprint, loadCacheEntry, saveCacheEntry
 
 
 class BaseNet(Module):
@@ -13,6 +24,7 @@ class BaseNet(Module):
             # assuming these lists layers don't change
             self._optim = self._buildLayersList(blocks, lambda block: block.getOptimizationLayers())
             self._forwardCounters = self._buildLayersList(blocks, lambda block: block.getCountersLayers())
+            self._switchUnits = self._buildLayersList(blocks, lambda block: block.getSwitchUnits())
 
         def _buildLayersList(self, blocks, getLayersFunc):
             layersList = []
@@ -30,25 +42,60 @@ class BaseNet(Module):
         def forwardCounters(self):
             return self._forwardCounters
 
+        def switchUnits(self):
+            return self._switchUnits
+
     _modelFlopsKey = 'modelFlops'
     _partitionKey = 'Partition'
     _baselineFlopsKey = 'baselineFlops'
     _baselineFlopsRatioKey = 'baselineFlopsRatio'
     _alphasDistributionKey = 'Alphas distribution'
+    _tracedPathsKey = 'traced_paths'
+    _memoryFormatKey = 'memory_format'
+    _flopsCacheKey = 'flops_cache'
+    _modelLatencyKey = 'modelLatency'
+    _costKey = 'cost'
+    _flopsCostKey = 'flops'
+    _latencyCostKey = 'latency'
+    _memoryCostKey = 'memory'
+    _pruneEpochKey = 'prune_epoch'
+    _pruneThresholdKey = 'prune_threshold'
+    # do width indices define model path, i.e. switching path doesn't rebuild model modules
+    # static paths can be traced and their switch plans can be cached
+    _staticPaths = True
+    # max number of paths plans we keep
+    _pathsPlansMaxSize = 1024
     # init args dict we have to sort by their values
     _keysToSortByValue = [_baselineFlopsRatioKey, _baselineFlopsKey]
 
     def __init__(self, args, initLayersParams):
         super(BaseNet, self).__init__()
+        # init traced paths cache
+        self._tracedPaths = TracedPaths(getattr(args, self._tracedPathsKey, 0) if self._staticPaths else 0)
+        # init paths plans cache, key is Path
+        self._pathsPlans = OrderedDict()
         # init save folder
         saveFolder = args.save
-        # init count flops flag
+        # init model flops, load them from flops cache if they haven't been given
         modelFlops = getattr(args, self._modelFlopsKey)
+        flopsCacheFolder = getattr(args, self._flopsCacheKey, None)
+        flopsCacheEntry = self._buildFlopsCacheEntry(args) if flopsCacheFolder else None
+        if (modelFlops is None) and flopsCacheFolder:
+            modelFlops = loadCacheEntry(flopsCacheFolder, flopsCacheEntry)
+            # share loaded flops with models built from args, e.g. replicas
+            setattr(args, self._modelFlopsKey, modelFlops)
+        # init count flops flag
         countFlopsFlag = modelFlops is None
         # init layers
         self.blocks = self.initBlocks(initLayersParams, countFlopsFlag)
         # init Layers class instance
         self._layers = self.Layers(self.blocks)
+        # init optimization layers each block flops depend on, and blocks each optimization layer affects their flops
+        self._blocksFlopsLayersIdx, self._layersFlopsBlocksIdx = self._buildFlopsDependencies()
+        # init activations & narrowed weights memory format
+        self._memoryFormat = memoryFormat(getattr(args, self._memoryFormatKey, defaultMemoryFormat()))
+        for layer in self._layers.forwardCounters():
+            layer.setMemoryFormat(self._memoryFormat)
         # init model alphas
         self._alphas = self._initAlphas(saveFolder)
 
@@ -64,9 +111,21 @@ class BaseNet(Module):
         else:
             # build args.modelFlops from layers flops data
             setattr(args, self._modelFlopsKey, self._getLayersFlopsData())
+            # add model flops to flops cache
+            if flopsCacheFolder:
+                saveCacheEntry(flopsCacheFolder, flopsCacheEntry, getattr(args, self._modelFlopsKey))
+
+        # set layers latency data from args.modelLatency, if latency has been measured
+        modelLatency = getattr(args, self._modelLatencyKey, None)
+        if modelLatency is not None:
+            self._setLayersLatencyData(modelLatency)
 
         # build dictionary of layer width indices list per width ratio
         self._baselineWidth, self.baselineFlops = self._buildBaselineWidthDict(args)
+        # init flops budget sampler, None if paths are drawn without budget
+        self._budgetSampler = BudgetSampler.build(self, args)
+        # init alphas closed-form flops distribution
+        self._flopsDistribution = FlopsDistribution(self)
         # print model to file
         self.printToFile(saveFolder)
         # # calc number of width permutations in model
@@ -89,8 +148,14 @@ class BaseNet(Module):
 
     # choose alpha based on alphas distribution
     @abstractmethod
-    def choosePathByAlphas(self):
-        raise NotImplementedError('subclasses must override choosePathByAlphas()!')
+    def _choosePathByAlphas(self):
+        raise NotImplementedError('subclasses must override _choosePathByAlphas()!')
+
+    # draw n paths from alphas distribution in a single batched distribution call,
+    # returns (n x nLayers) int tensor of layers samples, i.e. values setSamplePath() sets, on alphas device
+    @abstractmethod
+    def _sampleAlphaPaths(self, n: int):
+        raise NotImplementedError('subclasses must override _sampleAlphaPaths()!')
 
     # choose path based on alphas, without drawing from the distribution
     @abstractmethod
@@ -106,6 +171,64 @@ class BaseNet(Module):
     def _alphasClass(self):
         raise NotImplementedError('subclasses must override alphasClass()!')
 
+    # build standalone dense model of current path
+    @abstractmethod
+    def _materialize(self):
+        raise NotImplementedError('subclasses must override _materialize()!')
+
+    # choose path based on alphas distribution, conditioned on flops budget if we have budget sampler
+    def choosePathByAlphas(self):
+        if self._budgetSampler is None:
+            self._choosePathByAlphas()
+        else:
+            self._budgetSampler.choosePath()
+
+    # draw n paths based on alphas distribution, conditioned on flops budget if we have budget sampler
+    # returns (n x nLayers) int tensor of layers samples, set path by setSamplePath()
+    def sampleAlphaPaths(self, n: int):
+        if self._budgetSampler is None:
+            return self._sampleAlphaPaths(n)
+
+        return self._budgetSampler.samplePaths(n)
+
+    # draw n samples from alphas distribution, returns (n x nLayers) array of layers samples
+    def drawAlphasSamples(self, n: int):
+        return self._sampleAlphaPaths(n).cpu().numpy()
+
+    # converts layers sample to list of ints, tensor samples are copied to host at once
+    @staticmethod
+    def _sampleList(sample) -> list:
+        return sample.tolist() if is_tensor(sample) else [int(v) for v in sample]
+
+    # converts (nPaths x nLayers) array of layers samples to layers widths
+    # samples are layers width indices by default
+    def samplesToWidths(self, samples):
+        return self.pathsWidthIdxToWidth(samples)
+
+    # set layers sample as model path
+    def setSamplePath(self, sample):
+        self.setCurrWidthIdx(self._sampleList(sample))
+
+    # returns list of (values, widths, probs) arrays per layer, where layer value values[i] has width widths[i] & probability probs[i]
+    # returns None if layers distributions aren't independent
+    def layersSamplesDistribution(self):
+        return None
+
+    # returns (nPaths) tensor of (nPaths x nLayers) layers samples log probability under current alphas
+    # returns None if model doesn't define samples probability
+    def samplesLogProb(self, samples):
+        return None
+
+    # returns (nPaths x nAlphas) tensor of layers samples score function, i.e. log probability derivative w.r.t. alphas, under current alphas
+    # returns None if model doesn't define samples score
+    def samplesScores(self, samples):
+        return None
+
+    # returns (mean score, log probability mass) of alphas distribution conditioned on flops budget, estimated under current alphas
+    # returns None if paths are drawn from alphas distribution, i.e. we don't have budget sampler, or if model doesn't define samples score
+    def budgetMoments(self):
+        return None if self._budgetSampler is None else self._budgetSampler.conditionalMoments()
+
     def _initAlphas(self, saveFolder: str):
         _alphasClass = self._alphasClass()
         return _alphasClass(self, saveFolder)
@@ -114,6 +237,48 @@ class BaseNet(Module):
     def modelFlopsKey():
         return BaseNet._modelFlopsKey
 
+    # flops tables depend on model architecture, dataset input size & layers widths
+    @staticmethod
+    def _buildFlopsCacheEntry(args):
+        return architectureFingerprint(args.model, args.dataset, args.input_size, args.width, args.type, args.partition)
+
+    @staticmethod
+    def flopsCacheKey():
+        return BaseNet._flopsCacheKey
+
+    @staticmethod
+    def modelLatencyKey():
+        return BaseNet._modelLatencyKey
+
+    @staticmethod
+    def costKey():
+        return BaseNet._costKey
+
+    @staticmethod
+    def flopsCostKey():
+        return BaseNet._flopsCostKey
+
+    @staticmethod
+    def latencyCostKey():
+        return BaseNet._latencyCostKey
+
+    @staticmethod
+    def memoryCostKey():
+        return BaseNet._memoryCostKey
+
+    @staticmethod
+    def pruneEpochKey():
+        return BaseNet._pruneEpochKey
+
+    @staticmethod
+    def pruneThresholdKey():
+        return BaseNet._pruneThresholdKey
+
+    # path cost the search optimizes
+    @staticmethod
+    def costChoices():
+        return [BaseNet._flopsCostKey, BaseNet._latencyCostKey, BaseNet._memoryCostKey]
+
     @staticmethod
     def modelFlopsPathKey():
         return '{}_Path'.format(BaseNet.modelFlopsKey())
@@ -144,6 +309,29 @@ class BaseNet(Module):
     def _getLayersFlopsData(self):
         return [layer.getFlopsData() for layer in self._layers.forwardCounters()]
 
+    def _setLayersLatencyData(self, _modelLatency):
+        for layer, layerLatencyData in zip(self._layers.forwardCounters(), _modelLatency):
+            layer.setLatencyData(layerLatencyData)
+
+    # measure layers latency on local cpu, load it from args or from cache if it has been measured on this host
+    # sets args.modelLatency, therefore models built from args, e.g. replicas, don't measure latency
+    def initLayersLatency(self, args):
+        modelLatency = getattr(args, self._modelLatencyKey, None)
+        flopsCacheFolder = getattr(args, self._flopsCacheKey, None)
+        latencyCacheEntry = hostFingerprint(self._buildFlopsCacheEntry(args), self._latencyCostKey,
+                                            getattr(args, self._memoryFormatKey, defaultMemoryFormat())) if flopsCacheFolder else None
+        if (modelLatency is None) and flopsCacheFolder:
+            modelLatency = loadCacheEntry(flopsCacheFolder, latencyCacheEntry)
+
+        if modelLatency is None:
+            modelLatency = [layer.countWidthLatency() for layer in self._layers.forwardCounters()]
+            # add model latency to cache
+            if flopsCacheFolder:
+                saveCacheEntry(flopsCacheFolder, latencyCacheEntry, modelLatency)
+
+        self._setLayersLatencyData(modelLatency)
+        setattr(args, self._modelLatencyKey, modelLatency)
+
     def loadRandomWeights(self, logger=None):
         self.load_state_dict(self._randomWeights)
         if logger:
@@ -155,12 +343,120 @@ class BaseNet(Module):
     def flopsRatio(self):
         return self.countFlops() / self.baselineFlops
 
+    # measured latency of current path, requires layers latency, i.e. initLayersLatency()
+    def countLatency(self):
+        return sum([block.countLatency() for block in self.blocks])
+
+    # switches model to given path
+    def pathLatency(self, path):
+        self.setCurrWidthIdx(path)
+        return self.countLatency()
+
+    # current path memory footprint of single sample inference, i.e. layers parameters bytes & blocks peak activations bytes
+    def memoryBytes(self):
+        return self.blocksMemoryBytes([block.countMemory() for block in self.blocks])
+
+    # path memory footprint, given its blocks (parameters bytes, peak activations bytes) list
+    @staticmethod
+    def blocksMemoryBytes(blocksMemory: list):
+        return sum([paramsBytes for paramsBytes, _ in blocksMemory]) + max([peakBytes for _, peakBytes in blocksMemory])
+
+    # switches model to given path
+    def pathMemoryBytes(self, path):
+        self.setCurrWidthIdx(path)
+        return self.memoryBytes()
+
+    # vectorized flops of many paths, pathsWidth is (nPaths x nLayers) array of layers widths, i.e. number of filters
+    # returns flops array of size nPaths
+    def pathsFlops(self, pathsWidth):
+        pathsWidth = asarray(pathsWidth)
+        assert (pathsWidth.ndim == 2) and (pathsWidth.shape[-1] == len(self._layers.optimization()))
+        widths = {layer: pathsWidth[:, i] for i, layer in enumerate(self._layers.optimization())}
+
+        return sum([block.pathsFlops(widths) for block in self.blocks])
+
+    def pathsFlopsRatio(self, pathsWidth):
+        return self.pathsFlops(pathsWidth) / self.baselineFlops
+
+    # converts (nPaths x nLayers) array of layers width indices to layers widths
+    def pathsWidthIdxToWidth(self, pathsWidthIdx):
+        pathsWidthIdx = asarray(pathsWidthIdx)
+        return array([asarray(layer.widthList())[pathsWidthIdx[:, i]] for i, layer in enumerate(self._layers.optimization())]).T
+
     def layersList(self):
         return self._layers.optimization()
 
     def nLayers(self):
         return len(self.layersList())
 
+    # block flops depend on its layers widths & their previous layers widths
+    def _buildFlopsDependencies(self):
+        layersIdx = {layer: idx for idx, layer in enumerate(self._layers.optimization())}
+        blocksFlopsLayersIdx = []
+        layersFlopsBlocksIdx = [[] for _ in layersIdx]
+        for blockIdx, block in enumerate(self.blocks):
+            blockLayers = set(chain.from_iterable((layer, layer.prevLayer()) for layer in block.getCountersLayers()))
+            blockLayersIdx = sorted([layersIdx[layer] for layer in blockLayers if layer in layersIdx])
+            blocksFlopsLayersIdx.append(blockLayersIdx)
+            for idx in blockLayersIdx:
+                layersFlopsBlocksIdx[idx].append(blockIdx)
+
+        return blocksFlopsLayersIdx, layersFlopsBlocksIdx
+
+    def blocksFlopsLayersIdx(self):
+        return self._blocksFlopsLayersIdx
+
+    # returns indices of blocks whose flops depend on layers layersIdx widths, blocks latency & memory depend on the same layers
+    def layersBlocksIdx(self, layersIdx: list):
+        return sorted(set(chain.from_iterable(self._layersFlopsBlocksIdx[idx] for idx in layersIdx)))
+
+    # returns (layers width variable index, list of (widths, probs) per width variable), where probs is differentiable alphas function
+    # returns None if layers widths distributions aren't known in closed form
+    def widthsVariables(self):
+        return None
+
+    # closed-form flops distribution of alphas distribution, None if layers widths distributions aren't known in closed form
+    def flopsDistribution(self):
+        return None if self.widthsVariables() is None else self._flopsDistribution
+
+    # flops difference of setting layers layersIdx widths to newWidths, in path of given layers widths
+    # only blocks whose flops depend on these layers are evaluated, i.e. path flops aren't counted
+    def pathFlopsDelta(self, pathWidth: list, layersIdx: list, newWidths: list):
+        newPathWidth = list(pathWidth)
+        for idx, width in zip(layersIdx, newWidths):
+            newPathWidth[idx] = width
+
+        layers = self._layers.optimization()
+        delta = 0.0
+        for blockIdx in self.layersBlocksIdx(layersIdx):
+            block = self.blocks[blockIdx]
+            blockLayersIdx = self._blocksFlopsLayersIdx[blockIdx]
+            newFlops = block.pathsFlops({layers[idx]: array([newPathWidth[idx]]) for idx in blockLayersIdx})
+            flops = block.pathsFlops({layers[idx]: array([pathWidth[idx]]) for idx in blockLayersIdx})
+            delta += (newFlops - flops).item()
+
+        return delta
+
+    # returns list of (values, widths) arrays per layer, i.e. layer samples values & their widths, ordered by width
+    # samples are layers width indices by default
+    def layersSampleValues(self):
+        layersSampleValues = []
+        for layer in self._layers.optimization():
+            widths = asarray(layer.widthList())
+            values = widths.argsort(kind='stable')
+            layersSampleValues.append((values, widths[values]))
+
+        return layersSampleValues
+
+    # layers groups we apply width mutations on, i.e. single layers & width blocks
+    # width block is a group of layers who have the same number of output channels
+    def mutationGroups(self):
+        widthBlocks = OrderedDict()
+        for idx, layer in enumerate(self._layers.optimization()):
+            widthBlocks.setdefault(layer.outputChannels(), []).append(idx)
+
+        return [[idx] for idx in range(self.nLayers())] + [layersIdx for layersIdx in widthBlocks.values() if len(layersIdx) > 1]
+
     def alphas(self) -> list:
         return self._alphas.alphas()
 
@@ -184,6 +480,8 @@ class BaseNet(Module):
                 if nWidthLayer < nWidthNew:
                     assert ((nWidthNew - nWidthLayer) == 1)
                     layer.addWidth(0.0)
+            # layers width lists have been changed
+            self.clearPathsPlans()
 
             # init partition path indices
             partitionPathIndices = [(layer.nWidths() - 1) for layer in self.layersList()]
@@ -245,8 +543,21 @@ class BaseNet(Module):
     def currWidthRatio(self):
         return [layer.currWidthRatio() for layer in self._layers.optimization()]
 
+    def currPath(self) -> Path:
+        return Path(self.currWidthIdx())
+
     def setCurrWidthIdx(self, idxList: list):
         assert (len(self._layers.optimization()) == len(idxList))
+        # switch path by its plan, if we have one
+        if self._staticPaths:
+            path = idxList if isinstance(idxList, Path) else Path(idxList)
+            plan = self._pathsPlans.get(path)
+            if plan is not None:
+                # mark plan as most recently used
+                self._pathsPlans.move_to_end(path)
+                plan.apply(self._layers.switchUnits())
+                return
+
         for layer, idx in zip(self._layers.optimization(), idxList):
             layer.setCurrWidthIdx(idx)
 
@@ -254,6 +565,74 @@ class BaseNet(Module):
         for block in self.blocks:
             block.updateCurrWidth()
 
+        # save path plan
+        if self._staticPaths:
+            self._pathsPlans[path] = self._buildPathPlan()
+            # remove least recently used plan
+            if len(self._pathsPlans) > self._pathsPlansMaxSize:
+                self._pathsPlans.popitem(last=False)
+
+    # build current path plan
+    def _buildPathPlan(self) -> PathPlan:
+        return PathPlan([unit.switchState() for unit in self._layers.switchUnits()], self.currWidth(), self.currWidthRatio(), self.countFlops())
+
+    # must be called whenever width indices change their meaning, e.g. layers width lists have been changed
+    def clearPathsPlans(self):
+        self._pathsPlans.clear()
+
+    # returns list of removed width indices per layer, i.e. widths whose alphas probability is below threshold
+    # returns None if model doesn't support widths pruning
+    def negligibleWidths(self, threshold: float):
+        return None
+
+    # remove widths of alphas which are not layers alphas, e.g. model alphas
+    def _removeAlphasWidths(self, layersWidthsIdx: list):
+        pass
+
+    # remove widths from layers, their BNs & alphas, layersWidthsIdx is list of removed width indices per layer
+    # width indices change their meaning, therefore paths which use removed widths are dropped from baseline paths,
+    # and current path removed widths are replaced by layer 1st width
+    def removeLayersWidths(self, layersWidthsIdx: list):
+        layers = self._layers.optimization()
+        assert (len(layers) == len(layersWidthsIdx))
+        # map layer width old index to its new index, removed widths are mapped to None
+        idxMaps = []
+        for layer, widthsIdx in zip(layers, layersWidthsIdx):
+            keptIdx = [idx for idx in range(layer.nWidths()) if idx not in widthsIdx]
+            idxMaps.append({idx: (keptIdx.index(idx) if idx in keptIdx else None) for idx in range(layer.nWidths())})
+        currWidthIdx = self.currWidthIdx()
+
+        layersWidthsIdxDict = {layer: widthsIdx for layer, widthsIdx in zip(layers, layersWidthsIdx)}
+        for block in self.blocks:
+            block.removeLayersWidths(layersWidthsIdxDict)
+        self._removeAlphasWidths(layersWidthsIdx)
+        # layers width lists have been changed
+        self.clearPathsPlans()
+        self._tracedPaths.clear()
+
+        self._baselineWidth = {k: [idxMap[idx] for idxMap, idx in zip(idxMaps, idxList)] for k, idxList in self._baselineWidth.items()
+                               if all(idxMap[idx] is not None for idxMap, idx in zip(idxMaps, idxList))}
+        self.setCurrWidthIdx([0 if idxMap[idx] is None else idxMap[idx] for idxMap, idx in zip(idxMaps, currWidthIdx)])
+
+    # returns given path plan, might switch model to path
+    def _pathPlan(self, path) -> PathPlan:
+        plan = self._pathsPlans.get(Path(path)) if self._staticPaths else None
+        if plan is None:
+            self.setCurrWidthIdx(path)
+            plan = self._buildPathPlan()
+
+        return plan
+
+    # path derived data, cached for static paths
+    def pathWidth(self, path) -> list:
+        return self._pathPlan(path).width
+
+    def pathWidthRatio(self, path) -> list:
+        return self._pathPlan(path).widthRatio
+
+    def pathFlops(self, path):
+        return self._pathPlan(path).flops
+
     # build a dictionary where each key is width ratio and each value is the list of layer indices in order to set the key width ratio as current
     # width in each layer
     def buildHomogeneousWidthIdx(self, widthRatioList):
@@ -270,6 +649,12 @@ class BaseNet(Module):
     def calcBaselineFlops(self, restoreOrgStateFlag):
         return self.applyOnBaseline(self.countFlops, restoreOrgStateFlag)
 
+    def calcBaselineLatency(self, restoreOrgStateFlag):
+        return self.applyOnBaseline(self.countLatency, restoreOrgStateFlag)
+
+    def calcBaselineMemoryBytes(self, restoreOrgStateFlag):
+        return self.applyOnBaseline(self.memoryBytes, restoreOrgStateFlag)
+
     # apply some function on baseline model
     # baseline model are per layer width
     # this function create a map from baseline width to func() result on baseline model
@@ -302,6 +687,89 @@ class BaseNet(Module):
     def loadPreTrained(self, state_dict):
         self.load_state_dict(state_dict)
 
+    # replaces dense model (conv, bn) layers by conv, where bn has been folded into conv weights & bias, i.e. eval mode dense model
+    @staticmethod
+    def _foldDenseBNs(module: Module):
+        for name, child in module.named_children():
+            if isinstance(child, Sequential) and (len(child) == 2) and isinstance(child[0], Conv2d) and isinstance(child[1], BatchNorm2d):
+                setattr(module, name, fuse_conv_bn_eval(child[0], child[1]))
+            else:
+                BaseNet._foldDenseBNs(child)
+
+    # build standalone dense model of given path, where each layer is physically cut to its path width
+    # foldBNs folds BNs into conv layers, requires eval mode
+    def materializePath(self, widthIdxList: list, foldBNs: bool = False) -> Module:
+        # save model current width indices
+        modelCurrWidthIdx = self.currWidthIdx()
+        # switch path only if required, switching might generate new BNs, e.g. in binomial downsample
+        switchPathFlag = (modelCurrWidthIdx != list(widthIdxList))
+        # set model path
+        if switchPathFlag:
+            self.setCurrWidthIdx(widthIdxList)
+        # build dense model
+        denseModel = self._materialize()
+        denseModel.train(self.training)
+        if foldBNs:
+            assert (self.training is False)
+            self._foldDenseBNs(denseModel)
+        if self._memoryFormat is not None:
+            denseModel = denseModel.to(memory_format=self._memoryFormat)
+        # restore model layers current width
+        if switchPathFlag:
+            self.setCurrWidthIdx(modelCurrWidthIdx)
+
+        return denseModel
+
+    # traced paths hold a copy of the weights, which are stale once the weights have changed.
+    # weights are updated in training mode only, or by loading a state dict, therefore both invalidate traced paths.
+    # weights version isn't checked per forward, since walking over all parameters costs as much as the forward we save
+    def train(self, mode=True):
+        self._tracedPaths.clear()
+        return super(BaseNet, self).train(mode)
+
+    # state dict of pruned model removes the same widths from model, before layers load their BNs
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        self._tracedPaths.clear()
+        self._removeStateDictRemovedWidths(state_dict, prefix)
+        super(BaseNet, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _removeStateDictRemovedWidths(self, state_dict, prefix):
+        layersName = {module: name for name, module in self.named_modules()}
+        layersWidthsIdx = []
+        for layer in self._layers.optimization():
+            stateDictKeptWidthsIdx = layer.stateDictKeptWidthsIdx(state_dict, '{}{}.'.format(prefix, layersName[layer]))
+            keptWidthsIdx = layer.keptWidthsIdx()
+            layersWidthsIdx.append([] if stateDictKeptWidthsIdx is None else
+                                   [idx for idx, orgIdx in enumerate(keptWidthsIdx) if orgIdx not in stateDictKeptWidthsIdx])
+
+        if any(len(widthsIdx) > 0 for widthsIdx in layersWidthsIdx):
+            self.removeLayersWidths(layersWidthsIdx)
+
+    # forward x through traced BN folded dense model of current path
+    # falls back to model forward in training, since traced paths hold a copy of the weights
+    def tracedForward(self, x):
+        if self.training or is_grad_enabled() or (not self._tracedPaths.enabled()):
+            return self(x)
+
+        widthIdxList = self.currWidthIdx()
+        key = (tuple(widthIdxList), tuple(x.size()))
+        tracedModel = self._tracedPaths.get(key, lambda: self.materializePath(widthIdxList, foldBNs=True), x)
+        # update path layers forward counters, as if we have used model forward
+        for layer in self._layers.flops():
+            layer.updateForwardCounters()
+
+        return tracedModel(x)
+
+    def logTracedPaths(self, loggerFuncs):
+        if self._tracedPaths.enabled():
+            rows = self._tracedPaths.statsRows()
+            # apply loggers functions
+            for f in loggerFuncs:
+                f(rows)
+
+        # reset cache statistics
+        self._tracedPaths.resetStats()
+
     def saveAlphasCsv(self, data: list):
         self._alphas.saveCsv(self, data)
 
@@ -1,17 +1,64 @@
 from .BaseNet import BaseNet
 from ..ResNet18 import BasicBlock
 from models.modules.Alphas import Alphas
+from models.modules.PathSampler import PathSampler
 from models.modules.ConvSlimLayer import ConvSlimLayer, BatchNorm2d
+from utils.device import getDevice
 
-from torch import tensor, zeros, sigmoid, int32
+from collections import OrderedDict
+
+from numpy import stack, arange, unique, minimum, maximum, float64
+from numpy import round as roundArray
+from torch import tensor, zeros, sigmoid, int32, cat, where, searchsorted, minimum as torchMinimum, arange as torchArange, from_numpy as fromNumpy
 from torch import round as roundTensor
 from torch.distributions.binomial import Binomial
 
 
+# returns (widths, probs) of Binomial widths distribution on outputChannels filters, before rounding
+# probs are differentiable w.r.t. alphas
+def sampledWidthsProbs(outputChannels: int, alphas: tensor):
+    # Binomial distribution on n-1 layer filters (because we have to choose at least one filter)
+    dist = Binomial(outputChannels - 1, logits=alphas)
+    probs = dist.log_prob(torchArange(outputChannels, dtype=alphas.dtype, device=alphas.device)).exp()
+    return arange(1, outputChannels + 1), probs
+
+
+# returns (rounded widths, probs) of Binomial widths distribution on layer filters, where sampled widths are rounded by layer
+def roundedWidthsProbs(layer, alphas: tensor):
+    sampledWidths, probs = sampledWidthsProbs(layer.outputChannels(), alphas)
+    widths, widthsIdx = unique(layer.roundWidths(sampledWidths), return_inverse=True)
+    # sum probs of sampled widths rounded to the same width
+    widthsProbs = zeros(len(widths), dtype=probs.dtype, device=probs.device).index_add(0, fromNumpy(widthsIdx).to(probs.device), probs)
+    return widths, widthsProbs
+
+
+# returns (n x nVariables) Binomial draws on totalCount trials, by inverse CDF of given (n x nVariables) uniforms
+def binomialInverseCDF(totalCount: tensor, logits: tensor, uniforms: tensor):
+    nTrials = torchArange(int(totalCount.max().item()) + 1, dtype=logits.dtype, device=logits.device)
+    dist = Binomial(totalCount[:, None], logits=logits[:, None], validate_args=False)
+    # variables CDF over number of successes, padded with 1 beyond variable total count
+    probs = where(nTrials[None, :] <= totalCount[:, None], dist.log_prob(nTrials[None, :]).exp(), zeros(1, dtype=logits.dtype, device=logits.device))
+    cdf = probs.detach().cumsum(dim=-1)
+    successes = searchsorted(cdf, uniforms.t().contiguous().to(cdf.dtype), right=True)
+    return torchMinimum(successes, totalCount[:, None].long()).t()
+
+
 class BinomialConvSlimLayer(ConvSlimLayer):
+    # max number of generated BNs we keep per layer for reuse
+    _bnPoolMaxSize = 16
+    # default width granularity, sampled widths are rounded to multiples of granularity
+    # class attribute, since flopsWidthList() is used while counting flops in super().__init__()
+    _widthGranularity = 1
+
     def __init__(self, widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag):
         super(BinomialConvSlimLayer, self).__init__(widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag)
 
+        # init generated BNs pool, key is BN width
+        # pool BNs are not registered as layer modules, therefore they are not part of the state_dict
+        self._bnPool = OrderedDict()
+        # init width sampled from distribution, before rounding
+        self._sampledWidth = None
+
         # add additional BN for selected width
         self.bn.append(None)
         # add additional width & width ratio for selected width
@@ -24,11 +71,53 @@ class BinomialConvSlimLayer(ConvSlimLayer):
         self._widthRatioList[-1] = None
 
     def flopsWidthList(self):
-        return list(range(1, self.outputChannels() + 1))
+        _flopsWidthList = list(range(1, self.outputChannels() + 1))
+        if self._widthGranularity > 1:
+            # sampled widths are rounded, keep also layer widths, e.g. homogeneous & partition widths
+            _flopsWidthList = sorted(set([self.roundWidth(w) for w in _flopsWidthList] + [w for w in self._widthList if w is not None]))
+
+        return _flopsWidthList
+
+    # round width to a multiple of width granularity, in range [granularity, outputChannels]
+    def roundWidth(self, width):
+        k = self._widthGranularity
+        return min(max(k * round(width / k), k), self.outputChannels())
+
+    # vectorized roundWidth() of widths array
+    def roundWidths(self, widths):
+        k = self._widthGranularity
+        return minimum(maximum(k * roundArray(widths / k).astype(int), k), self.outputChannels())
+
+    # bounds the number of different widths, i.e. different conv shapes, we might sample
+    # must be applied before sampling, since layer widths are used as flops keys
+    def setWidthGranularity(self, widthGranularity: int):
+        self._widthGranularity = widthGranularity
+        # keep only flops of widths we might use
+        _flopsWidthList, _prevFlopsWidthList = set(self.flopsWidthList()), set(self.prevLayer().flopsWidthList())
+        self.setFlopsDict({(prevWidth, width): flops for (prevWidth, width), flops in self.flopsDict.items()
+                           if (prevWidth in _prevFlopsWidthList) and (width in _flopsWidthList)})
+
+    # returns BN for given width from pool, as if it has just been built
+    def _poolBN(self, width):
+        bn = self._bnPool.get(width)
+        if bn is None:
+            bn = BatchNorm2d(width).to(getDevice())
+            self._bnPool[width] = bn
+            # remove least recently used BN
+            if len(self._bnPool) > self._bnPoolMaxSize:
+                self._bnPool.popitem(last=False)
+        else:
+            # mark BN as most recently used
+            self._bnPool.move_to_end(width)
+            # reset BN parameters & statistics in place
+            bn.reset_parameters()
+            bn.train()
+
+        return bn
 
     # generate new BN for current width
     def generateWidthBN(self, width):
-        self.bn[len(self.bn) - 1] = BatchNorm2d(width).cuda()
+        self.bn[len(self.bn) - 1] = self._poolBN(width)
         self._widthList[-1] = width
         self._widthRatioList[-1] = width / self.outputChannels()
 
@@ -39,13 +128,22 @@ class BinomialConvSlimLayer(ConvSlimLayer):
         # build last BN in self.bn according to newWidth
         self.generateWidthBN(newWidth)
 
+    # set sampled width, rounded to width granularity, as new current layer width
+    def setSampledWidth(self, sampledWidth):
+        self._sampledWidth = sampledWidth
+        self.setCurrWidth(self.roundWidth(sampledWidth))
+
+    # returns width sampled from distribution, before rounding, i.e. the width alphas gradient is based on
+    def sampledWidth(self):
+        return self._sampledWidth
+
 
 class BinomialConvSlimLayerWithAlpha(BinomialConvSlimLayer):
     def __init__(self, widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag):
         super(BinomialConvSlimLayerWithAlpha, self).__init__(widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag)
 
         # init alphas
-        self._alphas = zeros(1).cuda().clone().detach().requires_grad_(True)
+        self._alphas = zeros(1).to(getDevice()).clone().detach().requires_grad_(True)
 
     # returns alphas value
     def alphas(self) -> tensor:
@@ -62,6 +160,11 @@ class BinomialConvSlimLayerWithAlpha(BinomialConvSlimLayer):
         width = 1 + dist.sample().type(int32).item()
         return width
 
+    # returns (widths, probs) arrays of widths distribution, before rounding
+    def sampledWidthsDistribution(self):
+        widths, probs = sampledWidthsProbs(self.outputChannels(), self._alphas)
+        return widths, probs.detach().cpu().numpy().astype(float64)
+
     def alphaWidthMean(self):
         return 1 + (self.probs() * (self.outputChannels() - 1))
 
@@ -70,13 +173,13 @@ class BinomialConvSlimLayerWithAlpha(BinomialConvSlimLayer):
         # sample width from the distribution
         newWidth = self._sampleWidthByAlphas()
         # set new width
-        self.setCurrWidth(newWidth)
+        self.setSampledWidth(newWidth)
 
     # choose layer width based on alpha mean value
     def chooseAlphaMean(self):
         newWidth = roundTensor(self.alphaWidthMean()).type(int32).item()
         # set new width
-        self.setCurrWidth(newWidth)
+        self.setSampledWidth(newWidth)
 
 
 class BasicBlock_Binomial(BasicBlock):
@@ -96,8 +199,25 @@ class BasicBlock_Binomial(BasicBlock):
 
 
 class BaseNet_Binomial(BaseNet):
+    # switching path generates new downsample BNs and layers widths are sampled,
+    # therefore width indices don't define the path, i.e. no traced paths & paths plans
+    _staticPaths = False
+    _widthGranularityKey = 'width_granularity'
+
     def __init__(self, args, initLayersParams):
         super(BaseNet_Binomial, self).__init__(args, initLayersParams)
+        # round sampled widths to multiples of width granularity
+        self.setWidthGranularity(getattr(args, self.widthGranularityKey(), 1))
+        # init variance reduced paths sampler, None if paths are drawn i.i.d.
+        self._pathSampler = PathSampler.build(args)
+
+    @staticmethod
+    def widthGranularityKey():
+        return BaseNet_Binomial._widthGranularityKey
+
+    def setWidthGranularity(self, widthGranularity: int):
+        for layer in self._layers.forwardCounters():
+            layer.setWidthGranularity(widthGranularity)
 
     # generic method to choose layer path
     def _choosePath(self, chooseLayerPathFunc):
@@ -109,12 +229,70 @@ class BaseNet_Binomial(BaseNet):
             block.updateCurrWidth()
 
     # choose alpha based on alphas distribution
-    def choosePathByAlphas(self):
+    def _choosePathByAlphas(self):
         def chooseLayerPathFunc(layer: BinomialConvSlimLayerWithAlpha):
             layer.choosePathByAlphas()
 
         self._choosePath(chooseLayerPathFunc)
 
+    # samples are layers sampled widths, before rounding
+    # single Binomial over all layers, each layer on its n-1 filters (because we have to choose at least one filter)
+    def _sampleAlphaPaths(self, n: int):
+        dist, _ = self._layersBinomial()
+        if self._pathSampler is None:
+            return 1 + dist.sample((n,)).long()
+
+        return 1 + binomialInverseCDF(dist.total_count, dist.logits, self._pathSampler.uniforms(n, len(dist.logits), dist.logits.device))
+
+    # returns layers (Binomial distributions, alphas mean width), Binomial on n-1 layer filters (because we have to choose at least one filter)
+    def _layersBinomial(self):
+        layers = self._layers.optimization()
+        logits = cat([layer.alphas() for layer in layers]).detach()
+        totalCount = tensor([layer.outputChannels() - 1 for layer in layers], dtype=logits.dtype, device=logits.device)
+        return Binomial(totalCount, logits=logits), 1 + (totalCount * sigmoid(logits))
+
+    def samplesLogProb(self, samples):
+        dist, _ = self._layersBinomial()
+        return dist.log_prob((samples - 1).to(dist.logits.device, dist.logits.dtype)).sum(dim=-1)
+
+    # layer score is sampled width - alpha mean width
+    def samplesScores(self, samples):
+        _, mean = self._layersBinomial()
+        return samples.to(mean.device, mean.dtype) - mean
+
+    def samplesToWidths(self, samples):
+        return stack([layer.roundWidths(samples[:, i]) for i, layer in enumerate(self._layers.optimization())], axis=-1)
+
+    # samples are layers rounded widths
+    def layersSampleValues(self):
+        layersSampleValues = []
+        for layer in self._layers.optimization():
+            widths = unique(layer.roundWidths(arange(1, layer.outputChannels() + 1)))
+            layersSampleValues.append((widths, widths))
+
+        return layersSampleValues
+
+    def setSamplePath(self, sample):
+        for layer, sampledWidth in zip(self._layers.optimization(), self._sampleList(sample)):
+            layer.setSampledWidth(sampledWidth)
+
+        # update curr width changes in each block
+        for block in self.blocks:
+            block.updateCurrWidth()
+
+    # each layer is a width variable
+    def widthsVariables(self):
+        variables = [roundedWidthsProbs(layer, layer.alphas()) for layer in self._layers.optimization()]
+        return list(range(len(variables))), variables
+
+    def layersSamplesDistribution(self):
+        distribution = []
+        for layer in self._layers.optimization():
+            sampledWidths, probs = layer.sampledWidthsDistribution()
+            distribution.append((sampledWidths, layer.roundWidths(sampledWidths), probs))
+
+        return distribution
+
     # select maximal alpha in each layer
     def choosePathAlphasAsPartition(self):
         def chooseLayerPathFunc(layer: BinomialConvSlimLayerWithAlpha):
@@ -1,9 +1,12 @@
 from .BaseNet import BaseNet
 from ..ResNet18 import BasicBlock, ConvSlimLayer
 from models.modules.Alphas import Alphas
+from utils.device import getDevice
 
+from numpy import arange, asarray, float64, inf
 from torch import tensor, zeros
 from torch.nn.functional import softmax
+from torch.nn.utils.rnn import pad_sequence
 from torch.distributions.categorical import Categorical
 
 
@@ -12,7 +15,7 @@ class ConvSlimLayerWithAlphas(ConvSlimLayer):
         super(ConvSlimLayerWithAlphas, self).__init__(widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag)
 
         # init alphas
-        self._alphas = zeros(self.nWidths()).cuda().clone().detach().requires_grad_(True)
+        self._alphas = zeros(self.nWidths()).to(getDevice()).clone().detach().requires_grad_(True)
 
     def flopsWidthList(self):
         return self.widthList()
@@ -35,6 +38,13 @@ class ConvSlimLayerWithAlphas(ConvSlimLayer):
     def chooseAlphaMax(self):
         self._currWidthIdx = self._alphas.argmax().item()
 
+    # alphas are pruned in place, i.e. optimizer & model alphas list keep the same tensor
+    def removeWidths(self, widthsIdx: list):
+        keptIdx = [idx for idx in range(self.nWidths()) if idx not in widthsIdx]
+        super(ConvSlimLayerWithAlphas, self).removeWidths(widthsIdx)
+        self._alphas.data = self._alphas.data[keptIdx]
+        self._alphas.grad = None
+
 
 class BasicBlock_Categorical(BasicBlock):
     def __init__(self, widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag):
@@ -53,7 +63,7 @@ class BaseNet_Categorical(BaseNet):
         super(BaseNet_Categorical, self).__init__(args, initLayersParams)
 
     # choose alpha based on alphas distribution
-    def choosePathByAlphas(self):
+    def _choosePathByAlphas(self):
         for layer in self._layers.optimization():
             layer.choosePathByAlphas()
 
@@ -70,6 +80,30 @@ class BaseNet_Categorical(BaseNet):
         for block in self.blocks:
             block.updateCurrWidth()
 
+    # samples are layers width indices
+    # layers alphas are padded to the same number of widths, padded widths have zero probability
+    def _sampleAlphaPaths(self, n: int):
+        logits = pad_sequence([layer.alphas() for layer in self._layers.optimization()], batch_first=True, padding_value=-inf)
+        return Categorical(logits=logits).sample((n,))
+
+    # layer maximal alpha width is never removed
+    def negligibleWidths(self, threshold: float):
+        layersWidthsIdx = []
+        for layer in self._layers.optimization():
+            probs = layer.probs()
+            layersWidthsIdx.append([idx for idx, p in enumerate(probs.tolist()) if (p < threshold) and (idx != probs.argmax().item())])
+
+        return layersWidthsIdx
+
+    def layersSamplesDistribution(self):
+        return [(arange(layer.nWidths()), asarray(layer.widthList()), layer.probs().cpu().numpy().astype(float64))
+                for layer in self._layers.optimization()]
+
+    # each layer is a width variable
+    def widthsVariables(self):
+        variables = [(asarray(layer.widthList()), softmax(layer.alphas(), dim=-1)) for layer in self._layers.optimization()]
+        return list(range(len(variables))), variables
+
     def restoreOriginalStateDictStructure(self):
         pass
 
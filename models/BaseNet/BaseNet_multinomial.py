@@ -1,9 +1,10 @@
 from .BaseNet import BaseNet
 from ..ResNet18 import BasicBlock, ConvSlimLayer
 from models.modules.Alphas import Alphas
+from utils.device import getDevice
 
-from torch import tensor, zeros, int32
-from torch.nn.functional import softmax
+from torch import tensor, zeros, int32, arange as torchArange
+from torch.nn.functional import softmax, one_hot
 from torch.distributions.multinomial import Multinomial
 
 
@@ -46,7 +47,7 @@ class BaseNet_Multinomial(BaseNet):
         self.setCurrWidthIdx(idxList)
 
     # choose alpha based on alphas distribution
-    def choosePathByAlphas(self):
+    def _choosePathByAlphas(self):
         alphas = self.alphas()[0]
         # draw partition from multinomial distribution
         dist = Multinomial(total_count=self.nLayers(), logits=alphas)
@@ -54,6 +55,42 @@ class BaseNet_Multinomial(BaseNet):
         # set partition as model path
         self._setPartitionPath(partition)
 
+    # samples are layers width indices, i.e. partitions converted to width indices
+    def _sampleAlphaPaths(self, n: int):
+        alphas = self.alphas()[0]
+        dist = Multinomial(total_count=self.nLayers(), logits=alphas)
+        partitions = dist.sample((n,))
+        # layer i width index is the number of widths whose partition cumulative sum is <= i
+        layersIdx = torchArange(self.nLayers(), device=partitions.device)
+        return (partitions.cumsum(dim=-1)[:, :, None] <= layersIdx[None, None, :]).sum(dim=1)
+
+    # converts layers width indices to partitions, i.e. number of layers per width
+    def _samplesPartition(self, samples):
+        alphas = self.alphas()[0]
+        return one_hot(samples.to(alphas.device).long(), len(alphas)).sum(dim=1).to(alphas.dtype)
+
+    def samplesLogProb(self, samples):
+        dist = Multinomial(total_count=self.nLayers(), logits=self.alphas()[0].detach())
+        return dist.log_prob(self._samplesPartition(samples))
+
+    # width score is number of layers of width - expected number of layers of width
+    def samplesScores(self, samples):
+        return self._samplesPartition(samples) - (self.nLayers() * self.probs())
+
+    # model alphas widths are removed from all layers, maximal alpha width is never removed
+    def negligibleWidths(self, threshold: float):
+        probs = self.probs()
+        widthsIdx = [idx for idx, p in enumerate(probs.tolist()) if (p < threshold) and (idx != probs.argmax().item())]
+        return [widthsIdx] * self.nLayers()
+
+    # alphas are pruned in place, i.e. optimizer keeps the same tensor
+    def _removeAlphasWidths(self, layersWidthsIdx: list):
+        alphas = self.alphas()[0]
+        widthsIdx = layersWidthsIdx[0]
+        assert all(layerWidthsIdx == widthsIdx for layerWidthsIdx in layersWidthsIdx)
+        alphas.data = alphas.data[[idx for idx in range(len(alphas)) if idx not in widthsIdx]]
+        alphas.grad = None
+
     # choose partition based on alphas probs as partition
     def choosePathAlphasAsPartition(self):
         probs = self.probs()
@@ -79,7 +116,7 @@ class AlphasPerModel(Alphas):
 
     def buildAlphas(self, model: BaseNet_Multinomial):
         nWidths = len(model.layersList()[0].widthList())
-        return [zeros(nWidths).cuda().clone().detach().requires_grad_(True)]
+        return [zeros(nWidths).to(getDevice()).clone().detach().requires_grad_(True)]
 
     def initColumns(self, model: BaseNet_Multinomial):
         return [self._alphasKey]
@@ -1,8 +1,11 @@
 from .BaseNet import BaseNet
-from .BaseNet_binomial import ConvSlimLayer, BinomialConvSlimLayer, BasicBlock
+from .BaseNet_binomial import ConvSlimLayer, BinomialConvSlimLayer, BasicBlock, BaseNet_Binomial, roundedWidthsProbs, binomialInverseCDF
 from models.modules.Alphas import Alphas
+from models.modules.PathSampler import PathSampler
+from utils.device import getDevice
 
-from torch import zeros, sigmoid, int32, tensor
+from numpy import stack, arange, unique
+from torch import zeros, sigmoid, int32, tensor, cat
 from torch.distributions.binomial import Binomial
 
 
@@ -26,8 +29,20 @@ class BasicBlock_WidthBlock_Binomial(BasicBlock):
 
 
 class BaseNet_WidthBlock_Binomial(BaseNet):
+    # switching path generates new downsample BNs and layers widths are sampled,
+    # therefore width indices don't define the path, i.e. no traced paths & paths plans
+    _staticPaths = False
+
     def __init__(self, args, initLayersParams):
         super(BaseNet_WidthBlock_Binomial, self).__init__(args, initLayersParams)
+        # round sampled widths to multiples of width granularity
+        self.setWidthGranularity(getattr(args, BaseNet_Binomial.widthGranularityKey(), 1))
+        # init variance reduced paths sampler, None if paths are drawn i.i.d.
+        self._pathSampler = PathSampler.build(args)
+
+    def setWidthGranularity(self, widthGranularity: int):
+        for layer in self._layers.forwardCounters():
+            layer.setWidthGranularity(widthGranularity)
 
     def alphasDict(self):
         return self._alphas.alphasDict()
@@ -38,14 +53,14 @@ class BaseNet_WidthBlock_Binomial(BaseNet):
             newWidth = calcNewWidthFunc(width, alphaWidth)
             # apply new width to layers
             for layer in alphaWidth.layersList():
-                layer.setCurrWidth(newWidth)
+                layer.setSampledWidth(newWidth)
 
         # update curr width changes in each block
         for block in self.blocks:
             block.updateCurrWidth()
 
     # choose alpha based on alphas distribution
-    def choosePathByAlphas(self):
+    def _choosePathByAlphas(self):
         def calcNewWidthFunc(width: int, alphaWidth: AlphaPerWidthBlock.AlphaWidth):
             # define Binomial distribution on n-1 layer filters (because we have to choose at least one filter)
             dist = Binomial(width - 1, logits=alphaWidth.tensor())
@@ -54,6 +69,73 @@ class BaseNet_WidthBlock_Binomial(BaseNet):
 
         self._choosePath(calcNewWidthFunc)
 
+    # samples are layers sampled widths, before rounding, layers in the same WidthBlock share their sample
+    # single Binomial over all WidthBlocks, each WidthBlock on its n-1 filters (because we have to choose at least one filter)
+    def _sampleAlphaPaths(self, n: int):
+        dist, _, _ = self._blocksBinomial()
+        # layers WidthBlock index
+        layersBlockIdx = [None] * self.nLayers()
+        for blockIdx, alphaWidth in enumerate(self.alphasDict().values()):
+            for layerIdx in alphaWidth.layersIdxList():
+                layersBlockIdx[layerIdx] = blockIdx
+
+        if self._pathSampler is None:
+            samples = 1 + dist.sample((n,)).long()
+        else:
+            samples = 1 + binomialInverseCDF(dist.total_count, dist.logits, self._pathSampler.uniforms(n, len(dist.logits), dist.logits.device))
+
+        return samples[:, tensor(layersBlockIdx, device=samples.device)]
+
+    # returns (WidthBlocks Binomial distributions, alphas mean width, WidthBlocks 1st layer index)
+    def _blocksBinomial(self):
+        alphasDict = self.alphasDict()
+        logits = cat([alphaWidth.tensor() for alphaWidth in alphasDict.values()]).detach()
+        totalCount = tensor([width - 1 for width in alphasDict.keys()], dtype=logits.dtype, device=logits.device)
+        layersIdx = [alphaWidth.layersIdxList()[0] for alphaWidth in alphasDict.values()]
+        return Binomial(totalCount, logits=logits), 1 + (totalCount * sigmoid(logits)), layersIdx
+
+    # WidthBlock layers share their sample, therefore sample probability is WidthBlocks samples probability
+    def samplesLogProb(self, samples):
+        dist, _, layersIdx = self._blocksBinomial()
+        return dist.log_prob((samples[:, layersIdx] - 1).to(dist.logits.device, dist.logits.dtype)).sum(dim=-1)
+
+    # WidthBlock score is sampled width - alpha mean width
+    def samplesScores(self, samples):
+        _, mean, layersIdx = self._blocksBinomial()
+        return samples[:, layersIdx].to(mean.device, mean.dtype) - mean
+
+    def samplesToWidths(self, samples):
+        return stack([layer.roundWidths(samples[:, i]) for i, layer in enumerate(self._layers.optimization())], axis=-1)
+
+    # samples are layers rounded widths
+    def layersSampleValues(self):
+        layersSampleValues = []
+        for layer in self._layers.optimization():
+            widths = unique(layer.roundWidths(arange(1, layer.outputChannels() + 1)))
+            layersSampleValues.append((widths, widths))
+
+        return layersSampleValues
+
+    # each WidthBlock is a width variable
+    def widthsVariables(self):
+        layersVariable = [None] * self.nLayers()
+        variables = []
+        for alphaWidth in self.alphasDict().values():
+            for layerIdx in alphaWidth.layersIdxList():
+                layersVariable[layerIdx] = len(variables)
+            # WidthBlock layers have the same number of filters & width granularity
+            variables.append(roundedWidthsProbs(alphaWidth.layersList()[0], alphaWidth.tensor()))
+
+        return layersVariable, variables
+
+    def setSamplePath(self, sample):
+        for layer, sampledWidth in zip(self._layers.optimization(), self._sampleList(sample)):
+            layer.setSampledWidth(sampledWidth)
+
+        # update curr width changes in each block
+        for block in self.blocks:
+            block.updateCurrWidth()
+
     # choose partition based on alphas probs as partition
     def choosePathAlphasAsPartition(self):
         def calcNewWidthFunc(width: int, alphaWidth: AlphaPerWidthBlock.AlphaWidth):
@@ -117,7 +199,7 @@ class AlphaPerWidthBlock(Alphas):
         for layerIdx, layer in enumerate(model.layersList()):
             width = layer.outputChannels()
             if width not in _alphasDict:
-                _tensor = zeros(1).cuda().clone().detach().requires_grad_(True)
+                _tensor = zeros(1).to(getDevice()).clone().detach().requires_grad_(True)
                 _alphas.append(_tensor)
                 _alphasDict[width] = self.AlphaWidth(_tensor)
 
@@ -1,10 +1,18 @@
 from abc import abstractmethod
+from math import floor
 
-from torch.nn import ModuleList, ReLU, Linear, AvgPool2d, MaxPool2d
+from numpy import where
+from torch.nn import Module, ModuleList, Sequential, Conv2d, BatchNorm2d, ReLU, Linear, AvgPool2d, MaxPool2d
 from torch.nn.functional import linear
 
 from models.modules.block import Block
+from models.modules.SlimLayer import SlimLayer
 from models.modules.ConvSlimLayer import ConvSlimLayer
+from utils.device import getDevice, toMemoryFormat
+
+
+# ResNet18 blocks out_planes, 1st block is a single conv layer, ImageNet blocks have 4 times out_planes
+blocksOutPlanes = [16, 16, 16, 16, 32, 32, 32, 64, 64, 64]
 
 
 class Input:
@@ -48,6 +56,11 @@ class Downsample(Block):
     def initResidual(self):
         raise NotImplementedError('subclasses must override initResidual()!')
 
+    @abstractmethod
+    # returns bool array, does each path use downsample, given widths arrays of downsampleSrc previous layer & conv2
+    def pathsUseDownsample(self, prevWidths, conv2Widths):
+        raise NotImplementedError('subclasses must override pathsUseDownsample()!')
+
     def downsample(self):
         return self._downsample[0]
 
@@ -61,6 +74,16 @@ class Downsample(Block):
     def getCountersLayers(self):
         return [self._downsampleSrc]
 
+    def getSwitchUnits(self):
+        return [self._downsampleSrc, self]
+
+    def pathsFlops(self, widths: dict):
+        # downsampleSrc width is conv2 width
+        prevWidths = SlimLayer.layerWidths(self._downsampleSrc.prevLayer(), widths)
+        conv2Widths = SlimLayer.layerWidths(self.conv2[0], widths)
+        # paths without downsample might have no flops entry, i.e. nan
+        return where(self.pathsUseDownsample(prevWidths, conv2Widths), self._downsampleSrc.flopsTable()[prevWidths, conv2Widths], 0)
+
     def outputLayer(self):
         return self
 
@@ -79,6 +102,25 @@ class Downsample(Block):
     def generatePathBNs(self, srcLayer):
         self._downsampleSrc.generatePathBNs(srcLayer)
 
+    # downsampleSrc width index follows conv2 width index, therefore it removes conv2 removed widths
+    def removeWidths(self, widthsIdx: list):
+        self._downsampleSrc.removeWidths(widthsIdx)
+
+    # downsample path state, i.e. updateCurrWidth() decisions
+    # downsampleSrc width index is part of its own state, since it is a counters layer
+    def switchState(self):
+        return self._downsample[0], self.residualFunc
+
+    def setSwitchState(self, state):
+        self._downsample[0], residualFunc = state
+        # bypass Module.__setattr__ modules & parameters lookup, residualFunc is a plain attribute
+        object.__setattr__(self, 'residualFunc', residualFunc)
+
+    # returns None if current path doesn't use downsample
+    def materialize(self):
+        _downsample = self.downsample()
+        return None if _downsample is None else _downsample.materialize()
+
 
 # downsample for block where downsample is always required, even for the same width
 class PermanentDownsample(Downsample):
@@ -91,6 +133,9 @@ class PermanentDownsample(Downsample):
     def initResidual(self):
         return self.downsampleResidual
 
+    def pathsUseDownsample(self, prevWidths, conv2Widths):
+        return True
+
     def updateCurrWidth(self):
         _downsample = self.downsample()
         _conv2 = self.conv2[0]
@@ -109,6 +154,9 @@ class TempDownsample(Downsample):
     def initResidual(self):
         return self.standardResidual
 
+    def pathsUseDownsample(self, prevWidths, conv2Widths):
+        return prevWidths != conv2Widths
+
     def updateCurrWidth(self):
         _prevLayer = self._downsampleSrc.prevLayer()
         _conv2 = self.conv2[0]
@@ -191,18 +239,127 @@ class BasicBlock(Block):
     def getCountersLayers(self):
         return [self.conv1] + self.downsample.getCountersLayers() + [self.conv2]
 
+    def getSwitchUnits(self):
+        return [self.conv1] + self.downsample.getSwitchUnits() + [self.conv2]
+
     def outputLayer(self):
         return self.conv2
 
     def countFlops(self):
         return sum([layer.countFlops() for layer in self.getFlopsLayers()])
 
+    def countLatency(self):
+        return sum([layer.countLatency() for layer in self.getFlopsLayers()])
+
+    def countMemory(self):
+        conv1ParamsBytes, inputBytes, conv1Bytes = self.conv1.layerMemory()
+        conv2ParamsBytes, _, conv2Bytes = self.conv2.layerMemory()
+        paramsBytes = conv1ParamsBytes + conv2ParamsBytes
+        # block input is kept for residual through conv1 & conv2
+        peakBytes = inputBytes + conv1Bytes + conv2Bytes
+        _downsample = self.downsample.downsample()
+        if _downsample is not None:
+            downsampleParamsBytes, _, downsampleBytes = _downsample.layerMemory()
+            paramsBytes += downsampleParamsBytes
+            # downsample runs after conv2, i.e. conv1 output has been released
+            peakBytes = max(peakBytes, inputBytes + conv2Bytes + downsampleBytes)
+
+        return paramsBytes, peakBytes
+
+    def pathsFlops(self, widths: dict):
+        return self.conv1.pathsFlops(widths) + self.downsample.pathsFlops(widths) + self.conv2.pathsFlops(widths)
+
+    def removeLayersWidths(self, layersWidthsIdx: dict):
+        super(BasicBlock, self).removeLayersWidths(layersWidthsIdx)
+        self.downsample.removeWidths(layersWidthsIdx[self.conv2])
+
     def generatePathBNs(self, srcLayer):
         self.conv1.generatePathBNs(srcLayer)
         if srcLayer != self.conv2:
             self.downsample.generatePathBNs(srcLayer)
             self.conv2.generatePathBNs(srcLayer)
 
+    def materialize(self):
+        return DenseBasicBlock(self.conv1.materialize(), self.conv2.materialize(), self.downsample.materialize())
+
+
+# BasicBlock of a single path, without slimmable layers
+class DenseBasicBlock(Module):
+    def __init__(self, conv1, conv2, downsample):
+        super(DenseBasicBlock, self).__init__()
+
+        self.conv1 = conv1
+        self.relu1 = ReLU(inplace=True)
+        self.conv2 = conv2
+        self.relu2 = ReLU(inplace=True)
+        self.downsample = downsample
+
+    def forward(self, x):
+        out = self.conv1(x)
+        out = self.relu1(out)
+        out = self.conv2(out)
+        out += x if self.downsample is None else self.downsample(x)
+        out = self.relu2(out)
+
+        return out
+
+
+# ResNet18 of a single path, i.e. standalone network we can deploy
+class DenseResNet18(Module):
+    def __init__(self, blocks, maxpool, avgpool, fc, widthList):
+        super(DenseResNet18, self).__init__()
+
+        self.blocks = blocks
+        # maxpool after 1st block, None if model has no maxpool
+        self.maxpool = maxpool
+        self.avgpool = avgpool
+        self.fc = fc
+        # save path layers width, for logging purposes
+        self.widthList = widthList
+
+    def forward(self, x):
+        out = self.blocks[0](x)
+        if self.maxpool is not None:
+            out = self.maxpool(out)
+
+        for block in self.blocks[1:]:
+            out = block(out)
+
+        out = self.avgpool(out)
+        out = out.view(out.size(0), -1)
+        out = self.fc(out)
+
+        return out
+
+
+# builds DenseResNet18 of path layers widths alone, i.e. without the slimmable model, e.g. in order to load a dense checkpoint.
+# widthList is path optimization layers widths, i.e. 1st conv width followed by blocks (conv1, conv2) widths.
+# fc in_features is given, since it depends on avgpool output size as well, i.e. on input size.
+# layers follow ResNet18_Cifar & ResNet18_Imagenet materialized paths, weights are left initialized
+def buildDenseResNet18(widthList: list, imagenet: bool, fcInFeatures: int, nClasses: int) -> DenseResNet18:
+    def convBN(in_planes, out_planes, kernel_size, stride):
+        return Sequential(Conv2d(in_planes, out_planes, kernel_size, stride=stride, padding=floor(kernel_size / 2), bias=False),
+                          BatchNorm2d(out_planes))
+
+    planesFactor, kernel_size, stride = (4, 7, 2) if imagenet else (1, 3, 1)
+    widths = iter(widthList)
+    width = next(widths)
+    blocks = ModuleList([convBN(3, width, kernel_size, stride)])
+    in_planes = blocksOutPlanes[0] * planesFactor
+    for out_planes in blocksOutPlanes[1:]:
+        out_planes *= planesFactor
+        stride1 = 1 if in_planes == out_planes else 2
+        conv1Width, conv2Width = next(widths), next(widths)
+        # downsample is permanent when out_planes change, otherwise it is used only when block input & output widths differ
+        downsample = convBN(width, conv2Width, 1, stride1) if (in_planes != out_planes) or (width != conv2Width) else None
+        blocks.append(DenseBasicBlock(convBN(width, conv1Width, 3, stride1), convBN(conv1Width, conv2Width, 3, 1), downsample))
+        width, in_planes = conv2Width, out_planes
+
+    maxpool = MaxPool2d(kernel_size=3, stride=2, padding=1) if imagenet else None
+    avgpool = AvgPool2d(7 if imagenet else 8)
+
+    return DenseResNet18(blocks, maxpool, avgpool, Linear(fcInFeatures, nClasses), list(widthList))
+
 
 def ResNet18(BaseNet, BasicBlockClass):
     class ResNet18(BaseNet):
@@ -212,9 +369,7 @@ def ResNet18(BaseNet, BasicBlockClass):
         # init layers (type, out_planes)
         def initBlocksPlanes(self):
             # return blocks
-            return [(BasicBlockClass.ConvSlimLayer(), 16), (BasicBlockClass, 16), (BasicBlockClass, 16), (BasicBlockClass, 16),
-                    (BasicBlockClass, 32), (BasicBlockClass, 32), (BasicBlockClass, 32),
-                    (BasicBlockClass, 64), (BasicBlockClass, 64), (BasicBlockClass, 64)]
+            return [(BasicBlockClass.ConvSlimLayer(), blocksOutPlanes[0])] + [(BasicBlockClass, out_planes) for out_planes in blocksOutPlanes[1:]]
 
         @staticmethod
         def nPartitionBlocks():
@@ -232,11 +387,30 @@ def ResNet18(BaseNet, BasicBlockClass):
         def generatePathBNs(self, srcLayer: ConvSlimLayer):
             for block in self.blocks:
                 block.generatePathBNs(srcLayer)
+            # layers width lists have been changed
+            self.clearPathsPlans()
 
         # restore layers original BNs
         def restoreOriginalBNs(self):
             for layer in self._layers.forwardCounters():
                 layer.restoreOriginalBNs()
+            # layers width lists have been changed
+            self.clearPathsPlans()
+
+        # build dense fc, narrowed according to last conv2d layer
+        def _materializeFc(self, block):
+            in_features = int(self.fc.in_features * block.outputLayer().currWidthRatio())
+            fc = Linear(in_features, self.fc.out_features)
+            fc.weight.data.copy_(self.fc.weight.narrow(1, 0, in_features))
+            fc.bias.data.copy_(self.fc.bias)
+
+            return fc.to(self.fc.weight.device)
+
+        def _materializeModel(self, maxpool):
+            blocks = ModuleList([block.materialize() for block in self.blocks])
+            fc = self._materializeFc(self.blocks[-1])
+
+            return DenseResNet18(blocks, maxpool, AvgPool2d(self.avgpool.kernel_size), fc, self.currWidth())
 
     return ResNet18
 
@@ -269,15 +443,19 @@ def ResNet18_Cifar(BaseClass):
                 prevLayer = l.outputLayer()
 
             self.avgpool = AvgPool2d(8)
-            self.fc = Linear(64, nClasses).cuda()
+            self.fc = Linear(64, nClasses).to(getDevice())
 
             return blocks
 
         def additionalLayersToLog(self):
             return [self.avgpool, self.fc]
 
+        def _materialize(self):
+            return self._materializeModel(maxpool=None)
+
         def forward(self, x):
-            out = x
+            # convert input once, blocks keep the memory format through the whole forward
+            out = toMemoryFormat(x, self._memoryFormat)
             for block in self.blocks:
                 out = block(out)
 
@@ -333,15 +511,20 @@ def ResNet18_Imagenet(BaseClass):
 
             self.maxpool = MaxPool2d(kernel_size=kernel_size, stride=2, padding=1)
             self.avgpool = AvgPool2d(7)
-            self.fc = Linear(1024, nClasses).cuda()
+            self.fc = Linear(1024, nClasses).to(getDevice())
 
             return blocks
 
         def additionalLayersToLog(self):
             return [self.maxpool, self.avgpool, self.fc]
 
+        def _materialize(self):
+            maxpool = MaxPool2d(kernel_size=self.maxpool.kernel_size, stride=self.maxpool.stride, padding=self.maxpool.padding)
+            return self._materializeModel(maxpool)
+
         def forward(self, x):
-            out = x
+            # convert input once, blocks keep the memory format through the whole forward
+            out = toMemoryFormat(x, self._memoryFormat)
 
             block = self.blocks[0]
             out = block(out)
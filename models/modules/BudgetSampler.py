@@ -0,0 +1,241 @@
+from math import log
+
+from numpy import array, arange, zeros, floor, prod, meshgrid, stack, repeat, tile, flatnonzero, bincount, where, maximum, concatenate, int64
+from torch import from_numpy as fromNumpy
+from numpy.random import choice
+
+
+# draws paths from model alphas distribution, conditioned on path flops <= flops budget
+class BudgetSampler:
+    _budgetSamplerKey = 'budget_sampler'
+    _flopsBudgetKey = 'flops_budget'
+    _noneKey = 'none'
+    _rejectionKey = 'rejection'
+    _dpKey = 'dp'
+    # number of paths drawn together in rejection sampling
+    _rejectionBatchSize = 256
+    # max number of rejection batches, budget is considered infeasible under current alphas if no path is accepted
+    _maxRejectionBatches = 40
+    # number of flops buckets in budget, dp rounds blocks flops down to buckets, therefore dp tables contain every path under budget,
+    # and dp paths over budget are rejected against their exact flops
+    _nBuckets = 64
+    # max number of dp draws per path, before falling back to rejection sampling
+    _maxDPDraws = 100
+    # max dp block table size, i.e. (previous block output values x block combinations x flops buckets),
+    # e.g. ImageNet widths blocks tables are too large, therefore their models fall back to rejection sampling
+    _maxDPTableSize = 2 ** 25
+    # number of paths drawn together in estimating the conditional distribution moments
+    _momentsBatchSize = 4096
+
+    def __init__(self, model, method: str, budget: float):
+        self._model = model
+        self._budget = budget
+        # dp requires independent layers distributions & bounded tables size, other models fall back to rejection sampling
+        if method == self._dpKey:
+            distribution = model.layersSamplesDistribution()
+            if distribution is None:
+                print('*** WARNING: [{}] requires independent layers distributions, falling back to [{}]'.format(self._dpKey, self._rejectionKey))
+                method = self._rejectionKey
+            elif self._maxTableSize(distribution) > self._maxDPTableSize:
+                print('*** WARNING: [{}] table size exceeds [{}], falling back to [{}]'.format(self._dpKey, self._maxDPTableSize, self._rejectionKey))
+                method = self._rejectionKey
+        self._method = method
+        # dp tables of the distribution they have been built for, dp tables are rebuilt only when distribution changes
+        self._dpTablesKey = None
+        self._dpTables = None
+
+    @staticmethod
+    def budgetSamplerKey():
+        return BudgetSampler._budgetSamplerKey
+
+    @staticmethod
+    def flopsBudgetKey():
+        return BudgetSampler._flopsBudgetKey
+
+    @staticmethod
+    def noneKey():
+        return BudgetSampler._noneKey
+
+    @staticmethod
+    def methodChoices():
+        return [BudgetSampler._noneKey, BudgetSampler._rejectionKey, BudgetSampler._dpKey]
+
+    # returns model budget sampler, None if args don't define one
+    # flops budget is given as ratio of model baseline flops
+    @staticmethod
+    def build(model, args):
+        method = getattr(args, BudgetSampler._budgetSamplerKey, BudgetSampler._noneKey)
+        if method == BudgetSampler._noneKey:
+            return None
+
+        return BudgetSampler(model, method, getattr(args, BudgetSampler._flopsBudgetKey) * model.baselineFlops)
+
+    def method(self):
+        return self._method
+
+    def budget(self):
+        return self._budget
+
+    # draw path under budget & set it as model path
+    def choosePath(self):
+        sample = self._sampleDP() if self._method == self._dpKey else self._sampleRejection(1)[0]
+        self._model.setSamplePath(sample)
+
+    # draw n paths under budget, returns (n x nLayers) int tensor of layers samples
+    def samplePaths(self, n: int):
+        if self._method == self._dpKey:
+            samples = stack([self._sampleDP() for _ in range(n)])
+        else:
+            samples = self._sampleRejection(n)
+
+        return fromNumpy(samples.astype(int64))
+
+    # exact, samples are independent, therefore samples under budget are drawn from the conditional distribution
+    # returns (n x nLayers) array, less than n samples if budget is (almost) infeasible under current alphas
+    def _sampleRejection(self, n: int):
+        accepted = []
+        nAccepted = 0
+        for _ in range(self._maxRejectionBatches):
+            samples = self._model.drawAlphasSamples(max(self._rejectionBatchSize, n))
+            flops = self._model.pathsFlops(self._model.samplesToWidths(samples))
+            underBudget = flatnonzero(flops <= self._budget)[:n - nAccepted]
+            accepted.append(samples[underBudget])
+            nAccepted += len(underBudget)
+            if nAccepted >= n:
+                return concatenate(accepted)
+
+        # budget is (almost) infeasible under current alphas
+        if nAccepted == 0:
+            raise ValueError('flops budget [{:.4e}] is infeasible under current alphas, no path out of [{}] drawn paths is under budget'
+                             .format(self._budget, self._maxRejectionBatches * max(self._rejectionBatchSize, n)))
+
+        print('*** WARNING: flops budget [{:.4e}] is almost infeasible under current alphas, drew [{}] paths out of [{}]'
+              .format(self._budget, nAccepted, n))
+        return concatenate(accepted)
+
+    # estimates the conditional distribution q(x) = p(x) * 1[flops(x) <= budget] / Z moments, from paths drawn from alphas distribution p(x)
+    # returns (E_q[score], log Z), where score is p(x) log probability derivative w.r.t. alphas, None if model doesn't define samples score.
+    # q score is score - E_q[score], i.e. p scores aren't centred under q, and q log probability is p log probability - log Z.
+    # drawn paths are independent of the paths we evaluate, therefore centring their scores by E_q[score] estimate keeps the gradient unbiased
+    def conditionalMoments(self):
+        underBudget = []
+        nDrawn = 0
+        for _ in range(self._maxRejectionBatches):
+            samples = self._model.drawAlphasSamples(self._momentsBatchSize)
+            flops = self._model.pathsFlops(self._model.samplesToWidths(samples))
+            underBudget.append(samples[flatnonzero(flops <= self._budget)])
+            nDrawn += len(samples)
+            if len(underBudget[-1]) > 0:
+                break
+
+        underBudget = concatenate(underBudget)
+        if len(underBudget) == 0:
+            raise ValueError('flops budget [{:.4e}] is infeasible under current alphas, no path out of [{}] drawn paths is under budget'
+                             .format(self._budget, nDrawn))
+
+        scores = self._model.samplesScores(fromNumpy(underBudget.astype(int64)))
+        if scores is None:
+            return None
+
+        return scores.mean(dim=0), log(len(underBudget) / nDrawn)
+
+    # returns (layer values indices combinations, combinations probability) of given block layers distributions
+    @staticmethod
+    def _blockCombinations(blockDistribution):
+        grids = meshgrid(*[arange(len(values)) for values, _, _ in blockDistribution], indexing='ij')
+        combinations = stack([grid.ravel() for grid in grids], axis=-1)
+        combinationsProb = prod([probs[combinations[:, i]] for i, (_, _, probs) in enumerate(blockDistribution)], axis=0)
+
+        return combinations, combinationsProb
+
+    # returns max dp block table size, i.e. (previous block output values x block combinations x flops buckets)
+    def _maxTableSize(self, distribution):
+        layerIdx = {layer: i for i, layer in enumerate(self._model.layersList())}
+        nPrev, maxSize = 1, 0
+        for block in self._model.blocks:
+            blockLayers = block.getOptimizationLayers()
+            nCombinations = prod([len(distribution[layerIdx[layer]][0]) for layer in blockLayers])
+            maxSize = max(maxSize, nPrev * nCombinations * (self._nBuckets + 1))
+            nPrev = len(distribution[layerIdx[blockLayers[-1]]][0])
+
+        return maxSize
+
+    # forward pass over blocks, where state is (block output layer value, used flops buckets),
+    # mass[v, b] is the probability of blocks prefix whose output layer value index is v and whose flops are b buckets
+    def _buildDPTables(self, distribution):
+        bucketSize = self._budget / self._nBuckets
+        nStates = self._nBuckets + 1
+        layerIdx = {layer: i for i, layer in enumerate(self._model.layersList())}
+
+        # model input has a single state
+        mass = zeros((1, nStates))
+        mass[0, 0] = 1.0
+        prevLayer = None
+        tables = []
+        for block in self._model.blocks:
+            blockLayers = block.getOptimizationLayers()
+            blockDistribution = [distribution[layerIdx[layer]] for layer in blockLayers]
+            combinations, combinationsProb = self._blockCombinations(blockDistribution)
+            nPrev, nCombinations = mass.shape[0], len(combinations)
+
+            # blocks flops of all (previous block output value, block combination) pairs
+            widths = {layer: tile(layerWidths[combinations[:, i]], nPrev) for i, (layer, (_, layerWidths, _)) in
+                      enumerate(zip(blockLayers, blockDistribution))}
+            if prevLayer is not None:
+                widths[prevLayer] = repeat(distribution[layerIdx[prevLayer]][1], nCombinations)
+            cost = floor(block.pathsFlops(widths) / bucketSize).astype(int).reshape(nPrev, nCombinations)
+
+            # add block to prefixes
+            outIdx = combinations[:, -1]
+            nOut = len(blockDistribution[-1][0])
+            newMass = zeros(nOut * nStates)
+            for prevIdx in flatnonzero(mass.sum(axis=-1) > 0):
+                buckets = cost[prevIdx][:, None] + arange(nStates)[None, :]
+                underBudget = buckets < nStates
+                newMass += bincount(((outIdx[:, None] * nStates) + buckets)[underBudget],
+                                    (combinationsProb[:, None] * mass[prevIdx][None, :])[underBudget], minlength=nOut * nStates)
+
+            tables.append((blockLayers, mass, cost, combinations, combinationsProb))
+            mass = newMass.reshape(nOut, nStates)
+            prevLayer = block.outputLayer()
+
+        return tables, mass
+
+    # draws path from the conditional distribution, exact, since dp tables contain every path under budget,
+    # and dp paths over budget are rejected against their exact flops
+    def _sampleDP(self):
+        distribution = self._model.layersSamplesDistribution()
+        key = tuple((widths.tobytes(), probs.tobytes()) for _, widths, probs in distribution)
+        if key != self._dpTablesKey:
+            self._dpTables = self._buildDPTables(distribution)
+            self._dpTablesKey = key
+
+        tables, mass = self._dpTables
+        if mass.sum() > 0:
+            for _ in range(self._maxDPDraws):
+                sample = self._drawDP(distribution, tables, mass)
+                if self._model.pathsFlops(self._model.samplesToWidths(sample[None, :]))[0] <= self._budget:
+                    return sample
+
+        # no path fits budget after rounding, or dp paths are mostly over budget
+        return self._sampleRejection(1)[0]
+
+    # draws path from dp tables, paths over budget are drawn as well, due to flops buckets rounding
+    def _drawDP(self, distribution, tables, mass):
+        layerIdx = {layer: i for i, layer in enumerate(self._model.layersList())}
+        sample = [None] * len(layerIdx)
+        # draw last block (output value, flops buckets) state
+        outIdx, buckets = divmod(choice(mass.size, p=mass.ravel() / mass.sum()), mass.shape[-1])
+        # backtrack blocks states
+        for blockLayers, prevMass, cost, combinations, combinationsProb in reversed(tables):
+            combinationsIdx = flatnonzero(combinations[:, -1] == outIdx)
+            prevBuckets = buckets - cost[:, combinationsIdx]
+            weights = where(prevBuckets >= 0, prevMass[arange(len(prevMass))[:, None], maximum(prevBuckets, 0)], 0) * combinationsProb[combinationsIdx]
+            prevIdx, idx = divmod(choice(weights.size, p=weights.ravel() / weights.sum()), len(combinationsIdx))
+            # set block layers values
+            for layer, valueIdx in zip(blockLayers, combinations[combinationsIdx[idx]]):
+                sample[layerIdx[layer]] = distribution[layerIdx[layer]][0][valueIdx]
+
+            outIdx, buckets = prevIdx, prevBuckets[prevIdx, idx]
+
+        return array(sample)
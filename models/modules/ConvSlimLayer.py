@@ -1,13 +1,26 @@
 from .SlimLayer import SlimLayer, abstractmethod
 from math import floor
+from collections import OrderedDict
 
-from torch.nn import ModuleList, Conv2d, BatchNorm2d
+from numpy import array, interp, linspace, unique
+from torch import is_grad_enabled, tensor, long
+from torch.nn import ModuleList, Sequential, Conv2d, BatchNorm2d
 from torch.nn.functional import conv2d
 
-from utils.flops_benchmark import count_flops
+from utils.flopsAnalytic import conv2dFlops
+from utils.latencyBenchmark import convLatency
+from utils.memoryAnalytic import convMemoryBytes
+from utils.device import getDevice, toMemoryFormat
 
 
 class ConvSlimLayer(SlimLayer):
+    # max number of contiguous weights slices we keep per layer
+    _weightsCacheMaxSize = 16
+    # buffer of pruned layer original indices of its kept widths, unpruned layers have no such buffer
+    _keptWidthsIdxKey = 'keptOrgWidthsIdx'
+    # max number of measured widths per (prevWidth, width) axis, latency of other widths is interpolated
+    _maxLatencyWidths = 8
+
     def __init__(self, widthRatioList, out_planes, kernel_size, stride, prevLayer, countFlopsFlag):
         super(ConvSlimLayer, self).__init__((prevLayer.outputChannels(), out_planes, kernel_size, stride), out_planes, widthRatioList,
                                             prevLayer, countFlopsFlag)
@@ -16,6 +29,7 @@ class ConvSlimLayer(SlimLayer):
         self.getOptimizationLayers = self.getLayers
         self.getFlopsLayers = self.getLayers
         self.getCountersLayers = self.getLayers
+        self.getSwitchUnits = self.getLayers
 
         # init layer original BNs container
         self._orgBNs = [self.bn]
@@ -24,6 +38,13 @@ class ConvSlimLayer(SlimLayer):
         # init layer original width ratio list
         self._orgWidthRatioList = self._widthRatioList
 
+        # init contiguous weights slices cache, key is (prevWidth, width)
+        self._weightsCache = OrderedDict()
+        # init conv weights version the cache slices have been sliced from
+        self._weightsCacheVersion = None
+        # init weights memory format, None keeps default contiguous format
+        self._memoryFormat = None
+
     def orgBNs(self):
         return self._orgBNs[0]
 
@@ -33,16 +54,67 @@ class ConvSlimLayer(SlimLayer):
     def _buildModules(self, params):
         in_planes, out_planes, kernel_size, stride = params
         # init conv2d module
-        self.conv = Conv2d(in_planes, out_planes, kernel_size, stride=stride, padding=floor(kernel_size / 2), bias=False).cuda()
+        self.conv = Conv2d(in_planes, out_planes, kernel_size, stride=stride, padding=floor(kernel_size / 2), bias=False).to(getDevice())
         # init independent batchnorm module for number of filters
-        self.bn = ModuleList([BatchNorm2d(n) for n in self._widthList]).cuda()
+        self.bn = ModuleList([BatchNorm2d(n) for n in self._widthList]).to(getDevice())
 
     def addWidth(self, widthRatio: float):
         # add new width to widthList, widthRatioList
         self._addWidthToLists(widthRatio)
         # add new BN
         newWidth = self._widthList[-1]
-        self.bn.append(BatchNorm2d(newWidth).cuda())
+        self.bn.append(BatchNorm2d(newWidth).to(getDevice()))
+
+    # remove widths from widthList, widthRatioList & BNs.
+    # kept widths original indices are saved in state dict, therefore state dicts of pruned & unpruned layers are loadable
+    def removeWidths(self, widthsIdx: list):
+        keptWidthsIdx = [orgIdx for idx, orgIdx in enumerate(self.keptWidthsIdx()) if idx not in widthsIdx]
+        self._removeWidthsFromLists(widthsIdx)
+        # remove BNs in place, original BNs container shares them
+        for idx in sorted(widthsIdx, reverse=True):
+            del self.bn[idx]
+        # update kept widths buffer
+        keptWidthsIdx = tensor(keptWidthsIdx, dtype=long, device=self.conv.weight.device)
+        if self.isPruned():
+            setattr(self, self._keptWidthsIdxKey, keptWidthsIdx)
+        else:
+            self.register_buffer(self._keptWidthsIdxKey, keptWidthsIdx)
+
+        self.clearWeightsCache()
+
+    def isPruned(self) -> bool:
+        return self._keptWidthsIdxKey in self._buffers
+
+    # layer widths indices in layer original widthList
+    def keptWidthsIdx(self) -> list:
+        return getattr(self, self._keptWidthsIdxKey).tolist() if self.isPruned() else list(range(self.nWidths()))
+
+    # returns state dict layer kept widths original indices, None if state dict layer hasn't been pruned
+    def stateDictKeptWidthsIdx(self, state_dict, prefix):
+        keptWidthsIdx = state_dict.get(prefix + self._keptWidthsIdxKey)
+        return None if keptWidthsIdx is None else keptWidthsIdx.tolist()
+
+    # rename state dict BNs to layer kept widths BNs, i.e. load state dict of unpruned layer, or of layer with more widths, into pruned layer
+    def _alignStateDictWidths(self, state_dict, prefix):
+        stateDictKeptWidthsIdx = self.stateDictKeptWidthsIdx(state_dict, prefix)
+        keptWidthsIdx = self.keptWidthsIdx()
+        if (stateDictKeptWidthsIdx == keptWidthsIdx) or ((stateDictKeptWidthsIdx is None) and (not self.isPruned())):
+            return
+        # unpruned state dict BN index is its original index
+        stateDictBNIdx = None if stateDictKeptWidthsIdx is None else {orgIdx: idx for idx, orgIdx in enumerate(stateDictKeptWidthsIdx)}
+        if (stateDictBNIdx is not None) and any(orgIdx not in stateDictBNIdx for orgIdx in keptWidthsIdx):
+            # state dict doesn't have all layer widths BNs
+            return
+
+        bnPrefix = '{}bn.'.format(prefix)
+        stateDictBNs = {k: state_dict.pop(k) for k in list(state_dict.keys()) if k.startswith(bnPrefix)}
+        for idx, orgIdx in enumerate(keptWidthsIdx):
+            srcPrefix = '{}{}.'.format(bnPrefix, orgIdx if stateDictBNIdx is None else stateDictBNIdx[orgIdx])
+            for k, v in stateDictBNs.items():
+                if k.startswith(srcPrefix):
+                    state_dict['{}{}.{}'.format(bnPrefix, idx, k[len(srcPrefix):])] = v
+
+        state_dict[prefix + self._keptWidthsIdxKey] = getattr(self, self._keptWidthsIdxKey)
 
     # generate new BNs based on current width
     def generatePathBNs(self, srcLayer):
@@ -52,7 +124,7 @@ class ConvSlimLayer(SlimLayer):
             # get current BN num_features
             bnFeatures = currBN.num_features
             # generate new BNs ModuleList
-            newBNs = ModuleList([BatchNorm2d(bnFeatures) for _ in range(self.nWidths())]).cuda()
+            newBNs = ModuleList([BatchNorm2d(bnFeatures) for _ in range(self.nWidths())]).to(getDevice())
             # copy weights to new BNs
             for bn in newBNs:
                 bn.load_state_dict(currBN.state_dict())
@@ -68,23 +140,123 @@ class ConvSlimLayer(SlimLayer):
         self._widthList = self._orgWidthList
         self._widthRatioList = self._orgWidthRatioList
 
-    def forward(self, x):
+    def _narrowWeights(self, prevWidth, width):
         # narrow conv weights (i.e. filters) according to current nFilters
-        convWeights = self.conv.weight.narrow(0, 0, self._widthList[self._currWidthIdx])
+        convWeights = self.conv.weight.narrow(0, 0, width)
         # narrow conv weights (i.e. filters) according to previous layer nFilters
-        convWeights = convWeights.narrow(1, 0, self.prevLayer().currWidth())
+        return convWeights.narrow(1, 0, prevWidth)
+
+    def clearWeightsCache(self):
+        self._weightsCache.clear()
+        self._weightsCacheVersion = None
+
+    # set memory format of narrowed weights, conv output follows weights memory format
+    def setMemoryFormat(self, _memoryFormat):
+        self._memoryFormat = _memoryFormat
+        self.clearWeightsCache()
+
+    # optimizers might update weights through .data, which doesn't bump weights version.
+    # weights are trained in training mode only, therefore switching mode invalidates the cache as well
+    def train(self, mode=True):
+        self.clearWeightsCache()
+        return super(ConvSlimLayer, self).train(mode)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        self.clearWeightsCache()
+        self._alignStateDictWidths(state_dict, prefix)
+        super(ConvSlimLayer, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    # returns contiguous copy of weights in layer memory format
+    def _contiguousWeights(self, weights):
+        return weights.contiguous() if self._memoryFormat is None else toMemoryFormat(weights, self._memoryFormat)
+
+    # returns cached weights of given key, builds them by buildWeightsFunc() if key is not in cache
+    def _cachedWeights(self, key, buildWeightsFunc):
+        # clear cache if conv weights have been modified (optimizer step, load_state_dict, etc.) since cache has been filled
+        weight = self.conv.weight
+        weightsVersion = (weight._version, weight.data_ptr())
+        if weightsVersion != self._weightsCacheVersion:
+            self.clearWeightsCache()
+            self._weightsCacheVersion = weightsVersion
+
+        weights = self._weightsCache.get(key)
+        if weights is None:
+            weights = buildWeightsFunc()
+            self._weightsCache[key] = weights
+            # remove least recently used weights
+            if len(self._weightsCache) > self._weightsCacheMaxSize:
+                self._weightsCache.popitem(last=False)
+        else:
+            # mark weights as most recently used
+            self._weightsCache.move_to_end(key)
+
+        return weights
+
+    # returns conv weights narrowed to (prevWidth, width)
+    # without gradient, returns contiguous slice from cache, as long as conv weights haven't been modified
+    def _convWeights(self, prevWidth, width):
+        # narrowed weights have to be part of the graph in case of gradient calculation.
+        # narrowing is O(1) & weights change every optimizer step, therefore graph views aren't cached
+        if is_grad_enabled():
+            return toMemoryFormat(self._narrowWeights(prevWidth, width), self._memoryFormat)
+
+        return self._cachedWeights((prevWidth, width), lambda: self._contiguousWeights(self._narrowWeights(prevWidth, width)))
+
+    # can we fold bn into conv weights, i.e. bn is an affine function of its input
+    @staticmethod
+    def _isFoldable(bn) -> bool:
+        return (not is_grad_enabled()) and (not bn.training) and bn.affine and bn.track_running_stats
+
+    # returns (weights, bias) of conv narrowed to (prevWidth, width), where bn has been folded into
+    def _foldedWeights(self, prevWidth, width, bn):
+        # bn might be replaced (e.g. binomial generated BNs) or its statistics might be updated, therefore it is part of the key
+        bnVersion = tuple((t.data_ptr(), t._version) for t in [bn.weight, bn.bias, bn.running_mean, bn.running_var])
+
+        def foldWeights():
+            scale = bn.weight / (bn.running_var + bn.eps).sqrt()
+            weights = self._contiguousWeights(self._narrowWeights(prevWidth, width) * scale.view(-1, 1, 1, 1))
+            bias = bn.bias - (bn.running_mean * scale)
+            return weights, bias
+
+        return self._cachedWeights((prevWidth, width, bnVersion), foldWeights)
+
+    def forward(self, x):
+        # get previous layer nFilters & current nFilters
+        prevWidth = self.prevLayer().currWidth()
+        width = self._widthList[self._currWidthIdx]
+        bn = self.bn[self._currWidthIdx]
 
         # perform forward
-        out = conv2d(x, convWeights, bias=self.conv.bias, stride=self.conv.stride, padding=self.conv.padding, dilation=self.conv.dilation,
-                     groups=self.conv.groups)
-        out = self.bn[self._currWidthIdx](out)
+        if self._isFoldable(bn):
+            # eval mode fast path, bn is folded into conv weights & bias
+            convWeights, bias = self._foldedWeights(prevWidth, width, bn)
+            out = conv2d(x, convWeights, bias=bias, stride=self.conv.stride, padding=self.conv.padding, dilation=self.conv.dilation,
+                         groups=self.conv.groups)
+        else:
+            convWeights = self._convWeights(prevWidth, width)
+            out = conv2d(x, convWeights, bias=self.conv.bias, stride=self.conv.stride, padding=self.conv.padding, dilation=self.conv.dilation,
+                         groups=self.conv.groups)
+            out = bn(out)
 
         # update forward counters
-        _currWidth = self.currWidth()
-        self._forwardCounters[_currWidth] += 1
+        self.updateForwardCounters()
 
         return out
 
+    # build standalone dense conv & BN, physically cut to (previous layer current width, current width)
+    def materialize(self) -> Sequential:
+        prevWidth = self.prevLayer().currWidth()
+        width = self.currWidth()
+        # init dense conv2d module with narrowed weights
+        conv = Conv2d(prevWidth, width, self.conv.kernel_size, stride=self.conv.stride, padding=self.conv.padding, dilation=self.conv.dilation,
+                      groups=self.conv.groups, bias=False)
+        conv.weight.data.copy_(self._narrowWeights(prevWidth, width))
+        # init batchnorm module with current width BN weights & statistics
+        bn = BatchNorm2d(width)
+        bn.load_state_dict(self.bn[self._currWidthIdx].state_dict())
+
+        return Sequential(conv, bn).to(self.conv.weight.device)
+
     def getLayers(self):
         return [self]
 
@@ -109,13 +281,48 @@ class ConvSlimLayer(SlimLayer):
         print('== Counting width flops ==')
 
         # iterate over current layer widths & previous layer widths
+        # flops are computed from conv shapes, i.e. no forward pass
         for width in self.flopsWidthList():
             for prevWidth in self.prevLayer().flopsWidthList():
-                conv = Conv2d(prevWidth, width, self.conv.kernel_size, bias=self.conv.bias, stride=self.conv.stride,
-                              padding=self.conv.padding, dilation=self.conv.dilation, groups=self.conv.groups)
-                flops, output_size = count_flops(conv, input_size, prevWidth)
+                flops, output_size = conv2dFlops(self.conv, prevWidth, width, input_size)
                 flopsDict[(prevWidth, width)] = flops
 
         print(flopsDict.keys())
         print('== Done counting ==')
         return flopsDict, output_size
+
+    def countWidthMemory(self):
+        conv = self.conv
+        input_size = self.prevLayer().outputSize()
+        return {(prevWidth, width): convMemoryBytes(prevWidth, width, conv.kernel_size, conv.groups, conv.bias is not None, input_size,
+                                                    self.outputSize(), conv.weight.element_size())
+                for prevWidth, width in self.flopsDict.keys()}
+
+    # returns measured widths of axis widths, i.e. evenly spaced axis widths & layer widths
+    def _latencyGrid(self, axisWidths, layer):
+        if len(axisWidths) <= self._maxLatencyWidths:
+            return axisWidths
+
+        gridWidths = set(axisWidths[i] for i in linspace(0, len(axisWidths) - 1, self._maxLatencyWidths).round().astype(int))
+        if isinstance(layer, SlimLayer):
+            gridWidths.update(w for w in layer.widthList() if w in axisWidths)
+
+        return sorted(gridWidths)
+
+    # measure latency for each width, in the same table structure as flopsDict
+    # latency is measured over a grid of at most _maxLatencyWidths (+ layers widths) per axis, other widths are bilinearly interpolated,
+    # e.g. binomial layers have (outputChannels x prevOutputChannels) widths
+    def countWidthLatency(self):
+        print('== Measuring width latency ==')
+        input_size = self.prevLayer().outputSize()
+        prevWidths, widths = [unique([key[i] for key in self.flopsDict.keys()]).tolist() for i in range(2)]
+        prevGrid, grid = self._latencyGrid(prevWidths, self.prevLayer()), self._latencyGrid(widths, self)
+        gridLatency = array([[convLatency(self.conv, prevWidth, width, input_size, self._memoryFormat) for width in grid] for prevWidth in prevGrid])
+        # interpolate over width axis, then over prevWidth axis
+        widthsLatency = array([interp(widths, grid, prevWidthLatency) for prevWidthLatency in gridLatency])
+        widthIdx = {width: i for i, width in enumerate(widths)}
+        latencyDict = {(prevWidth, width): float(interp(prevWidth, prevGrid, widthsLatency[:, widthIdx[width]]))
+                       for prevWidth, width in self.flopsDict.keys()}
+        print('== Done measuring ==')
+
+        return latencyDict
@@ -0,0 +1,157 @@
+from numpy import arange, meshgrid, zeros, ones, floor, ceil, clip, linspace, searchsorted, bincount, moveaxis, einsum, float64 as npFloat64
+from numpy.fft import rfft, irfft
+from torch import tensor, tensordot, float64
+
+
+# closed-form flops distribution of alphas distribution, for models whose layers widths distributions are known in closed form.
+# model flops are the sum of blocks flops, where block flops depend on a few width variables, i.e. block flops table over its variables.
+# expected flops & variance are exact and differentiable w.r.t. alphas, histogram is exact up to flops buckets resolution
+class FlopsDistribution:
+    # number of flops buckets per histogram bin
+    _binBuckets = 16
+    # max number of flops buckets, bounds histogram time
+    _maxBuckets = 1024
+    # histogram bins span expected flops +- _nStd std
+    _nStd = 4
+
+    def __init__(self, model):
+        self._model = model
+        # blocks flops tables of the width variables they have been built for
+        self._tablesKey = None
+        self._tables = None
+
+    # returns list of (block variables, block flops table over variables widths) per block
+    def _blocksTables(self, layersVariable: list, variables: list) -> list:
+        key = (tuple(layersVariable), tuple(tuple(widths) for widths, _ in variables))
+        if key != self._tablesKey:
+            self._tables = self._buildBlocksTables(layersVariable, variables)
+            self._tablesKey = key
+
+        return self._tables
+
+    def _buildBlocksTables(self, layersVariable: list, variables: list) -> list:
+        model = self._model
+        layers = model.layersList()
+        tables = []
+        for block, blockLayersIdx in zip(model.blocks, model.blocksFlopsLayersIdx()):
+            blockVariables = sorted(set(layersVariable[idx] for idx in blockLayersIdx))
+            grids = meshgrid(*[arange(len(variables[v][0])) for v in blockVariables], indexing='ij')
+            widths = {layers[idx]: variables[layersVariable[idx]][0][grids[blockVariables.index(layersVariable[idx])].ravel()] for idx in
+                      blockLayersIdx}
+            flops = block.pathsFlops(widths).reshape(grids[0].shape)
+            tables.append((blockVariables, tensor(flops, dtype=float64)))
+
+        return tables
+
+    # contracts table variables which aren't in keepVariables with their probs, returns (kept variables, contracted table)
+    @staticmethod
+    def _marginalize(tableVariables: list, table, keepVariables: list, probs: list):
+        tableVariables = list(tableVariables)
+        for v in list(tableVariables):
+            if v not in keepVariables:
+                axis = tableVariables.index(v)
+                table = tensordot(table, probs[v], dims=([axis], [0]))
+                tableVariables.pop(axis)
+
+        return tableVariables, table
+
+    # returns (expected flops, flops variance) tensors
+    def moments(self):
+        layersVariable, variables = self._model.widthsVariables()
+        probs = [p.to(float64) for _, p in variables]
+        tables = self._blocksTables(layersVariable, variables)
+
+        means = [self._marginalize(blockVariables, table, [], probs)[-1] for blockVariables, table in tables]
+        variance = sum([self._marginalize(blockVariables, table * table, [], probs)[-1] - (mean * mean)
+                        for (blockVariables, table), mean in zip(tables, means)])
+        # blocks flops covariance, blocks who don't share variables are independent
+        for k, (variablesK, tableK) in enumerate(tables):
+            for l in range(k + 1, len(tables)):
+                variablesL, tableL = tables[l]
+                shared = [v for v in variablesK if v in variablesL]
+                if len(shared) > 0:
+                    _, condMeanK = self._marginalize(variablesK, tableK, shared, probs)
+                    _, condMeanL = self._marginalize(variablesL, tableL, shared, probs)
+                    _, jointMean = self._marginalize(shared, condMeanK * condMeanL, [], probs)
+                    variance = variance + (2 * (jointMean - (means[k] * means[l])))
+
+        return sum(means), variance
+
+    def expectedFlops(self):
+        mean, _ = self.moments()
+        return mean
+
+    # returns (bins flops edges, bins probabilities), bins span expected flops +- 4 std, mass outside is added to edge bins.
+    # forward pass over blocks, where state is (frontier variable value, used flops buckets),
+    # frontier variable is the variable both previous blocks & next blocks depend on
+    def histogram(self, nBins: int):
+        layersVariable, variables = self._model.widthsVariables()
+        probs = [p.detach().cpu().numpy().astype(npFloat64) for _, p in variables]
+        tables = [(blockVariables, table.numpy()) for blockVariables, table in self._blocksTables(layersVariable, variables)]
+
+        mean, variance = [v.item() for v in self.moments()]
+        std = max(variance, 0.0) ** 0.5
+        maxFlops = sum([table.max() for _, table in tables])
+        binsEdges = linspace(max(mean - (self._nStd * std), 0.0), min(mean + (self._nStd * std), maxFlops), nBins + 1)
+        bucketSize = max((binsEdges[-1] - binsEdges[0]) / (nBins * self._binBuckets), maxFlops / self._maxBuckets)
+        # blocks flops mass is split between the buckets below & above block flops, i.e. linear binning, which keeps expected flops.
+        # total might exceed max flops by a bucket per block
+        nStates = int(ceil(maxFlops / bucketSize)) + len(tables) + 1
+        # variables blocks after each block depend on
+        nextVariables = [set() for _ in tables]
+        for k in range(len(tables) - 2, -1, -1):
+            nextVariables[k] = nextVariables[k + 1] | set(tables[k + 1][0])
+
+        seen = set()
+        frontier = None
+        mass = zeros((1, nStates))
+        mass[0, 0] = 1.0
+        for (blockVariables, table), blockNextVariables in zip(tables, nextVariables):
+            # multiply block grid by probs of variables block introduces
+            weights = ones(table.shape)
+            for axis, v in enumerate(blockVariables):
+                if v not in seen:
+                    weights = weights * probs[v].reshape([-1 if i == axis else 1 for i in range(table.ndim)])
+            seen.update(blockVariables)
+            newFrontier = [v for v in seen if v in blockNextVariables]
+            assert (len(newFrontier) <= 1) and ((frontier is None) or (frontier in blockVariables))
+            newFrontier = newFrontier[0] if len(newFrontier) > 0 else None
+            assert (newFrontier is None) or (newFrontier in blockVariables)
+
+            # order grid axes as (frontier, new frontier, rest)
+            cost = table / bucketSize
+            axes = [blockVariables.index(v) for v in [frontier, newFrontier] if v is not None]
+            axes = list(dict.fromkeys(axes))
+            cost, weights = moveaxis(cost, axes, list(range(len(axes)))), moveaxis(weights, axes, list(range(len(axes))))
+            nFrontier = len(probs[frontier]) if frontier is not None else 1
+            if frontier is None:
+                cost, weights = cost[None], weights[None]
+            if (newFrontier is None) or (newFrontier == frontier):
+                cost, weights = cost[:, None], weights[:, None]
+            cost, weights = cost.reshape(nFrontier, cost.shape[1], -1), weights.reshape(nFrontier, weights.shape[1], -1)
+
+            # block flops histogram (kernel) per (frontier value, new frontier value)
+            lowCost = floor(cost)
+            highFraction = cost - lowCost
+            kernelIdx = arange(nFrontier * cost.shape[1]).reshape(nFrontier, cost.shape[1], 1) * nStates
+            kernels = zeros(nFrontier * cost.shape[1] * nStates)
+            for buckets, fraction in [(lowCost.astype(int), 1 - highFraction), (lowCost.astype(int) + 1, highFraction)]:
+                valid = buckets < nStates
+                kernels += bincount((kernelIdx + buckets)[valid], (fraction * weights)[valid], minlength=len(kernels))
+            kernels = kernels.reshape(nFrontier, cost.shape[1], nStates)
+
+            # add block flops to prefixes flops, i.e. convolve prefixes flops mass with block kernels
+            fftSize = 2 * nStates
+            massFFT, kernelsFFT = rfft(mass, fftSize), rfft(kernels, fftSize)
+            if newFrontier == frontier:
+                newMassFFT = massFFT * kernelsFFT[:, 0]
+            else:
+                newMassFFT = einsum('ik,igk->gk', massFFT, kernelsFFT)
+            mass = clip(irfft(newMassFFT, fftSize)[:, :nStates], 0, None)
+            frontier = newFrontier
+
+        bucketsMass = mass.sum(axis=0)
+        bucketsBin = clip(searchsorted(binsEdges, arange(nStates) * bucketSize, side='right') - 1, 0, nBins - 1)
+        binsProbs = bincount(bucketsBin, bucketsMass, minlength=nBins)
+
+        return binsEdges.tolist(), binsProbs.tolist()
@@ -0,0 +1,66 @@
+from array import array
+
+
+# immutable path, i.e. layers width indices, backed by a small int array
+# path hash is stable across processes, therefore paths can be used as dictionary keys and compared cheaply
+class Path:
+    __slots__ = ['_widthIdx', '_hash']
+    _typecode = 'h'
+
+    def __init__(self, widthIdxList):
+        self._widthIdx = array(self._typecode, widthIdxList)
+        # tuple of ints hash doesn't depend on process hash seed
+        self._hash = hash(tuple(self._widthIdx))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, Path):
+            return (self._hash == other._hash) and (self._widthIdx == other._widthIdx)
+
+        if isinstance(other, (list, tuple)):
+            return self.tolist() == list(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else (not eq)
+
+    def __len__(self):
+        return len(self._widthIdx)
+
+    def __iter__(self):
+        return iter(self._widthIdx)
+
+    # slicing returns tuple of width indices
+    def __getitem__(self, idx):
+        v = self._widthIdx[idx]
+        return tuple(v) if isinstance(idx, slice) else v
+
+    def __repr__(self):
+        return '{}'.format(self.tolist())
+
+    def __getstate__(self):
+        return self.tolist()
+
+    def __setstate__(self, state):
+        self.__init__(state)
+
+    def tolist(self) -> list:
+        return self._widthIdx.tolist()
+
+
+# model state of a path, i.e. switch units states (layers width indices & downsample decisions), and path derived data
+# switching to a path by its plan is a single pass of assignments
+class PathPlan:
+    def __init__(self, switchStates: list, width: list, widthRatio: list, flops):
+        self._switchStates = switchStates
+        self.width = width
+        self.widthRatio = widthRatio
+        self.flops = flops
+
+    def apply(self, switchUnits):
+        for unit, state in zip(switchUnits, self._switchStates):
+            unit.setSwitchState(state)
@@ -0,0 +1,56 @@
+from torch import rand, stack, argsort
+from torch.quasirandom import SobolEngine
+
+
+# draws uniforms for paths sampling by inverse CDF, i.e. variance reduced alternatives to i.i.d. paths.
+# each uniform is marginally U[0,1), therefore each path is marginally drawn from alphas distribution and gradient estimators remain unbiased
+class PathSampler:
+    _pathSamplerKey = 'path_sampler'
+    _iidKey = 'iid'
+    # pairs of paths from uniforms u & 1-u, i.e. pair paths are mirrored quantiles
+    _antitheticKey = 'antithetic'
+    # scrambled Sobol sequence, points are balanced when n is a power of 2
+    _sobolKey = 'sobol'
+    # latin hypercube, each variable n strata contain a single uniform each
+    _stratifiedKey = 'stratified'
+
+    def __init__(self, method: str):
+        self._method = method
+
+    @staticmethod
+    def pathSamplerKey():
+        return PathSampler._pathSamplerKey
+
+    @staticmethod
+    def iidKey():
+        return PathSampler._iidKey
+
+    @staticmethod
+    def methodChoices():
+        return [PathSampler._iidKey, PathSampler._antitheticKey, PathSampler._sobolKey, PathSampler._stratifiedKey]
+
+    # returns path sampler, None if paths are drawn i.i.d.
+    @staticmethod
+    def build(args):
+        method = getattr(args, PathSampler._pathSamplerKey, PathSampler._iidKey)
+        if method == PathSampler._iidKey:
+            return None
+
+        return PathSampler(method)
+
+    def method(self):
+        return self._method
+
+    # returns (n x nVariables) uniforms tensor on device
+    def uniforms(self, n: int, nVariables: int, device):
+        if self._method == self._antitheticKey:
+            u = rand(((n + 1) // 2, nVariables), device=device)
+            # pairs are consecutive rows, odd n drops last pair mirror
+            return stack([u, 1 - u], dim=1).view(-1, nVariables)[:n]
+
+        if self._method == self._sobolKey:
+            return SobolEngine(nVariables, scramble=True).draw(n).to(device)
+
+        # stratified
+        strata = argsort(rand((n, nVariables), device=device), dim=0)
+        return (strata + rand((n, nVariables), device=device)) / n
@@ -1,5 +1,6 @@
 from abc import abstractmethod
 from collections import defaultdict
+from numpy import full, nan, array
 from .block import Block
 
 
@@ -24,7 +25,9 @@ class SlimLayer(Block):
         self._forwardCounters = self._initForwardCounters()
 
         # count flops for each width
-        self.flopsDict, self.output_size = self.countWidthFlops(self.prevLayer().outputSize()) if countFlopsFlag else (None, None)
+        self.setFlopsData(self.countWidthFlops(self.prevLayer().outputSize()) if countFlopsFlag else (None, None))
+        # init latency for each width, latency is measured on demand only
+        self.latencyDict = None
 
     @abstractmethod
     def _buildWidthList(self, buildParams):
@@ -49,13 +52,48 @@ class SlimLayer(Block):
     def countWidthFlops(self, input_size):
         raise NotImplementedError('subclasses must override countWidthFlops()!')
 
+    @abstractmethod
+    # count memory bytes for each (prevWidth, width) in flops table, i.e. (parameters, input, output) bytes
+    def countWidthMemory(self):
+        raise NotImplementedError('subclasses must override countWidthMemory()!')
+
+    @abstractmethod
+    # measure latency for each (prevWidth, width) in flops table
+    def countWidthLatency(self):
+        raise NotImplementedError('subclasses must override countWidthLatency()!')
+
     @abstractmethod
     # add new width to layer
     def addWidth(self, widthRatio: float):
         raise NotImplementedError('subclasses must override addWidth()!')
 
+    @abstractmethod
+    # remove widths of given indices from layer
+    def removeWidths(self, widthsIdx: list):
+        raise NotImplementedError('subclasses must override removeWidths()!')
+
     def setFlopsData(self, _flopsData):
-        self.flopsDict, self.output_size = _flopsData
+        flopsDict, self.output_size = _flopsData
+        self.setFlopsDict(flopsDict)
+
+    # flopsDict is the flops data we save, flops table is its dense copy for paths flops
+    # memory table is computed for flopsDict widths
+    def setFlopsDict(self, flopsDict):
+        self.flopsDict = flopsDict
+        self._flopsTable = None if flopsDict is None else self._buildFlopsTable(flopsDict)
+        self.memoryDict = None if flopsDict is None else self.countWidthMemory()
+
+    # dense 2-D flops array, indexed by (prevWidth, width), missing widths pairs are nan
+    @staticmethod
+    def _buildFlopsTable(flopsDict):
+        widths = array(list(flopsDict.keys()))
+        flopsTable = full(tuple(widths.max(axis=0) + 1), nan)
+        flopsTable[widths[:, 0], widths[:, 1]] = list(flopsDict.values())
+
+        return flopsTable
+
+    def flopsTable(self):
+        return self._flopsTable
 
     def getFlopsData(self):
         return self.flopsDict, self.output_size
@@ -63,16 +101,58 @@ class SlimLayer(Block):
     def countFlops(self):
         return self.flopsDict[(self.prevLayer().currWidth(), self.currWidth())]
 
+    # current width (parameters, input, output) bytes
+    def layerMemory(self):
+        return self.memoryDict[(self.prevLayer().currWidth(), self.currWidth())]
+
+    # standalone layer holds its input & output
+    def countMemory(self):
+        paramsBytes, inputBytes, outputBytes = self.layerMemory()
+        return paramsBytes, inputBytes + outputBytes
+
+    def setLatencyData(self, latencyDict):
+        self.latencyDict = latencyDict
+
+    def getLatencyData(self):
+        return self.latencyDict
+
+    def countLatency(self):
+        return self.latencyDict[(self.prevLayer().currWidth(), self.currWidth())]
+
+    # layer widths array from widths dictionary, layers which are not in widths have fixed width, e.g. model input
+    @staticmethod
+    def layerWidths(layer, widths: dict):
+        return widths[layer] if layer in widths else layer.currWidth()
+
+    def pathsFlops(self, widths: dict):
+        return self._flopsTable[self.layerWidths(self.prevLayer(), widths), self.layerWidths(self, widths)]
+
     def prevLayer(self):
         return self._prevLayer[0]
 
     def updateCurrWidth(self):
         pass
 
+    # layer path state, i.e. current width index
+    def switchState(self):
+        return self._currWidthIdx
+
+    def setSwitchState(self, state):
+        # bypass Module.__setattr__ modules & parameters lookup, _currWidthIdx is a plain int
+        object.__setattr__(self, '_currWidthIdx', state)
+
     def _addWidthToLists(self, widthRatio: float):
         self._widthRatioList.append(widthRatio)
         self._widthList.append(int(widthRatio * self.outputChannels()))
 
+    # lists are updated in place, since original lists might share them
+    def _removeWidthsFromLists(self, widthsIdx: list):
+        keptIdx = [idx for idx in range(self.nWidths()) if idx not in widthsIdx]
+        self._widthRatioList[:] = [self._widthRatioList[idx] for idx in keptIdx]
+        self._widthList[:] = [self._widthList[idx] for idx in keptIdx]
+        # current width index points to the same width, or to 1st width if current width has been removed
+        self._currWidthIdx = keptIdx.index(self._currWidthIdx) if self._currWidthIdx in keptIdx else 0
+
     def widthList(self):
         return self._widthList
 
@@ -114,6 +194,10 @@ class SlimLayer(Block):
     def resetForwardCounters(self):
         self._forwardCounters = self._initForwardCounters()
 
+    # count forward of current width
+    def updateForwardCounters(self):
+        self._forwardCounters[self.currWidth()] += 1
+
     def outputLayer(self):
         return self
 
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+from torch.jit import trace, optimize_for_inference
+
+
+# LRU cache of traced dense models, one per (path, input size)
+# evaluating a cached path runs the traced graph instead of the slimmable model python forward
+class TracedPaths:
+    _hitsKey = 'Hits'
+    _missesKey = 'Misses'
+    _cachedKey = 'Cached paths'
+
+    def __init__(self, maxSize: int):
+        # max number of traced paths we keep, 0 disables the cache
+        self._maxSize = maxSize
+        # init traced paths cache, key is (path width indices, input size)
+        self._cache = OrderedDict()
+        # init cache statistics
+        self._hits = 0
+        self._misses = 0
+
+    def enabled(self) -> bool:
+        return self._maxSize > 0
+
+    # traced models hold a copy of the weights, therefore cache must be cleared once the weights have changed
+    def clear(self):
+        self._cache.clear()
+
+    # returns traced model of given key, traces buildModelFunc() output if key is not in cache
+    def get(self, key: tuple, buildModelFunc: callable, x):
+        tracedModel = self._cache.get(key)
+        if tracedModel is None:
+            self._misses += 1
+            # frozen & optimized for inference, e.g. mkldnn convolutions on cpu
+            tracedModel = optimize_for_inference(trace(buildModelFunc(), x, check_trace=False))
+            self._cache[key] = tracedModel
+            # remove least recently used path
+            if len(self._cache) > self._maxSize:
+                self._cache.popitem(last=False)
+        else:
+            self._hits += 1
+            # mark path as most recently used
+            self._cache.move_to_end(key)
+
+        return tracedModel
+
+    def statsRows(self) -> list:
+        return [[self._hitsKey, self._hits], [self._missesKey, self._misses], [self._cachedKey, len(self._cache)]]
+
+    def resetStats(self):
+        self._hits = 0
+        self._misses = 0
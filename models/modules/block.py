@@ -16,6 +16,11 @@ class Block(Module):
     def getCountersLayers(self):
         raise NotImplementedError('subclasses must override getCountersLayers()!')
 
+    @abstractmethod
+    # returns modules whose state changes on path switch, i.e. modules implementing switchState() & setSwitchState()
+    def getSwitchUnits(self):
+        raise NotImplementedError('subclasses must override getSwitchUnits()!')
+
     @abstractmethod
     def outputLayer(self):
         raise NotImplementedError('subclasses must override outputLayer()!')
@@ -24,6 +29,21 @@ class Block(Module):
     def countFlops(self):
         raise NotImplementedError('subclasses must override countFlops()!')
 
+    @abstractmethod
+    # current path memory footprint, i.e. (parameters bytes, peak activations bytes)
+    def countMemory(self):
+        raise NotImplementedError('subclasses must override countMemory()!')
+
+    @abstractmethod
+    # measured latency of current path
+    def countLatency(self):
+        raise NotImplementedError('subclasses must override countLatency()!')
+
+    @abstractmethod
+    # count flops of many paths at once, widths is a dictionary of layer widths array, i.e. layer width in each path
+    def pathsFlops(self, widths: dict):
+        raise NotImplementedError('subclasses must override pathsFlops()!')
+
     @abstractmethod
     # make some adjustments in model due to current width selected
     def updateCurrWidth(self):
@@ -33,3 +53,13 @@ class Block(Module):
     # generate new BNs for current model path, except for given srcLayer
     def generatePathBNs(self, srcLayer):
         raise NotImplementedError('subclasses must override generatePathBNs()!')
+
+    @abstractmethod
+    # build standalone dense module, physically cut to current width
+    def materialize(self):
+        raise NotImplementedError('subclasses must override materialize()!')
+
+    # remove widths from block layers, layersWidthsIdx is dictionary of removed width indices per optimization layer
+    def removeLayersWidths(self, layersWidthsIdx: dict):
+        for layer in self.getOptimizationLayers():
+            layer.removeWidths(layersWidthsIdx[layer])
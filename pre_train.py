@@ -4,7 +4,7 @@ from sys import exit
 from traceback import format_exc
 
 import torch.backends.cudnn as cudnn
-from torch.cuda import is_available, set_device
+from torch.cuda import is_available
 from torch.cuda import manual_seed as cuda_manual_seed
 from torch import manual_seed as torch_manual_seed
 
@@ -12,6 +12,7 @@ from trainRegimes.PreTrainedRegime import PreTrainedRegime
 from utils.HtmlLogger import HtmlLogger
 from utils.emails import sendEmail
 from utils.args import parseArgs
+from utils.device import isCuda, initDevice
 
 if __name__ == '__main__':
     # load command line arguments
@@ -19,13 +20,13 @@ if __name__ == '__main__':
     # init main logger
     logger = HtmlLogger(args.save, 'log')
 
-    if not is_available():
+    if isCuda(args.device) and (not is_available()):
         print('no gpu device available')
         exit(1)
 
     args.seed = datetime.now().microsecond
     nprandom.seed(args.seed)
-    set_device(args.gpu[0])
+    initDevice(args.device, args.gpu[0])
     cudnn.benchmark = True
     torch_manual_seed(args.seed)
     cudnn.enabled = True
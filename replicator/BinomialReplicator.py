@@ -8,26 +8,29 @@ class BinomialReplicator(MultinomialReplicator):
     @staticmethod
     def _addLossDictFunc(cModel):
         def addLossDict(lossDict: dict, lossDictsList: list, widthRatio: float, trainedPathIdx: list):
-            trainedPathWidth = cModel.currWidth()
             trainPathWidthRatio = cModel.currWidthRatio()
 
             diffList = []
-            for layerIdx, layer in enumerate(cModel.layersList()):
-                diff = trainedPathWidth[layerIdx] - layer.alphaWidthMean().item()
+            for layer in cModel.layersList():
+                # diff is based on sampled width, before rounding to width granularity
+                diff = layer.sampledWidth() - layer.alphaWidthMean().item()
                 diffList.append(diff)
 
-            lossDictsList.append((lossDict, diffList, trainPathWidthRatio))
+            # path sample, i.e. layers sampled widths
+            sample = [layer.sampledWidth() for layer in cModel.layersList()]
+
+            lossDictsList.append((lossDict, diffList, trainPathWidthRatio, sample))
 
         return addLossDict
 
     @staticmethod
-    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsHistoryDict, lossDictsList, gpu: int):
+    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsRegistry, lossDictsList, gpu: int):
         cModel = replica.getModel()
 
         addLossDictFunc = BinomialReplicator._addLossDictFunc(cModel)
         generateTrainParams = MultinomialReplicator.generateTrainParams
 
-        BinomialReplicator.evaluateSample(replica, lossFunc, data, pathsHistoryDict, lossDictsList, generateTrainParams, addLossDictFunc)
+        BinomialReplicator.evaluateSample(replica, lossFunc, data, pathsRegistry, lossDictsList, generateTrainParams, addLossDictFunc)
 
 
 class BlockBinomialReplicator(MultinomialReplicator):
@@ -37,25 +40,28 @@ class BlockBinomialReplicator(MultinomialReplicator):
     @staticmethod
     def _addLossDictFunc(cModel):
         def addLossDict(lossDict: dict, lossDictsList: list, widthRatio: float, trainedPathIdx: list):
-            trainedPathWidth = cModel.currWidth()
             trainPathWidthRatio = cModel.currWidthRatio()
 
             alphasDict = cModel.alphasDict()
             widthDiffDict = {}
             for width, alphaWidth in alphasDict.items():
-                # take one of alpha layers index, in order to get actual alpha width in current partition
-                layerIdx = alphaWidth.layersIdxList()[0]
-                widthDiffDict[width] = trainedPathWidth[layerIdx] - alphaWidth.mean(width).item()
+                # take one of alpha layers, in order to get actual alpha sampled width in current partition
+                # diff is based on sampled width, before rounding to width granularity
+                layer = alphaWidth.layersList()[0]
+                widthDiffDict[width] = layer.sampledWidth() - alphaWidth.mean(width).item()
+
+            # path sample, i.e. layers sampled widths
+            sample = [layer.sampledWidth() for layer in cModel.layersList()]
 
-            lossDictsList.append((lossDict, widthDiffDict, trainPathWidthRatio))
+            lossDictsList.append((lossDict, widthDiffDict, trainPathWidthRatio, sample))
 
         return addLossDict
 
     @staticmethod
-    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsHistoryDict, lossDictsList, gpu: int):
+    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsRegistry, lossDictsList, gpu: int):
         cModel = replica.getModel()
 
         addLossDictFunc = BlockBinomialReplicator._addLossDictFunc(cModel)
         generateTrainParams = MultinomialReplicator.generateTrainParams
 
-        BlockBinomialReplicator.evaluateSample(replica, lossFunc, data, pathsHistoryDict, lossDictsList, generateTrainParams, addLossDictFunc)
+        BlockBinomialReplicator.evaluateSample(replica, lossFunc, data, pathsRegistry, lossDictsList, generateTrainParams, addLossDictFunc)
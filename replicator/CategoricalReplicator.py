@@ -17,7 +17,7 @@ class CategoricalReplicator(ModelReplicator):
         return CategoricalReplica
 
     @staticmethod
-    def iterateOverSamples(replica: CategoricalReplica, lossFunc, data, pathsHistoryDict, lossDictsList, gpu: int):
+    def iterateOverSamples(replica: CategoricalReplica, lossFunc, data, pathsRegistry, lossDictsList, gpu: int):
         cModel = replica.getModel()
         # iterate over layers. in each layer iterate over alphas
         for layerIdx, layer in enumerate(cModel.layersList()):
@@ -33,7 +33,7 @@ class CategoricalReplicator(ModelReplicator):
                 for k, loss in lossDict.items():
                     alphaLossDict[k].append(loss.item())
 
-            ModelReplicator.evaluateSample(replica, lossFunc, data, pathsHistoryDict, lossDictsList, generateTrainParams, addLossDict)
+            ModelReplicator.evaluateSample(replica, lossFunc, data, pathsRegistry, lossDictsList, generateTrainParams, addLossDict)
 
     def processResults(self, results: list) -> list:
         raise ValueError('processResults() has NOT been modified to fit latest changes (iterating over all dataset instead of single batch)')
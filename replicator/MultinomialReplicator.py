@@ -25,11 +25,11 @@ class MultinomialReplicator(ModelReplicator):
         lossDictsList.append((lossDict, trainedPathIdx))
 
     @staticmethod
-    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsHistoryDict, lossDictsList, gpu: int):
+    def iterateOverSamples(replica: MultinomialReplica, lossFunc, data, pathsRegistry, lossDictsList, gpu: int):
         generateTrainParams = MultinomialReplicator.generateTrainParams
         addLossDict = MultinomialReplicator.addLossDict
 
-        ModelReplicator.evaluateSample(replica, lossFunc, data, pathsHistoryDict, lossDictsList, generateTrainParams, addLossDict)
+        ModelReplicator.evaluateSample(replica, lossFunc, data, pathsRegistry, lossDictsList, generateTrainParams, addLossDict)
 
     def processResults(self, results: list) -> list:
         gpuLossDictsList = results[0]
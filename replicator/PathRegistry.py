@@ -0,0 +1,95 @@
+from hashlib import sha1
+from multiprocessing import Manager
+
+from torch.nn import Module
+
+from utils.device import getDevice
+
+
+# registry of paths evaluated under current epoch weights & alphas, i.e. in replicator loss() calls of the same epoch.
+# registry paths dictionary is shared between replicas processes, key is path hash, value is path evaluations,
+# i.e. list of (loss dict, width ratio, trained path idx) per dataset batch
+class PathRegistry:
+    _pathRegistryKey = 'path_registry'
+    _noneKey = 'none'
+    _reuseKey = 'reuse'
+    _resampleKey = 'resample'
+    # max number of path resamples, before reusing repeated path evaluations
+    _maxResampleAttempts = 16
+
+    def __init__(self, policy: str, paths: dict):
+        self._policy = policy
+        self._paths = paths
+        # current process statistics
+        self._nHits = 0
+        self._nResamples = 0
+
+    @staticmethod
+    def pathRegistryKey():
+        return PathRegistry._pathRegistryKey
+
+    @staticmethod
+    def noneKey():
+        return PathRegistry._noneKey
+
+    @staticmethod
+    def policyChoices():
+        return [PathRegistry._noneKey, PathRegistry._reuseKey, PathRegistry._resampleKey]
+
+    @staticmethod
+    def policy(args) -> str:
+        return getattr(args, PathRegistry._pathRegistryKey, PathRegistry._noneKey)
+
+    # returns manager process serving registries shared dictionaries, None if args policy doesn't register paths
+    @staticmethod
+    def buildManager(args):
+        return None if PathRegistry.policy(args) == PathRegistry._noneKey else Manager()
+
+    # returns new empty registry, shared between processes by manager
+    @staticmethod
+    def build(args, manager):
+        return PathRegistry(PathRegistry.policy(args), {} if manager is None else manager.dict())
+
+    def nPaths(self) -> int:
+        return len(self._paths)
+
+    def stats(self) -> list:
+        return [['Policy', self._policy], ['Hits', self._nHits], ['Resamples', self._nResamples]]
+
+    # path key depends on path widths & train params, train params layers are replaced by their index
+    @staticmethod
+    def pathKey(model, trainParams) -> str:
+        if isinstance(trainParams, tuple):
+            layersList = model.layersList()
+            trainParams = tuple(layersList.index(p) if isinstance(p, Module) else p for p in trainParams)
+
+        return sha1(repr((model.currWidth(), trainParams)).encode()).hexdigest()
+
+    # returns whether we should draw new path instead of path key
+    def resample(self, pathKey: str, nAttempts: int) -> bool:
+        resample = (self._policy == self._resampleKey) and (nAttempts < self._maxResampleAttempts) and (pathKey in self._paths)
+        if resample:
+            self._nResamples += 1
+
+        return resample
+
+    # returns path recorded evaluations on current device, None if path hasn't been evaluated
+    def lookup(self, pathKey: str):
+        if self._policy == self._noneKey:
+            return None
+
+        evaluations = self._paths.get(pathKey)
+        if evaluations is None:
+            return None
+
+        self._nHits += 1
+        return [({k: v.to(getDevice()) for k, v in lossDict.items()}, widthRatio, trainedPathIdx)
+                for lossDict, widthRatio, trainedPathIdx in evaluations]
+
+    # record path evaluations, loss dicts are moved to cpu in order to share them between processes
+    def record(self, pathKey: str, evaluations: list):
+        if self._policy == self._noneKey:
+            return
+
+        self._paths[pathKey] = [({k: v.detach().cpu() for k, v in lossDict.items()}, widthRatio, trainedPathIdx)
+                                for lossDict, widthRatio, trainedPathIdx in evaluations]
@@ -1,6 +1,7 @@
 from abc import abstractmethod
 
 from .TrainPathWeights import TrainPathWeights
+from utils.device import getDevice
 
 
 class Replica:
@@ -10,6 +11,8 @@ class Replica:
 
         # replicate regime model
         self._replicateModel(buildModelFunc, args, modelStateDict, modelAlphas)
+        # paths drawn in advance from alphas distribution
+        self._paths = []
         # init trainWeights instance
         self._trainWeights = TrainPathWeights(getModel=self.getModel, getModelParallel=self.getModel, getArgs=lambda: args, getLogger=lambda: logger,
                                               getTrainQueue=lambda: trainQueue, getValidQueue=lambda: None,
@@ -33,6 +36,26 @@ class Replica:
     def getModel(self):
         return self._cModel
 
+    # set paths list, i.e. layers samples, paths are set by chooseNextPath()
+    def setPaths(self, paths: list):
+        self._paths = list(paths)
+
+    # draw n paths based on alphas distribution, paths are set by chooseNextPath()
+    def drawPaths(self, n: int):
+        self.setPaths(self._cModel.sampleAlphaPaths(n).tolist() if n > 0 else [])
+
+    # set next drawn path as model path, draws a new path if all drawn paths have been used
+    def chooseNextPath(self):
+        if len(self._paths) == 0:
+            self.drawPaths(1)
+
+        self._cModel.setSamplePath(self._paths.pop(0))
+
+    # set a new path drawn from alphas distribution as model path, paths drawn in advance are kept,
+    # i.e. resampled paths don't break paths samplers point sets, e.g. antithetic pairs, nor the paths split between replicas
+    def chooseResampledPath(self):
+        self._cModel.setSamplePath(self._cModel.sampleAlphaPaths(1).tolist()[0])
+
     def _updateWeights(self, srcModelStateDict: dict):
         model = self._cModel
         # copy weights
@@ -48,8 +71,8 @@ class Replica:
     def _replicateModel(self, buildModelFunc, args, modelStateDict: dict, modelAlphas: list):
         # create model new instance
         cModel = buildModelFunc(args)
-        # set model to cuda on specific GPU
-        cModel = cModel.cuda()
+        # set model to process device, i.e. specific GPU
+        cModel = cModel.to(getDevice())
         # set mode to eval mode
         cModel.eval()
         # set as class member
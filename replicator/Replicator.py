@@ -4,13 +4,14 @@ from time import sleep
 from multiprocessing.pool import Pool
 
 from torch import tensor, no_grad, load
-from torch.cuda import set_device
 
 from trainRegimes.regime import TrainRegime
 from models.BaseNet.BaseNet import BaseNet
 from .Replica import Replica
+from .PathRegistry import PathRegistry
 
 from utils.emails import emailException
+from utils.device import replicaDevice, initDevice, getDevice
 
 
 # from multiprocessing import Process
@@ -43,19 +44,24 @@ class ModelReplicator:
         self._model = regime.model
         self.gpuIDs = []
         self._gpusDataPath = regime.args.gpusDataPath
+        self._deviceName = regime.args.device
         self._srcModelStateDict = self._model.state_dict()
         self._modelStateDict = {}
+        # manager process serving paths registries shared between replicas
+        self._pathsRegistryManager = PathRegistry.buildManager(regime.args)
 
     @abstractmethod
     def processResults(self, results: list) -> list:
         raise NotImplementedError('subclasses must override processResults()!')
 
     def _cloneStateDictToGPU(self, modelStateDict: dict, gpu: int):
+        # init GPU gpu device
+        device = replicaDevice(self._deviceName, gpu)
         # init model state_dict clone for GPU gpu
         stateDictClone = {}
         # fill model state_dict clone with tensors on GPU gpu
         for k, v in modelStateDict.items():
-            stateDictClone[k] = v if (v.device.index == gpu) else v.clone().cuda(gpu)
+            stateDictClone[k] = v if (v.device == device) else v.clone().to(device)
 
         return stateDictClone
 
@@ -70,8 +76,10 @@ class ModelReplicator:
     def _cloneModelAlphas(self, modelAlphas: list):
         gpuAlphasClones = {}
         for gpu in set(self.gpuIDs):
+            # init GPU gpu device
+            device = replicaDevice(self._deviceName, gpu)
             # init model state_dict clone for GPU gpu
-            alphasClone = [t.detach() if (t.device.index == gpu) else t.detach().clone().cuda(gpu) for t in modelAlphas]
+            alphasClone = [t.detach() if (t.device == device) else t.detach().clone().to(device) for t in modelAlphas]
             # add model alphas clone on GPU gpu to GPUs dictionary
             gpuAlphasClones[gpu] = alphasClone
 
@@ -88,42 +96,28 @@ class ModelReplicator:
         # update source model state dict
         self._srcModelStateDict = srcModel.state_dict()
 
-    # given paths history dictionary and current path, checks if current path exists in history dictionary
-    @staticmethod
-    def _doesPathExist(pathsHistoryDict: dict, currPath: list) -> bool:
-        currDict = pathsHistoryDict
-        # init boolean flag
-        pathExists = True
-        for v in currPath:
-            if v not in currDict:
-                pathExists = False
-                currDict[v] = {}
-            # update current dict, we move to next layer
-            currDict = currDict[v]
-
-        return pathExists
-
     # select new path based on alphas distribution.
-    # check that selected path hasn't been selected before
+    # draw new path instead of paths registry has evaluated, if registry policy is to resample
+    # returns (path train params, path registry key)
     @staticmethod
-    def _generateNewPath(replica: Replica, pathsHistoryDict: dict) -> list:
+    def _generateNewPath(replica: Replica, pathsRegistry: PathRegistry, generateTrainParams: callable) -> tuple:
         cModel = replica.getModel()
         # restore model original weights & BNs
         replica.restoreModelOriginalWeights()
-        # init does path exist flag
-        pathExists = True
-        while pathExists:
-            # select path based on alphas distribution
-            cModel.choosePathByAlphas()
+        # select path based on alphas distribution, i.e. next path drawn in advance
+        replica.chooseNextPath()
+        nAttempts = 0
+        while True:
             # get selected path indices
-            pathWidthIdx = cModel.currWidthIdx()
-            # # get selected path width
-            # pathWidth = cModel.currWidth()
-            # # check that selected path hasn't been selected before
-            # pathExists = ModelReplicator._doesPathExist(pathsHistoryDict, pathWidth)
-            pathExists = False
+            pathWidthIdx = cModel.currPath()
+            trainParams = generateTrainParams(pathWidthIdx)
+            pathKey = PathRegistry.pathKey(cModel, trainParams)
+            if not pathsRegistry.resample(pathKey, nAttempts):
+                return trainParams, pathKey
 
-        return pathWidthIdx
+            # draw resampled path separately, paths drawn in advance are kept for the next samples
+            replica.chooseResampledPath()
+            nAttempts += 1
 
     # split samples between processes
     def _splitSamples(self, nSamples: int) -> dict:
@@ -142,7 +136,8 @@ class ModelReplicator:
     def _cloneTensors(self, tensorsList: list) -> dict:
         dataPerGPU = {}
         for gpu in self.gpuIDs:
-            gpuTensorsList = [t if (gpu == t.device.index) else t.clone().cuda(gpu) for t in tensorsList]
+            device = replicaDevice(self._deviceName, gpu)
+            gpuTensorsList = [t if (device == t.device) else t.clone().to(device) for t in tensorsList]
             dataPerGPU[gpu] = gpuTensorsList
 
         return dataPerGPU
@@ -189,32 +184,38 @@ class ModelReplicator:
 
     @staticmethod
     @abstractmethod
-    def iterateOverSamples(replica: Replica, lossFunc: callable, dataset, pathsHistoryDict: dict, lossDictsList: list, gpu: int):
+    def iterateOverSamples(replica: Replica, lossFunc: callable, dataset, pathsRegistry: PathRegistry, lossDictsList: list, gpu: int):
         raise NotImplementedError('subclasses must override iterateOverSamples()!')
 
     @abstractmethod
     def replicaClass(self) -> Replica:
         raise NotImplementedError('subclasses must override replicaClass()!')
 
-    def buildArgs(self, dataset, modelAlphas: dict, nSamplesPerCopy: list):
+    def buildArgs(self, dataset, modelAlphas: dict, pathsPerCopy: list, pathsRegistry: PathRegistry):
         regime = self._regime
         args = []
         for gpuIdx, gpu in enumerate(self.gpuIDs):
             data = (regime.buildModel, regime.flopsLoss, self._modelStateDict[gpu], modelAlphas[gpu], self.initLossDictsList(),
                     (regime.getArgs(), regime.getLogger(), regime.getTrainQueue(), regime.getTrainFolderPath()),
-                    dataset, nSamplesPerCopy[gpuIdx], gpu, self.iterateOverSamples, self.replicaClass())
+                    dataset, pathsPerCopy[gpuIdx], gpu, self.iterateOverSamples, self.replicaClass(), pathsRegistry)
 
             args.append(data)
 
         return args
 
-    def loss(self, model: BaseNet, dataset):
+    # returns new empty paths registry, registry paths are evaluated using current weights & alphas
+    def newPathsRegistry(self) -> PathRegistry:
+        return PathRegistry.build(self._regime.args, self._pathsRegistryManager)
+
+    # nSamples overrides GPUs data number of samples, e.g. samples requested by adaptive samples controller
+    # pathsRegistry is registry of paths evaluated earlier under the same weights & alphas, e.g. in previous rounds of the same epoch,
+    # None evaluates paths with a new empty registry
+    def loss(self, model: BaseNet, dataset, nSamples: int = None, pathsRegistry: PathRegistry = None):
         # init new epoch: save model current state dict, clear old state dict from GPUs
         self.initNewEpoch(model)
         # update GPUs data, clone model state dict to GPUs
-        nSamples = self._updateGPUsData()
-        # split samples between model copies (processes)
-        nSamplesPerCopy = self._splitSamples(nSamples)
+        gpusNSamples = self._updateGPUsData()
+        nSamples = gpusNSamples if nSamples is None else nSamples
         # set number of model copies
         nCopies = len(self.gpuIDs)
         # clone model alphas tensors
@@ -222,8 +223,22 @@ class ModelReplicator:
         # clone train set over GPUs
         # IS IT NECESSARY ???
 
-        # generate args per replication
-        args = self.buildArgs(dataset, modelAlphas, nSamplesPerCopy)
+        # init paths registry, registry paths are evaluated using current weights & alphas
+        if pathsRegistry is None:
+            pathsRegistry = self.newPathsRegistry()
+
+        # draw all samples paths together, in a single batched distribution call, and split them between model copies
+        # drawing paths together keeps variance reduced paths samplers point sets, e.g. antithetic pairs, across copies
+        paths = model.sampleAlphaPaths(nSamples).tolist()
+        # budget sampler might draw less paths, when flops budget is almost infeasible
+        nSamples = len(paths)
+        # split samples between model copies (processes)
+        nSamplesPerCopy = self._splitSamples(nSamples)
+        pathsPerCopy = [paths[sum(nSamplesPerCopy[:gpuIdx]):sum(nSamplesPerCopy[:gpuIdx + 1])] for gpuIdx in range(nCopies)]
+
+        # generate args per replication, copies without paths are skipped, i.e. when there are less samples than copies
+        args = [copyArgs for copyArgs, copyPaths in zip(self.buildArgs(dataset, modelAlphas, pathsPerCopy, pathsRegistry), pathsPerCopy)
+                if len(copyPaths) > 0]
 
         # init flag to indicate whether multiprocessing succeeded or failed (due to insufficient space on GPU for example)
         multiProcSuccess = False
@@ -233,7 +248,7 @@ class ModelReplicator:
         sleepTime, sleepTimeMax = 60, (60 * 10)
         while not multiProcSuccess:
             try:
-                with Pool(processes=nCopies, maxtasksperchild=1) as p:
+                with Pool(processes=len(args), maxtasksperchild=1) as p:
                     results = p.map(self.lossPerReplication, args)
                 # if we got here, then multiprocessing succeeded
                 multiProcSuccess = True
@@ -250,6 +265,10 @@ class ModelReplicator:
                 # update sleep time in case of recurring exceptions
                 sleepTime = min(sleepTime * 2, sleepTimeMax)
 
+        # update paths registry info table
+        if self._pathsRegistryManager is not None:
+            self._regime.logger.addInfoTable(PathRegistry.pathRegistryKey(), [['Samples', nSamples], ['Unique paths', pathsRegistry.nPaths()]])
+
         lossDictsList = self.processResults(results)
         # make sure we have calculated nSamples loss for each batch by validating on 1st batch
         assert (len(lossDictsList[0]) == nSamples)
@@ -260,42 +279,41 @@ class ModelReplicator:
     def lossPerReplication(params):
         # extract transferred params to process
         buildModelFunc, lossFunc, modelStateDict, modelAlphas, lossDictsList, trainWeightsElements, \
-        dataset, nSamples, gpu, iterateOverSamples, replicaClass = params
-        # set process GPU
-        set_device(gpu)
+        dataset, paths, gpu, iterateOverSamples, replicaClass, pathsRegistry = params
+        # set process device
+        args = trainWeightsElements[0]
+        initDevice(args.device, gpu)
         # init Replica instance on GPU with updated weights & alphas
         replica = replicaClass(buildModelFunc, modelStateDict, modelAlphas, gpu, trainWeightsElements)
-        # init samples (paths) history, to make sure we don't select the same sample twice
-        pathsHistoryDict = {}
+        # set samples paths drawn by source model
+        replica.setPaths(paths)
+        nSamples = len(paths)
 
         # iterate over samples. generate a sample (path), train it and evaluate alphas on sample
         for sampleIdx in range(nSamples):
             print('===== Sample idx:[{}/{}] - GPU:[{}] ====='.format(sampleIdx, nSamples, gpu))
-            iterateOverSamples(replica, lossFunc, dataset, pathsHistoryDict, lossDictsList, gpu)
+            iterateOverSamples(replica, lossFunc, dataset, pathsRegistry, lossDictsList, gpu)
+
+        # print paths registry statistics
+        print('Paths registry:{}'.format(pathsRegistry.stats()))
 
         return lossDictsList
 
+    # train path & evaluate it over dataset, returns list of (loss dict, width ratio, trained path idx) per batch & trained path
     @staticmethod
-    def evaluateSample(replica: Replica, lossFunc: callable, dataset, pathsHistoryDict: dict, lossDictsList: list,
-                       generateTrainParams: callable, addLossDict: callable):
+    def _evaluatePath(replica: Replica, lossFunc: callable, dataset, trainParams) -> list:
         cModel = replica.getModel()
-        print('alphas:{}'.format(cModel.alphas()))
-        # select new path based on alphas distribution.
-        # check that selected path hasn't been selected before
-        pathWidthIdx = ModelReplicator._generateNewPath(replica, pathsHistoryDict)
-        print('Configuration layers width:{}'.format(cModel.currWidth()))
         # train model on path
-        trainParams = generateTrainParams(pathWidthIdx)
         evalPaths = replica.train(trainParams)
         # switch to eval mode
         cModel.eval()
-        # init path loss dictionaries list
-        pathLossDictsList = []
+        # init path evaluations list
+        evaluations = []
         # evaluate batch over trained paths
         with no_grad():
             for input, target in dataset:
-                input = input.cuda().clone().detach().requires_grad_(False)
-                target = target.cuda(async=True).clone().detach().requires_grad_(False)
+                input = input.to(getDevice()).clone().detach().requires_grad_(False)
+                target = target.to(getDevice(), non_blocking=True).clone().detach().requires_grad_(False)
 
                 # # init homogeneous logits over batch dictionary
                 # # keys are the homogeneous width flops, not homogeneous width
@@ -312,12 +330,39 @@ class ModelReplicator:
                     # set cModel path to trained path
                     cModel.setCurrWidthIdx(trainedPathIdx)
                     # forward input in model selected path
-                    logits = cModel(input)
+                    logits = cModel.tracedForward(input)
                     # calc loss
-                    lossDict = lossFunc(logits, target, cModel.countFlops())
+                    lossDict = lossFunc(logits, target, lossFunc.pathCost(cModel, trainedPathIdx))
                     # lossDict = lossFunc(logits, target, cModel.countFlops(), homogeneousLogits)
-                    # add loss to container
-                    addLossDict(lossDict, pathLossDictsList, widthRatio, trainedPathIdx)
+                    # add evaluation to list
+                    evaluations.append((lossDict, widthRatio, trainedPathIdx))
+
+        # print traced paths cache statistics
+        cModel.logTracedPaths(loggerFuncs=[lambda rows: print('Traced paths:{}'.format(rows))])
+
+        return evaluations
+
+    @staticmethod
+    def evaluateSample(replica: Replica, lossFunc: callable, dataset, pathsRegistry: PathRegistry, lossDictsList: list,
+                       generateTrainParams: callable, addLossDict: callable):
+        cModel = replica.getModel()
+        print('alphas:{}'.format(cModel.alphas()))
+        # select new path based on alphas distribution.
+        trainParams, pathKey = ModelReplicator._generateNewPath(replica, pathsRegistry, generateTrainParams)
+        print('Configuration layers width:{}'.format(cModel.currWidth()))
+        # reuse path evaluations if path has been evaluated before, otherwise train & evaluate path
+        evaluations = pathsRegistry.lookup(pathKey)
+        if evaluations is None:
+            evaluations = ModelReplicator._evaluatePath(replica, lossFunc, dataset, trainParams)
+            pathsRegistry.record(pathKey, evaluations)
+
+        # init path loss dictionaries list
+        pathLossDictsList = []
+        for lossDict, widthRatio, trainedPathIdx in evaluations:
+            # set cModel path to trained path
+            cModel.setCurrWidthIdx(trainedPathIdx)
+            # add loss to container
+            addLossDict(lossDict, pathLossDictsList, widthRatio, trainedPathIdx)
 
         # add path loss dictionaries list to lossDictsList
         lossDictsList.append(pathLossDictsList)
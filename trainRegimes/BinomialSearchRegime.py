@@ -1,7 +1,8 @@
 from .SearchRegime import SearchRegime, EpochTrainWeights, HtmlLogger
 from models.BaseNet.BaseNet_binomial import BaseNet_Binomial
 from replicator.BinomialReplicator import BinomialReplicator
-from torch import zeros
+from torch import tensor, float32
+from utils.device import getDevice
 
 
 class BinomialTrainWeights(EpochTrainWeights):
@@ -57,6 +58,10 @@ class BinomialSearchRegime(SearchRegime):
             container[self.epochLossAvgTemplate.format(k)] = [{0: []}]
         # add loss variance keys
         container[self.batchLossVarianceTemplate.format(lossClass.totalKey())] = [{0: []}]
+        # add gradient variance ratio key
+        container[self.gradientVarianceRatioKey] = [{0: []}]
+        # add replay effective sample size key
+        container[self.replayEffectiveSamplesKey] = [{0: []}]
 
         return container
 
@@ -69,13 +74,20 @@ class BinomialSearchRegime(SearchRegime):
 
     def _pathsListToRows(self, batchLossDictsList: list) -> list:
         pathsListRows = [['#', 'Paths']]
-        for pathIdx, (lossDict, widthDiffDict, partitionRatio) in enumerate(batchLossDictsList):
+        for pathIdx, (lossDict, widthDiffDict, partitionRatio, _) in enumerate(batchLossDictsList):
             # build formatted loss dict
             formattedLossDict = {k: '{:.3f}'.format(v) for k, v in lossDict.items()}
             pathsListRows.append([pathIdx + 1, [['Path', partitionRatio], ['Loss', self.formats[self.trainLossKey](formattedLossDict)]]])
 
         return pathsListRows
 
+    # paths samples are layers sampled widths
+    def _pathsSamples(self, batchLossDictsList: list):
+        return tensor([sample for _, _, _, sample in batchLossDictsList])
+
+    def _hasPathsScores(self) -> bool:
+        return True
+
     def _getListFunc(self):
         return lambda key: lambda containers: containers[key][0][0]
 
@@ -84,7 +96,7 @@ class BinomialSearchRegime(SearchRegime):
 
     # updates alphas gradients
     # updates statistics
-    def _updateAlphasGradients(self, lossDictsPartitionList: list) -> dict:
+    def _updateAlphasGradients(self, lossDictsPartitionList: list, batchNum: int) -> dict:
         model = self.model
         nSamples = len(lossDictsPartitionList)
         totalKey = self.flopsLoss.totalKey()
@@ -96,24 +108,25 @@ class BinomialSearchRegime(SearchRegime):
         lossDictsList = []
         # init losses averages
         lossAvgDict = {k: 0.0 for k in self.flopsLoss.lossKeys()}
-        # init model alphas gradient tensor
-        alphasGrad = [zeros(1, requires_grad=True).cuda() for _ in range(nAlphas)]
+        # init paths scores, i.e. layers diff, and paths losses
+        scores, losses = [], []
         # iterate over losses
-        for lossDict, diffList, partitionRatio in lossDictsPartitionList:
+        for lossDict, diffList, partitionRatio, _ in lossDictsPartitionList:
             # add lossDict to loss dicts list
             lossDictsList.append(lossDict)
             # sum loss by keys
             for k, v in lossDict.items():
                 lossAvgDict[k] += v.item()
-            # calc lossDict contribution to each layer alpha gradient
-            assert (len(alphasGrad) == len(diffList))
-            for layerIdx, diff in enumerate(diffList):
-                alphasGrad[layerIdx] += (diff * lossDict[totalKey].item())
+            # add path layers diff & loss, lossDict contribution to each layer alpha gradient is diff * loss
+            assert (nAlphas == len(diffList))
+            scores.append(diffList)
+            losses.append(lossDict[totalKey].item())
 
-        # average gradient and put in layer.alpha.grad
+        # calc gradient and put in layer.alpha.grad
+        alphasGrad = self._alphasGradient(tensor(scores, dtype=float32, device=getDevice()), tensor(losses, device=getDevice()), batchNum)
         assert (len(alphas) == len(alphasGrad))
         for alpha, alphaGrad in zip(alphas, alphasGrad):
-            alpha.grad = (alphaGrad / nSamples)
+            alpha.grad = alphaGrad.view(1)
         # update gradient
         # average losses
         for k in lossAvgDict.keys():
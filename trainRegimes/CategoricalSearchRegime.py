@@ -3,6 +3,7 @@ from models.BaseNet.BaseNet_categorical import BaseNet_Categorical
 from replicator.CategoricalReplicator import CategoricalReplicator
 from scipy.stats import entropy
 from torch import zeros
+from utils.device import getDevice
 
 
 class CategoricalSearchRegime(SearchRegime):
@@ -59,7 +60,7 @@ class CategoricalSearchRegime(SearchRegime):
 
     # updates alphas gradients
     # updates statistics
-    def _updateAlphasGradients(self, lossDictsList: list) -> dict:
+    def _updateAlphasGradients(self, lossDictsList: list, batchNum: int) -> dict:
         model = self.model
         totalKey = self.flopsLoss.totalKey()
 
@@ -79,7 +80,7 @@ class CategoricalSearchRegime(SearchRegime):
             # add to model probs list
             probsList.append(layerProbs)
             # init layer alphas gradient vector
-            layerAlphasGrad = zeros(layer.nWidths(), requires_grad=True).cuda()
+            layerAlphasGrad = zeros(layer.nWidths(), requires_grad=True).to(getDevice())
             # iterate over alphas
             for idx, alphaLossDict in enumerate(layerLossDicts):
                 alphaLossAvgDict = {}
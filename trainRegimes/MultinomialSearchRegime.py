@@ -3,7 +3,8 @@ from models.BaseNet.BaseNet_multinomial import BaseNet_Multinomial
 from replicator.MultinomialReplicator import MultinomialReplicator
 from scipy.stats import entropy
 from itertools import groupby
-from torch import zeros
+from torch import zeros, tensor, stack
+from utils.device import getDevice
 
 
 class MultinomialSearchRegime(SearchRegime):
@@ -31,6 +32,10 @@ class MultinomialSearchRegime(SearchRegime):
             container[self.batchLossAvgTemplate.format(k)] = [{0: []}]
         # add loss variance keys
         container[self.batchLossVarianceTemplate.format(lossClass.totalKey())] = [{0: []}]
+        # add gradient variance ratio key
+        container[self.gradientVarianceRatioKey] = [{0: []}]
+        # add replay effective sample size key
+        container[self.replayEffectiveSamplesKey] = [{0: []}]
 
         return container
 
@@ -54,9 +59,16 @@ class MultinomialSearchRegime(SearchRegime):
             alphaTitle = self._alphaPlotTitle(layer, alphaIdx)
             stats.addValue(lambda containers: containers[alphaDistributionKey][0][alphaTitle], p.item())
 
+    # paths samples are layers width indices
+    def _pathsSamples(self, batchLossDictsList: list):
+        return tensor([partition for _, partition in batchLossDictsList])
+
+    def _hasPathsScores(self) -> bool:
+        return True
+
     # updates alphas gradients
     # updates statistics
-    def _updateAlphasGradients(self, lossDictsPartitionList: list) -> dict:
+    def _updateAlphasGradients(self, lossDictsPartitionList: list, batchNum: int) -> dict:
         model = self.model
         nSamples = len(lossDictsPartitionList)
         totalKey = self.flopsLoss.totalKey()
@@ -69,8 +81,8 @@ class MultinomialSearchRegime(SearchRegime):
         lossDictsList = []
         # init losses averages
         lossAvgDict = {k: 0.0 for k in self.flopsLoss.lossKeys()}
-        # calc v2
-        v2 = zeros(nAlphas, requires_grad=True).cuda()
+        # init paths scores, i.e. partition groups size - expected groups size, and paths losses
+        scores, losses = [], []
         for lossDict, partition in lossDictsPartitionList:
             # add lossDict to loss dicts list
             lossDictsList.append(lossDict)
@@ -80,26 +92,23 @@ class MultinomialSearchRegime(SearchRegime):
             # group alphas indices from partition
             groups = groupby(partition, key=lambda x: x)
             # sort groups size in a tensor
-            partitionGroupsSize = zeros(nAlphas).cuda()
+            partitionGroupsSize = zeros(nAlphas).to(getDevice())
             for _, group in groups:
                 group = list(group)
                 if len(group) > 0:
                     partitionGroupsSize[group[0]] = len(group)
-            # add weighted loss sum to v2
-            v2 += (lossDict[totalKey].item() * partitionGroupsSize)
+            # add path score & loss
+            scores.append(partitionGroupsSize - (model.nLayers() * probs))
+            losses.append(lossDict[totalKey].item())
 
-        # average weighted loss sum
-        v2 /= nSamples
         # average losses
         for k in lossAvgDict.keys():
             lossAvgDict[k] /= nSamples
 
         # init total loss average
         lossAvg = lossAvgDict[totalKey]
-        # calc v1
-        v1 = lossAvg * model.nLayers() * probs
-        # update alphas grad = E[I_ni*Loss] - E[I_ni]*E[Loss] = v2 - v1
-        alphas.grad = v2 - v1
+        # update alphas grad = E[I_ni*Loss] - E[I_ni]*E[Loss] = E[(I_ni - E[I_ni]) * (Loss - baseline)]
+        alphas.grad = self._alphasGradient(stack(scores), tensor(losses, device=getDevice()), batchNum)
 
         # calc loss variance
         lossVariance = [((x[totalKey].item() - lossAvg) ** 2) for x in lossDictsList]
@@ -4,7 +4,7 @@ from torch import save as saveCheckpoint
 
 from utils.trainWeights import TrainWeights, EpochData
 from utils.training import TrainingOptimum
-from utils.checkpoint import save_checkpoint
+from utils.checkpoint import save_checkpoint, save_dense_checkpoint
 
 
 class OptimalTrainWeights(TrainWeights):
@@ -74,6 +74,10 @@ class OptimalTrainWeights(TrainWeights):
 
         # save model checkpoint
         save_checkpoint(self.getTrainFolderPath(), model, optimizer, validAccDict, is_best)
+        # save partition optimal weights as standalone dense model
+        partitionPath = dict(model.baselineWidth()).get(model.partitionKey())
+        if is_best and (partitionPath is not None):
+            save_dense_checkpoint(self.getTrainFolderPath(), model, partitionPath, validAccDict)
 
         # add data to main logger table
         logger.addDataRow(dataRow)
@@ -92,9 +96,10 @@ class OptimalTrainWeights(TrainWeights):
         # save optimal validation values
         setattr(args, self.validAccKey, optAcc)
         setattr(args, self.validLossKey, optLoss)
-        # remove model flops from args
+        # remove model flops & latency from args
         model = self.getModel()
         setattr(args, model.modelFlopsKey(), None)
+        setattr(args, model.modelLatencyKey(), None)
 
 
 class OptimalRegime(TrainRegime):
@@ -1,8 +1,9 @@
 from os import makedirs
 from time import time
+from math import inf
 from argparse import Namespace
 
-from torch import tensor
+from torch import tensor, cat, ones
 from torch import save as saveCheckpoint
 from torch.optim.sgd import SGD
 from torch.optim.lr_scheduler import ReduceLROnPlateau
@@ -11,11 +12,16 @@ from .regime import TrainRegime, abstractmethod
 from .PreTrainedRegime import PreTrainedTrainWeights, EpochData
 from models.BaseNet.BaseNet import BaseNet
 from models.modules.SlimLayer import SlimLayer
-from utils.flopsLoss import FlopsLoss
+from utils.flopsLoss import FlopsLoss, LatencyLoss, MemoryLoss
 from utils.HtmlLogger import HtmlLogger
 from utils.trainWeights import TrainWeights
+from utils.pathRefiner import PathRefiner
+from utils.lossBaseline import LossBaseline
+from utils.replayStore import ReplayStore
+from utils.sampleController import SampleController
 from utils.checkpoint import save_checkpoint
 from utils.training import AlphaTrainingStats
+from utils.device import getDevice
 
 
 class EpochTrainWeights(PreTrainedTrainWeights):
@@ -109,22 +115,30 @@ class SearchRegime(TrainRegime):
     widthKey = TrainWeights.widthKey
     lrKey = TrainWeights.lrKey
     validFlopsRatioKey = TrainWeights.flopsRatioKey
+    memoryKey = TrainWeights.memoryKey
+    flopsDistributionKey = 'Flops distribution'
 
     # init table columns
     k = 2
     alphasTableTitle = 'Alphas (top [{}])'.format(k)
     # init table columns names
     colsTrainAlphas = [batchNumKey, archLossKey, alphasTableTitle, pathsListKey, gradientsKey]
-    colsMainLogger = [epochNumKey, archLossKey, trainLossKey, trainAccKey, validLossKey, validAccKey, validFlopsRatioKey, widthKey, lrKey]
+    colsMainLogger = [epochNumKey, archLossKey, trainLossKey, trainAccKey, validLossKey, validAccKey, validFlopsRatioKey, flopsDistributionKey,
+                      memoryKey, widthKey, lrKey]
 
     # init statistics (plots) keys template
     batchLossAvgTemplate = '{}_Loss_Avg_(Batch)'
     epochLossAvgTemplate = '{}_Loss_Avg_(Epoch)'
     batchLossVarianceTemplate = '{}_Loss_Variance_(Batch)'
+    # number of flops distribution histogram bins
+    flopsHistogramBins = 10
+
     # init statistics (plots) keys
     entropyKey = 'Alphas_Entropy'
     batchAlphaDistributionKey = 'Alphas_Distribution_(Batch)'
     epochAlphaDistributionKey = 'Alphas_Distribution_(Epoch)'
+    gradientVarianceRatioKey = 'Alphas_Gradient_Variance_Ratio_(Batch)'
+    replayEffectiveSamplesKey = 'Replay_Effective_Samples_(Batch)'
 
     # init formats for keys
     formats = {
@@ -132,7 +146,9 @@ class SearchRegime(TrainRegime):
     }
 
     def __init__(self, args, logger):
-        self.lossClass = FlopsLoss
+        # select loss class by path cost we optimize
+        lossClasses = {BaseNet.flopsCostKey(): FlopsLoss, BaseNet.latencyCostKey(): LatencyLoss, BaseNet.memoryCostKey(): MemoryLoss}
+        self.lossClass = lossClasses[getattr(args, BaseNet.costKey(), BaseNet.flopsCostKey())]
         super(SearchRegime, self).__init__(args, logger)
 
         # init number of epochs
@@ -148,8 +164,30 @@ class SearchRegime(TrainRegime):
         self.formats[self.epochNumKey] = lambda x: '{}/{}'.format(x, self.nEpochs)
 
         # init flops loss
-        self.flopsLoss = FlopsLoss(args, getattr(args, self.model.baselineFlopsKey()))
-        self.flopsLoss = self.flopsLoss.cuda()
+        baselineFlopsDict = getattr(args, self.model.baselineFlopsKey())
+        if self.lossClass is LatencyLoss:
+            # measure model layers latency, before replications are built
+            self.model.initLayersLatency(args)
+            self.flopsLoss = LatencyLoss(args, baselineFlopsDict, self.model.calcBaselineLatency(restoreOrgStateFlag=True))
+        elif self.lossClass is MemoryLoss:
+            self.flopsLoss = MemoryLoss(args, baselineFlopsDict, self.model.calcBaselineMemoryBytes(restoreOrgStateFlag=True))
+        else:
+            self.flopsLoss = FlopsLoss(args, baselineFlopsDict)
+        self.flopsLoss = self.flopsLoss.to(getDevice())
+        # init alphas gradient estimator baseline
+        self.lossBaseline = LossBaseline.build(args)
+        # init replay store of previous epochs paths evaluations, None if replay is disabled
+        self.replayStore = ReplayStore.build(args)
+        # model weights version, paths evaluations are valid under the weights they have been evaluated with.
+        # search doesn't update model weights, i.e. version should be incremented if it would, or if paths change their meaning
+        self.weightsVersion = 0
+        # init adaptive epoch samples controller, None if epoch samples number is fixed
+        self.sampleController = SampleController.build(args)
+        # alphas gradient relative standard error is estimated from paths scores, i.e. regimes without them keep gpus data nSamples
+        if (self.sampleController is not None) and (not self._hasPathsScores()):
+            print('*** WARNING: [{}] requires paths scores, which [{}] doesn\'t define, epoch samples number is fixed by gpus data nSamples'
+                  .format(SampleController.samplesRSEKey(), self.__class__.__name__))
+            self.sampleController = None
 
         # create search queue
         self.search_queue = self.createSearchQueue()
@@ -206,9 +244,93 @@ class SearchRegime(TrainRegime):
     # updates alphas gradients
     # updates statistics
     @abstractmethod
-    def _updateAlphasGradients(self, lossDictsList: list) -> dict:
+    def _updateAlphasGradients(self, lossDictsList: list, batchNum: int) -> dict:
         raise NotImplementedError('subclasses must override _updateAlphasGradients()!')
 
+    # returns (nPaths x nLayers) tensor of batch paths samples, i.e. values model.setSamplePath() sets
+    # returns None if regime paths can't be replayed
+    def _pathsSamples(self, batchLossDictsList: list):
+        return None
+
+    # returns whether regime paths samples have scores, i.e. whether paths alphas gradient contributions are defined
+    def _hasPathsScores(self) -> bool:
+        return False
+
+    # returns list of (nPaths x nVariables) paths alphas gradient contributions per batch, under current alphas & loss baseline
+    # returns None if regime paths scores aren't defined
+    def _pathsContributions(self, lossDictsList: list):
+        totalKey = self.flopsLoss.totalKey()
+        samples = self._pathsSamples(lossDictsList[0])
+        scores = None if samples is None else self.model.samplesScores(samples)
+        if scores is None:
+            return None
+
+        # paths drawn under flops budget are scored under the conditional distribution
+        budgetMoments = self.model.budgetMoments()
+        if budgetMoments is not None:
+            scores = scores - budgetMoments[0]
+
+        scores = scores.to(getDevice())
+        return [self.lossBaseline.contributions(scores, tensor([pathEvaluation[0][totalKey].item() for pathEvaluation in batchLossDictsList],
+                                                               device=getDevice())) for batchLossDictsList in lossDictsList]
+
+    # evaluates more paths until alphas gradient relative standard error reaches controller target, returns all paths evaluations
+    # all epoch rounds share the same paths registry, i.e. paths evaluated in previous rounds are reused, since weights & alphas are the same
+    def _adaptEpochSamples(self, search_queue) -> list:
+        controller = self.sampleController
+        pathsRegistry = self.replicator.newPathsRegistry()
+        lossDictsList = self.replicator.loss(self.model, search_queue, controller.minSamples(), pathsRegistry)
+        while True:
+            nSamples = len(lossDictsList[0])
+            contributions = self._pathsContributions(lossDictsList)
+            rse = inf if contributions is None else controller.relativeStandardError(contributions)
+            nNextSamples = controller.nextSamples(nSamples, rse)
+            if nNextSamples == 0:
+                break
+
+            nextLossDictsList = self.replicator.loss(self.model, search_queue, nNextSamples, pathsRegistry)
+            lossDictsList = [batchLossDictsList + nextBatchLossDictsList for batchLossDictsList, nextBatchLossDictsList in
+                             zip(lossDictsList, nextLossDictsList)]
+
+        # update samples controller info table
+        self.logger.addInfoTable(SampleController.samplesRSEKey(), [['Samples', nSamples], ['RSE', '{:.3f}'.format(rse)]])
+
+        return lossDictsList
+
+    # returns (nPaths) tensor of paths samples log probability under current alphas, given budget moments under current alphas
+    # paths drawn under flops budget have the conditional distribution log probability, i.e. alphas distribution log probability - log mass
+    def _samplesLogProb(self, samples, budgetMoments):
+        logProb = self.model.samplesLogProb(samples)
+        return logProb if budgetMoments is None else (logProb - budgetMoments[1])
+
+    # returns alphas gradient estimate, given (nPaths x nVariables) paths scores & (nPaths) paths losses over search batch batchNum
+    # stored paths of previous epochs are added with truncated importance weights, i.e. min(current alphas prob / sampling alphas prob, truncation)
+    # paths drawn under flops budget are drawn from the conditional distribution, therefore their scores are centred by the conditional mean score,
+    # and their importance weights are the conditional distributions ratio, whose mass changes with alphas
+    # adds gradient variance ratio due to loss baseline & paths effective sample size to statistics
+    def _alphasGradient(self, scores: tensor, losses: tensor, batchNum: int) -> tensor:
+        model = self.model
+        budgetMoments = model.budgetMoments()
+        weights = ones(len(losses), device=scores.device)
+        replay = None if self.replayStore is None else self.replayStore.batch(batchNum, self.weightsVersion)
+        if replay is not None:
+            replaySamples, replayLogProb, replayLosses = replay
+            replayLogRatio = self._samplesLogProb(replaySamples, budgetMoments) - replayLogProb.to(scores.device)
+            replayWeights = replayLogRatio.exp().clamp(max=self.replayStore.truncation())
+            scores = cat([scores, model.samplesScores(replaySamples).to(scores.device, scores.dtype)])
+            losses = cat([losses, replayLosses.to(losses.device, losses.dtype)])
+            weights = cat([weights, replayWeights.to(weights.dtype)])
+
+        if budgetMoments is not None:
+            scores = scores - budgetMoments[0].to(scores.device, scores.dtype)
+
+        gradient, varianceRatio = self.lossBaseline.gradient(scores, losses, weights)
+        self.statistics.addValue(lambda containers: containers[self.gradientVarianceRatioKey][0][0], varianceRatio)
+        effectiveSamples = ((weights.sum() ** 2) / (weights * weights).sum()).item()
+        self.statistics.addValue(lambda containers: containers[self.replayEffectiveSamplesKey][0][0], effectiveSamples)
+
+        return gradient
+
     def _alphaPlotTitle(self, layer: SlimLayer, alphaIdx: int) -> str:
         return '{} ({})'.format(layer.widthRatioByIdx(alphaIdx), layer.widthByIdx(alphaIdx))
 
@@ -250,8 +372,14 @@ class SearchRegime(TrainRegime):
         startTime = time()
         # choose nSamples paths, train them, evaluate them over search_queue
         # lossDictsList is a list of lists where each list contains losses of specific batch
-        lossDictsList = replicator.loss(model, search_queue)
+        if self.sampleController is None:
+            lossDictsList = replicator.loss(model, search_queue)
+        else:
+            lossDictsList = self._adaptEpochSamples(search_queue)
         calcTime = time() - startTime
+        # epoch paths samples & their log probability under alphas they have been drawn from, i.e. before alphas steps
+        epochSamples = None if self.replayStore is None else self._pathsSamples(lossDictsList[0])
+        epochLogProb = None if epochSamples is None else self._samplesLogProb(epochSamples, model.budgetMoments())
 
         trainLogger = loggers.get(self.trainLoggerKey)
         if trainLogger:
@@ -261,7 +389,7 @@ class SearchRegime(TrainRegime):
             # reset optimizer gradients
             optimizer.zero_grad()
             # update statistics and alphas gradients based on loss
-            lossAvgDict = self._updateAlphasGradients(batchLossDictsList)
+            lossAvgDict = self._updateAlphasGradients(batchLossDictsList, batchNum)
             # perform optimizer step
             optimizer.step()
 
@@ -293,6 +421,14 @@ class SearchRegime(TrainRegime):
                 # add row to data table
                 trainLogger.addDataRow(dataRow)
 
+        # update loss baseline with epoch paths, after all epoch batches gradients have been computed
+        self.lossBaseline.endEpoch()
+        # store epoch paths evaluations for next epochs
+        if epochLogProb is not None:
+            totalKey = self.flopsLoss.totalKey()
+            epochLosses = tensor([[pathEvaluation[0][totalKey].item() for pathEvaluation in batchLossDictsList] for batchLossDictsList in lossDictsList])
+            self.replayStore.add(epochSamples, epochLogProb, epochLosses.t(), self.weightsVersion)
+
         epochLossDict = trainStats.epochLoss()
         # log summary row
         summaryDataRow = {self.batchNumKey: self.summaryKey, self.archLossKey: epochLossDict}
@@ -325,6 +461,16 @@ class SearchRegime(TrainRegime):
         table = self.logger.createInfoTable('Show', rows)
         return table
 
+    # flops ratio expected value, std & histogram of alphas distribution
+    def _createFlopsDistributionTable(self, flopsDistribution, baselineFlops: float):
+        mean, variance = flopsDistribution.moments()
+        rows = [['Mean', '{:.3f}'.format(mean.item() / baselineFlops)], ['Std', '{:.3f}'.format(max(variance.item(), 0.0) ** 0.5 / baselineFlops)]]
+        binsEdges, binsProbs = flopsDistribution.histogram(self.flopsHistogramBins)
+        for low, high, prob in zip(binsEdges[:-1], binsEdges[1:], binsProbs):
+            rows.append(['[{:.3f}, {:.3f})'.format(low / baselineFlops, high / baselineFlops), '{:.3f}'.format(prob)])
+
+        return self.logger.createInfoTable('Show', rows)
+
     def _createJob(self, epoch: int, id: int, choosePathFunc: callable) -> dict:
         model = self.model
         args = self.args
@@ -349,12 +495,18 @@ class SearchRegime(TrainRegime):
         modelFlopsKey = BaseNet.modelFlopsKey()
         # reset model flops dict
         setattr(job, modelFlopsKey, None)
+        # reset model latency, it is measured by search only
+        setattr(job, BaseNet.modelLatencyKey(), None)
+        # set path memory footprint, i.e. bytes of single sample inference
+        job.memoryBytes = model.memoryBytes()
         # save job
         jobPath = '{}/{}.pth.tar'.format(self.jobsPath, job.jobName)
         saveCheckpoint(job, jobPath)
 
         # add flops ratio to data row
         dataRow[self.validFlopsRatioKey] = model.flopsRatio()
+        # add path memory footprint to data row
+        dataRow[self.memoryKey] = job.memoryBytes
         # add path width ratio to data row
         dataRow[self.widthKey] = self._createPartitionInfoTable(job.partition)
         # add epoch number to data row
@@ -367,13 +519,14 @@ class SearchRegime(TrainRegime):
     def _createEpochJobs(self, epoch: int) -> list:
         # init epoch data rows list
         epochDataRows = []
-        # init model path chooser function
-        choosePathFunc = self.model.choosePathAlphasAsPartition
-        for id in self._getEpochRange(self.args.nJobs):
+        model = self.model
+        # only 1st job should be based on alphas max, the rest should sample from alphas distribution
+        # draw sampled jobs paths together, in a single batched distribution call
+        paths = model.sampleAlphaPaths(self.args.nJobs - 1).tolist() if self.args.nJobs > 1 else []
+        choosePathFuncs = [model.choosePathAlphasAsPartition] + [(lambda path=path: model.setSamplePath(path)) for path in paths]
+        for id, choosePathFunc in zip(self._getEpochRange(self.args.nJobs), choosePathFuncs):
             jobDataRow = self._createJob(epoch, id, choosePathFunc)
             epochDataRows.append(jobDataRow)
-            # only 1st job should be based on alphas max, the rest should sample from alphas distribution
-            choosePathFunc = self.model.choosePathByAlphas
 
         return epochDataRows
 
@@ -406,11 +559,19 @@ class SearchRegime(TrainRegime):
             epochLossDict, alphasDataRow = self.trainAlphas(self.valid_queue, optimizer, epoch, loggersDict)
             # update scheduler
             scheduler.step(epochLossDict.get(self.flopsLoss.totalKey()))
+            # remove negligible widths from search space
+            self._pruneWidths(optimizer, epoch)
 
             # calc model choosePathAlphasAsPartition flops ratio
             model.choosePathAlphasAsPartition()
             # add values to alphas data row
-            additionalData = {self.epochNumKey: epoch, self.lrKey: optimizer.param_groups[0]['lr'], self.validFlopsRatioKey: model.flopsRatio()}
+            additionalData = {self.epochNumKey: epoch, self.lrKey: optimizer.param_groups[0]['lr'], self.validFlopsRatioKey: model.flopsRatio(),
+                              self.memoryKey: model.memoryBytes()}
+            # alphas flops distribution replaces alphas partition path flops ratio, if model has closed-form flops distribution
+            flopsDistribution = model.flopsDistribution()
+            if flopsDistribution is not None:
+                additionalData[self.validFlopsRatioKey] = flopsDistribution.expectedFlops().item() / model.baselineFlops
+                additionalData[self.flopsDistributionKey] = self._createFlopsDistributionTable(flopsDistribution, model.baselineFlops)
             self._applyFormats(additionalData)
             # add alphas data row
             alphasDataRow.update(additionalData)
@@ -419,6 +580,48 @@ class SearchRegime(TrainRegime):
             # save checkpoint
             save_checkpoint(self.trainFolderPath, model, optimizer, epochLossDict)
 
+        # refine alphas partition path by local search
+        nRefineSteps = getattr(args, PathRefiner.refineStepsKey(), 0)
+        if nRefineSteps > 0:
+            self.refinePath(nRefineSteps)
+
+    # remove widths whose alphas probability is below prune threshold, from prune epoch on
+    def _pruneWidths(self, optimizer, epoch: int):
+        args = self.args
+        model = self.model
+        pruneEpoch = getattr(args, BaseNet.pruneEpochKey(), 0)
+        if (pruneEpoch <= 0) or (epoch < pruneEpoch):
+            return
+
+        layersWidthsIdx = model.negligibleWidths(getattr(args, BaseNet.pruneThresholdKey()))
+        if (layersWidthsIdx is None) or all(len(widthsIdx) == 0 for widthsIdx in layersWidthsIdx):
+            return
+
+        rows = [['Layer #', 'Widths']] + [[layerIdx, [layer.widthRatioByIdx(idx) for idx in widthsIdx]]
+                                          for layerIdx, (layer, widthsIdx) in enumerate(zip(model.layersList(), layersWidthsIdx)) if len(widthsIdx) > 0]
+        alphasShapes = [alphas.shape for alphas in model.alphas()]
+        model.removeLayersWidths(layersWidthsIdx)
+        # reset pruned alphas momentum
+        for alphas, shape in zip(model.alphas(), alphasShapes):
+            if alphas.shape != shape:
+                optimizer.state.pop(alphas, None)
+        # width indices have changed their meaning, i.e. stored paths are stale, and learned baseline might refer to removed alphas
+        self.weightsVersion += 1
+        self.lossBaseline = LossBaseline.build(args)
+
+        self.logger.addInfoTable('Pruned widths - Epoch:[{}]'.format(epoch), rows)
+
+    # local search from alphas partition path, refined path is saved as job
+    def refinePath(self, nSteps: int):
+        model = self.model
+        nBatches = getattr(self.args, PathRefiner.refineBatchesKey(), PathRefiner.defaultBatches())
+        refiner = PathRefiner(model, self.flopsLoss, self.valid_queue, nBatches)
+        sample, rows = refiner.refine(nSteps)
+        self.logger.addInfoTable('Path refinement', rows)
+        # create refined path job, i.e. train it as any other sampled path
+        jobDataRow = self._createJob(self.nEpochs + 1, 0, lambda: model.setSamplePath(sample))
+        self.logger.addDataRow(jobDataRow, trType='<tr bgcolor="#2CBDD6">')
+
             # # create jobs and train model weights
             # if (epoch % args.train_weights_interval) == 0:
             #     # create epoch jobs
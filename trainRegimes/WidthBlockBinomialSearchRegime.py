@@ -1,4 +1,4 @@
-from .BinomialSearchRegime import BinomialSearchRegime, zeros
+from .BinomialSearchRegime import BinomialSearchRegime, tensor, float32, getDevice
 from replicator.BinomialReplicator import BlockBinomialReplicator
 from models.BaseNet.BaseNet_widthblock_binomial import BaseNet_WidthBlock_Binomial
 
@@ -38,6 +38,10 @@ class WidthBlockBinomialSearchRegime(BinomialSearchRegime):
             container[self.epochLossAvgTemplate.format(k)] = [{0: []}]
         # add loss variance keys
         container[self.batchLossVarianceTemplate.format(lossClass.totalKey())] = [{0: []}]
+        # add gradient variance ratio key
+        container[self.gradientVarianceRatioKey] = [{0: []}]
+        # add replay effective sample size key
+        container[self.replayEffectiveSamplesKey] = [{0: []}]
 
         return container
 
@@ -50,7 +54,7 @@ class WidthBlockBinomialSearchRegime(BinomialSearchRegime):
 
     # updates alphas gradients
     # updates statistics
-    def _updateAlphasGradients(self, lossDictsPartitionList: list) -> dict:
+    def _updateAlphasGradients(self, lossDictsPartitionList: list, batchNum: int) -> dict:
         model = self.model
         totalKey = self.flopsLoss.totalKey()
         nSamples = len(lossDictsPartitionList)
@@ -62,25 +66,25 @@ class WidthBlockBinomialSearchRegime(BinomialSearchRegime):
         lossDictsList = []
         # init losses averages
         lossAvgDict = {k: 0.0 for k in self.flopsLoss.lossKeys()}
-        # init model alphas gradient tensor
-        alphasGrad = {width: zeros(1, requires_grad=True).cuda() for width in alphasDict.keys()}
+        # init paths scores, i.e. blocks width diff, and paths losses
+        scores, losses = [], []
         # iterate over losses
-        for lossDict, widthDiffDict, partitionRatio in lossDictsPartitionList:
+        for lossDict, widthDiffDict, partitionRatio, _ in lossDictsPartitionList:
             # add lossDict to loss dicts list
             lossDictsList.append(lossDict)
             # sum loss by keys
             for k, v in lossDict.items():
                 lossAvgDict[k] += v.item()
-            # calc lossDict contribution to each layer alpha gradient
-            for width, widthDiff in widthDiffDict.items():
-                # add element to alpha gradient
-                alphasGrad[width] += (widthDiff * lossDict[totalKey].item())
-
-        # average gradient and put in layer.alpha.grad
-        assert (nAlphas == len(alphasGrad.keys()))
-        for width, alphaWidth in alphasDict.items():
+            # add path blocks width diff & loss, lossDict contribution to each block alpha gradient is widthDiff * loss
+            assert (nAlphas == len(widthDiffDict.keys()))
+            scores.append([widthDiffDict[width] for width in alphasDict.keys()])
+            losses.append(lossDict[totalKey].item())
+
+        # calc gradient and put in block alpha grad
+        alphasGrad = self._alphasGradient(tensor(scores, dtype=float32, device=getDevice()), tensor(losses, device=getDevice()), batchNum)
+        for alphaWidth, alphaGrad in zip(alphasDict.values(), alphasGrad):
             alphaTensor = alphaWidth.tensor()
-            alphaTensor.grad = (alphasGrad[width] / nSamples)
+            alphaTensor.grad = alphaGrad.view(1)
 
         # update gradient
         # average losses
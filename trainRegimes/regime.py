@@ -9,13 +9,14 @@ from utils.data import load_data
 from utils.args import logParameters
 from utils.HtmlLogger import HtmlLogger
 from utils.statistics import Statistics
+from utils.device import getDevice
 
 
 class TrainRegime:
     def __init__(self, args: Namespace, logger: HtmlLogger):
         # init model
         model = self.buildModel(args)
-        model = model.cuda()
+        model = model.to(getDevice())
         # create DataParallel model instance
         self.modelParallel = model
         # self.modelParallel = DataParallel(model, args.gpu)
@@ -90,7 +91,6 @@ class TrainRegime:
 # #     idxList[i] += 2
 # model.setCurrWidthIdx(idxList)
 # v1 = model.countFlops()
-# from utils.flops_benchmark import count_flops
 # from torch.nn.modules.conv import Conv2d
 # from torch.nn.modules.pooling import AvgPool2d
 # from torch.nn.modules.linear import Linear
@@ -189,4 +189,3 @@ class TrainRegime:
 #
 #         return out
 #
-# flops, output_size = count_flops(G(), args.input_size, 3)
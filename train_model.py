@@ -8,7 +8,7 @@ from os.path import dirname, basename, exists
 from torch import load as loadCheckpoint
 from torch import manual_seed as torch_manual_seed
 from torch.cuda import manual_seed as cuda_manual_seed
-from torch.cuda import is_available, set_device
+from torch.cuda import is_available
 import torch.backends.cudnn as cudnn
 
 from models.BaseNet.BaseNet import BaseNet
@@ -18,6 +18,7 @@ from utils.trainWeights import TrainWeights
 from utils.HtmlLogger import HtmlLogger
 from utils.zip import create_exp_dir
 from utils.checkpoint import checkpointFileType
+from utils.device import deviceChoices, isCuda, initDevice, getDevice
 
 
 def checkpointPrefix(fileName):
@@ -26,7 +27,7 @@ def checkpointPrefix(fileName):
 
 def train(scriptArgs):
     # load args from file
-    args = loadCheckpoint(scriptArgs.json, map_location=lambda storage, loc: storage.cuda())
+    args = loadCheckpoint(scriptArgs.json, map_location=getDevice())
 
     # terminate if validAcc exists
     _validAccKey = TrainWeights.validAccKey
@@ -41,7 +42,6 @@ def train(scriptArgs):
     args.seed = datetime.now().microsecond
     # update cudnn parameters
     random.seed(args.seed)
-    set_device(scriptArgs.gpu[0])
     cudnn.benchmark = True
     torch_manual_seed(args.seed)
     cudnn.enabled = True
@@ -103,15 +103,12 @@ def iterateFolder(scriptArgs):
                             remove(filePath)
 
 
-if not is_available():
-    print('no gpu device available')
-    exit(1)
-
 parser = ArgumentParser()
 # parser.add_argument('--json', type=str, required=True, help='JSON file path')
 parser.add_argument('--folderPath', type=str, required=True, help='checkpoints folder path')
 parser.add_argument('--data', type=str, required=True, help='datasets folder path')
 parser.add_argument('--repeatNum', type=int, required=True, choices=range(1, 100), help='checkpoint training repeat number')
+parser.add_argument('--device', type=str, default='cuda', choices=deviceChoices(), help='device to train on')
 parser.add_argument('--gpu', type=str, default='0', help='gpu device id, e.g. 0,1,3')
 parser.add_argument('--workers', type=int, default=0, choices=range(0, 32), help='num of workers')
 parser.add_argument('--optimal_epochs', type=int, default=150, help='stop training weights if there is no new optimum in last optimal_epochs')
@@ -124,4 +121,11 @@ scriptArgs = parser.parse_args()
 if type(scriptArgs.gpu) is str:
     scriptArgs.gpu = [int(i) for i in scriptArgs.gpu.split(',')]
 
+if isCuda(scriptArgs.device) and (not is_available()):
+    print('no gpu device available')
+    exit(1)
+
+# set process device
+initDevice(scriptArgs.device, scriptArgs.gpu[0])
+
 iterateFolder(scriptArgs)
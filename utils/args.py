@@ -7,9 +7,18 @@ from socket import gethostname
 from torch import load, save
 
 from models.BaseNet.BaseNet import BaseNet
+from models.modules.BudgetSampler import BudgetSampler
+from models.modules.PathSampler import PathSampler
+from utils.pathRefiner import PathRefiner
+from utils.lossBaseline import LossBaseline
+from utils.replayStore import ReplayStore
+from utils.sampleController import SampleController
+from replicator.PathRegistry import PathRegistry
 from utils.HtmlLogger import HtmlLogger
 from utils.zip import create_exp_dir
 from utils.checkpoint import generate_partitions
+from utils.flopsCache import defaultCacheFolder
+from utils.device import deviceChoices, memoryFormatChoices, defaultMemoryFormat
 
 
 class Switcher:
@@ -89,30 +98,66 @@ def parseArgs():
     parser.add_argument('--search_momentum', type=float, default=0.9, help='momentum')
     parser.add_argument('--search_weight_decay', type=float, default=4e-5, help='weight decay')
     # GPU params
+    parser.add_argument('--device', type=str, default='cuda', choices=deviceChoices(), help='device to run search & training on')
     parser.add_argument('--gpu', type=str, default='0', help='gpu device id, e.g. 0,1,3')
     parser.add_argument('--workers', type=int, default=0, choices=range(0, 32), help='num of workers')
+    parser.add_argument('--memory_format', type=str, default=defaultMemoryFormat(), choices=memoryFormatChoices(),
+                        help='activations & narrowed weights memory format, channels_last requires torch>=1.5')
+    parser.add_argument('--traced_paths', type=int, default=0, help='number of traced paths to cache for inference, 0 disables tracing')
     # logging params
     parser.add_argument('--logInterval', type=int, default=50, choices=range(1, 1000), help='log training once in --logInterval epochs')
     # pre-trained params
     parser.add_argument('--pre_trained', type=str, default=None, help='pre-trained model to copy weights from')
     parser.add_argument('--{}'.format(modelFlopsKey), type=str, default=None, help='model flops list where each element is a layer flops dict')
+    parser.add_argument('--{}'.format(BaseNet.flopsCacheKey()), type=str, default=defaultCacheFolder(),
+                        help='folder of model flops cached by architecture, empty string disables the cache')
     # training params
     parser.add_argument('--search_epochs', type=int, default=1000, help='number of search regime epochs')
     parser.add_argument('--search_patience', type=int, default=2, help='search scheduler epochs patience before lowering learning rate')
     parser.add_argument('--weights_epochs', type=int, default=100, help='number of weights training epochs')
     parser.add_argument('--weights_patience', type=int, default=2, help='weights training scheduler epochs patience before lowering learning rate')
+    parser.add_argument('--{}'.format(PathRefiner.refineStepsKey()), type=int, default=0,
+                        help='max number of local search steps refining alphas partition path after search, 0 disables refinement')
+    parser.add_argument('--{}'.format(PathRefiner.refineBatchesKey()), type=int, default=PathRefiner.defaultBatches(),
+                        help='number of validation batches refinement scores each candidate path on')
     parser.add_argument('--train_weights_interval', type=int, default=20, help='train model weights after [train_weights_interval] search epochs')
+    parser.add_argument('--{}'.format(PathRegistry.pathRegistryKey()), type=str, default=PathRegistry.noneKey(),
+                        choices=PathRegistry.policyChoices(), help='replicas paths evaluated before in epoch, reuse their loss or resample them')
     # parser.add_argument('--train_portion', type=float, default=1.0, help='portion of training data')
     # parser.add_argument('--train_regime', default='TrainRegime', choices=trainRegimesNames, help='Training regime')
     parser.add_argument('--alphas_data_parts', type=int, default=1, help='split alphas training data to parts. each loop uses single part')
     parser.add_argument('--nSamples', type=int, default=5, help='number of samples (paths) to evaluate on each alpha')
     parser.add_argument('--nJobs', type=int, default=5, help='number of jobs (checkpoints) to sample from current alphas distribution')
     parser.add_argument('--lmbda', type=float, default=0.0, help='Lambda value for FlopsLoss')
+    parser.add_argument('--{}'.format(BaseNet.costKey()), type=str, default=BaseNet.flopsCostKey(), choices=BaseNet.costChoices(),
+                        help='path cost the search optimizes, latency is measured per layer width on local cpu')
+    parser.add_argument('--{}'.format(BudgetSampler.budgetSamplerKey()), type=str, default=BudgetSampler.noneKey(),
+                        choices=BudgetSampler.methodChoices(), help='draw paths from alphas distribution conditioned on flops <= flops_budget, '
+                             'dp falls back to rejection for models without independent layers distributions, e.g. multinomial & block_binomial, '
+                             'or whose dp tables are too large, e.g. ImageNet widths')
+    parser.add_argument('--{}'.format(BudgetSampler.flopsBudgetKey()), type=float, default=1.0,
+                        help='budget sampler flops budget, as ratio of baseline width flops')
+    parser.add_argument('--{}'.format(PathSampler.pathSamplerKey()), type=str, default=PathSampler.iidKey(),
+                        choices=PathSampler.methodChoices(), help='binomial models paths samples, variance reduced samplers draw paths by inverse CDF')
+    parser.add_argument('--{}'.format(LossBaseline.lossBaselineKey()), type=str, default=LossBaseline.noneKey(),
+                        choices=LossBaseline.methodChoices(), help='loss baseline subtracted from paths losses in alphas gradient estimator')
+    parser.add_argument('--{}'.format(ReplayStore.replaySizeKey()), type=int, default=0,
+                        help='max number of previous epochs paths draws reused in alphas gradient, 0 disables replay')
+    parser.add_argument('--{}'.format(ReplayStore.replayTruncationKey()), type=float, default=1.0,
+                        help='replayed paths importance weights are truncated to [replay_truncation]')
+    parser.add_argument('--{}'.format(BaseNet.pruneEpochKey()), type=int, default=0,
+                        help='remove widths whose alphas probability is below [prune_threshold] from epoch [prune_epoch] on, 0 disables pruning')
+    parser.add_argument('--{}'.format(BaseNet.pruneThresholdKey()), type=float, default=0.01, help='pruned widths max alphas probability')
+    parser.add_argument('--{}'.format(SampleController.samplesRSEKey()), type=float, default=0.0,
+                        help='epoch paths are added until alphas gradient relative standard error reaches [samples_rse], 0 uses fixed nSamples, binomial & multinomial searches only')
+    parser.add_argument('--{}'.format(SampleController.minSamplesKey()), type=int, default=4, help='adaptive samples initial number of epoch paths')
+    parser.add_argument('--{}'.format(SampleController.maxSamplesKey()), type=int, default=64, help='adaptive samples max number of epoch paths')
     # # Conv2d params
     # parser.add_argument('--kernel', type=int, default=3, help='conv kernel size, e.g. 1,3,5')
     # width params
     parser.add_argument('--width', type=str, required=True, help='list of width values, e.g. 0.25,0.5,0.75,1.0')
     parser.add_argument('--baseline', type=float, default=None, help='baseline width ratio we want to compare to')
+    parser.add_argument('--width_granularity', type=int, default=1, help='round binomial sampled widths to multiples of width_granularity')
     # call function to generate width partitions checkpoints
     parser.add_argument('--generate_partitions', type=str, default=None)
 
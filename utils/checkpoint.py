@@ -1,11 +1,13 @@
 from shutil import copyfile
 
 from torch import save as saveModel
+from torch import load as loadModel
 
 checkpointFileType = 'pth.tar'
 stateFilenameDefault = 'model'
 stateCheckpointPattern = '{}/{}_checkpoint.' + checkpointFileType
 stateOptModelPattern = '{}/{}_opt.' + checkpointFileType
+stateDenseModelPattern = '{}/{}_dense.' + checkpointFileType
 blocksPartitionKey = 'blocksPartition'
 
 
@@ -33,6 +35,36 @@ def save_checkpoint(path, model, optimizer, best_prec1, is_best=False, filename=
     return state, filePaths
 
 
+# save standalone dense model of given path, i.e. deployable checkpoint without the rest of the slimmable model
+# dense model is saved as state dict, path widths & classifier params, i.e. everything load_dense_checkpoint() builds the dense model from
+def save_dense_checkpoint(path, model, widthIdxList, best_prec1, filename=None):
+    print('*** save_dense_checkpoint ***')
+    # build path dense model
+    denseModel = model.materializePath(widthIdxList)
+    # set state dictionary
+    state = dict(state_dict=denseModel.state_dict(), width=denseModel.widthList, widthIdx=list(widthIdxList), imagenet=denseModel.maxpool is not None,
+                 fc=(denseModel.fc.in_features, denseModel.fc.out_features), best_prec1=best_prec1)
+    # set state filename
+    filename = filename or stateFilenameDefault
+    filePath = stateDenseModelPattern.format(path, filename)
+    # save state to file
+    saveModel(state, filePath)
+
+    return state, filePath
+
+
+# returns standalone dense model of dense checkpoint, built from checkpoint path widths alone & loaded with its weights
+def load_dense_checkpoint(filePath):
+    # imported locally, since models import utils.checkpoint
+    from models.ResNet18 import buildDenseResNet18
+
+    state = loadModel(filePath, map_location=lambda storage, loc: storage)
+    denseModel = buildDenseResNet18(state['width'], state['imagenet'], *state['fc'])
+    denseModel.load_state_dict(state['state_dict'])
+
+    return denseModel
+
+
 def generate_partitions(args, blocksPermutationList, modelBlocks):
     nBlocks, nLayersPerBlock = modelBlocks
 
@@ -7,6 +7,7 @@ from torch.utils.data.dataloader import DataLoader
 from torch.utils.data.sampler import SubsetRandomSampler
 
 from utils.preprocess import get_transform
+from utils.device import isCuda
 
 __DATASETS_DEFAULT_PATH = '/media/ssd/Datasets/'
 
@@ -43,6 +44,8 @@ def splitDataToParts(data, indices, nParts, createDataLoader):
 
 
 def load_data(args):
+    # pin memory only if we copy batches to gpu
+    pin_memory = isCuda(args.device)
     # init transforms
     transform = {
         'train': get_transform(args.dataset, augment=True),
@@ -57,13 +60,13 @@ def load_data(args):
     # split = int(floor(args.train_portion * num_train))
 
     train_queue = DataLoader(train_data, batch_size=args.batch_size, sampler=SubsetRandomSampler(indices),
-                             pin_memory=True, num_workers=args.workers)
+                             pin_memory=pin_memory, num_workers=args.workers)
 
-    valid_queue = DataLoader(valid_data, batch_size=args.batch_size, shuffle=True, pin_memory=True, num_workers=args.workers)
+    valid_queue = DataLoader(valid_data, batch_size=args.batch_size, shuffle=True, pin_memory=pin_memory, num_workers=args.workers)
 
     # init create DataLoader function
     createDataLoader = lambda data, _indices: DataLoader(data, batch_size=args.batch_size, sampler=SubsetRandomSampler(_indices),
-                                                         pin_memory=True, num_workers=args.workers)
+                                                         pin_memory=pin_memory, num_workers=args.workers)
     # build search_queue as list of DataLoaders
     create_search_queue = lambda: splitDataToParts(train_data, indices, args.alphas_data_parts, createDataLoader)
 
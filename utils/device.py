@@ -0,0 +1,62 @@
+import torch
+from torch import device as torchDevice
+from torch.cuda import set_device
+
+_cudaKey = 'cuda'
+_cpuKey = 'cpu'
+_contiguousKey = 'contiguous'
+_channelsLastKey = 'channels_last'
+# current process device, every module allocates its tensors & modules on this device
+_currDevice = [torchDevice(_cudaKey)]
+
+
+def deviceChoices() -> list:
+    return [_cudaKey, _cpuKey]
+
+
+def isCuda(deviceName: str) -> bool:
+    return deviceName == _cudaKey
+
+
+# returns the device of model replication on given gpu
+# on cpu, gpu ids only determine how many replications we run simultaneously
+def replicaDevice(deviceName: str, gpu: int) -> torchDevice:
+    return torchDevice(_cudaKey, gpu) if isCuda(deviceName) else torchDevice(_cpuKey)
+
+
+# set current process device, select gpu in case of cuda device
+def initDevice(deviceName: str, gpu: int):
+    if isCuda(deviceName):
+        set_device(gpu)
+
+    _currDevice[0] = replicaDevice(deviceName, gpu)
+
+
+def getDevice() -> torchDevice:
+    return _currDevice[0]
+
+
+def memoryFormatChoices() -> list:
+    return [_contiguousKey, _channelsLastKey]
+
+
+def defaultMemoryFormat() -> str:
+    return _contiguousKey
+
+
+# returns torch memory format by its name, None stands for default contiguous format, i.e. no layout conversion
+def memoryFormat(memoryFormatName: str):
+    if memoryFormatName == _contiguousKey:
+        return None
+
+    # channels_last is available since torch 1.5
+    _memoryFormat = getattr(torch, memoryFormatName, None)
+    if _memoryFormat is None:
+        raise ValueError('Memory format [{}] is not supported by torch [{}]'.format(memoryFormatName, torch.__version__))
+
+    return _memoryFormat
+
+
+# returns x in given memory format, None keeps x as is
+def toMemoryFormat(x, _memoryFormat):
+    return x if _memoryFormat is None else x.contiguous(memory_format=_memoryFormat)
@@ -0,0 +1,31 @@
+# closed-form flops, computed from layers shapes only, i.e. no forward pass & no device.
+# multiply-add counts as 2 flops and total is divided by 2, i.e. flops are multiply-adds (+ bias adds).
+# model flops count conv layers only, i.e. the classifier is the same for all paths and isn't counted
+
+
+# spatial output size of a single dimension, same formula as Conv2d output shape
+def convOutputSize(input_size: int, kernel_size: int, stride: int, padding: int, dilation: int) -> int:
+    return ((input_size + (2 * padding) - (dilation * (kernel_size - 1)) - 1) // stride) + 1
+
+
+# returns (flops, output_size) of conv over input of size input_size x input_size, where
+# conv params (kernel_size, stride, padding, dilation) are (height, width) tuples, as in Conv2d
+def convFlops(in_channels: int, out_channels: int, kernel_size: tuple, stride: tuple, padding: tuple, dilation: tuple, groups: int,
+              bias: bool, input_size: int):
+    output_height, output_width = [convOutputSize(input_size, *dimParams) for dimParams in zip(kernel_size, stride, padding, dilation)]
+    kernel_height, kernel_width = kernel_size
+
+    # We count multiply-add as 2 flops
+    conv_per_position_flops = 2 * kernel_height * kernel_width * in_channels * out_channels / groups
+    active_elements_count = output_height * output_width
+    overall_flops = conv_per_position_flops * active_elements_count
+    if bias:
+        overall_flops += out_channels * active_elements_count
+
+    return overall_flops / 2, output_width
+
+
+# returns (flops, output_size) of given Conv2d module params, replacing its channels by (in_channels, out_channels)
+def conv2dFlops(conv, in_channels: int, out_channels: int, input_size: int):
+    return convFlops(in_channels, out_channels, conv.kernel_size, conv.stride, conv.padding, conv.dilation, conv.groups, conv.bias is not None,
+                     input_size)
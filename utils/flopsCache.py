@@ -0,0 +1,48 @@
+from os import makedirs, getpid, replace
+from os.path import exists, expanduser
+from hashlib import sha1
+from socket import gethostname
+
+from torch import load, save, get_num_threads, __version__
+
+from utils.checkpoint import checkpointFileType
+
+# bump whenever flops counting changes, in order to invalidate existing cache entries
+_flopsCacheVersion = 1
+# per user cache folder, shared by all runs & checkouts of the user
+_defaultCacheFolder = '~/.cache/slimmable/flops'
+
+
+def defaultCacheFolder() -> str:
+    return expanduser(_defaultCacheFolder)
+
+
+# architecture fingerprint, i.e. everything layers flops tables depend on
+def architectureFingerprint(model: str, dataset: str, input_size: int, width: list, baseNetType: str, partition: list) -> str:
+    fingerprint = repr((_flopsCacheVersion, model, dataset, input_size, list(width), baseNetType, partition))
+    return sha1(fingerprint.encode()).hexdigest()
+
+
+# host fingerprint of given architecture fingerprint, for host dependent tables, e.g. measured latency
+def hostFingerprint(archFingerprint: str, *params) -> str:
+    fingerprint = repr((archFingerprint, gethostname(), get_num_threads(), __version__) + params)
+    return sha1(fingerprint.encode()).hexdigest()
+
+
+def _flopsCachePath(cacheFolder: str, key: str) -> str:
+    return '{}/{}.{}'.format(cacheFolder, key, checkpointFileType)
+
+
+# returns cached entry, None if key is not in cache
+def loadCacheEntry(cacheFolder: str, key: str):
+    path = _flopsCachePath(cacheFolder, key)
+    return load(path) if exists(path) else None
+
+
+def saveCacheEntry(cacheFolder: str, key: str, entry):
+    makedirs(cacheFolder, exist_ok=True)
+    path = _flopsCachePath(cacheFolder, key)
+    # multiple processes might write the same entry, therefore write to temp file and rename, which is atomic
+    tmpPath = '{}.{}'.format(path, getpid())
+    save(entry, tmpPath)
+    replace(tmpPath, path)
@@ -1,9 +1,11 @@
-from numpy import linspace
+from abc import abstractmethod
+from numpy import linspace, interp
 from bisect import bisect_left
 
 from torch import tensor, float32, sigmoid
 from torch.nn import CrossEntropyLoss, Module, LeakyReLU
 from torch.serialization import load
+from utils.device import getDevice
 import matplotlib
 
 matplotlib.use('Agg')
@@ -28,7 +30,7 @@ class LossFunction:
 
     def calcLoss(self, modelFlops: float) -> tensor:
         v = (modelFlops / self.minFlops) ** 2
-        return tensor(v, dtype=float32).cuda()
+        return tensor(v, dtype=float32, device=getDevice())
 
 
 class FlopsLoss(Module):
@@ -37,12 +39,14 @@ class FlopsLoss(Module):
     _crossEntropyKey = 'CrossEntropy'
     _flopsKey = 'Flops'
     _lossKeys = [_totalKey, _crossEntropyKey, _flopsKey]
+    # path cost key
+    _costKey = _flopsKey
 
     def __init__(self, args, baselineFlopsDict: dict):
         super(FlopsLoss, self).__init__()
 
         self.lmbda = args.lmbda
-        self.crossEntropyLoss = CrossEntropyLoss().cuda()
+        self.crossEntropyLoss = CrossEntropyLoss().to(getDevice())
         self.baselineFlops = baselineFlopsDict.get(args.baseline)
 
         # self.flopsLoss = LossFunction(self.baselineFlops).calcLoss
@@ -71,6 +75,16 @@ class FlopsLoss(Module):
     def totalKey() -> str:
         return FlopsLoss._totalKey
 
+    # path cost the loss is applied on
+    @staticmethod
+    def pathCost(model, path):
+        return model.pathFlops(path)
+
+    # model current path cost, given its flops, i.e. flops don't have to be counted
+    @staticmethod
+    def currPathCost(model, flops: float):
+        return flops
+
     # # Methods I, II, III loss function
     # def forward(self, input: tensor, target: tensor, modelFlops: float) -> dict:
     #     loss = {self._crossEntropyKey: self.crossEntropyLoss(input, target),
@@ -79,11 +93,8 @@ class FlopsLoss(Module):
     #
     #     return loss
 
-    # Method IV loss function
-    def forward(self, input: tensor, target: tensor, modelFlops: float) -> dict:
-        loss = {self._crossEntropyKey: self.crossEntropyLoss(input, target),
-                self._flopsKey: tensor(modelFlops, dtype=float32).cuda()}
-
+    # calc expected loss for modelFlops, by modelFlops corresponding linear line
+    def _expectedLoss(self, modelFlops: float) -> float:
         # find modelFlops corresponding linear line
         flopsIdx = bisect_left(self._flopsList, modelFlops)
         if flopsIdx <= 0:
@@ -94,8 +105,15 @@ class FlopsLoss(Module):
             assert (x0 <= modelFlops <= x1)
 
         m, b = self._linearLineParams[(x0, x1)]
+        return (m * modelFlops) + b
+
+    # Method IV loss function
+    def forward(self, input: tensor, target: tensor, modelFlops: float) -> dict:
+        loss = {self._crossEntropyKey: self.crossEntropyLoss(input, target),
+                self._costKey: tensor(modelFlops, dtype=float32, device=getDevice())}
+
         # calc expected loss for modelFlops
-        expectedLoss = (m * modelFlops) + b
+        expectedLoss = self._expectedLoss(modelFlops)
         lossDiff = loss[self._crossEntropyKey] - expectedLoss
         loss[self._totalKey] = self._flopsLoss(lossDiff / expectedLoss)
 
@@ -182,3 +200,118 @@ class FlopsLoss(Module):
         pdf = PdfPages(self.flopsLossImgPath)
         pdf.savefig(fig)
         pdf.close()
+
+
+# FlopsLoss counterpart for other path costs, e.g. latency
+# homogeneous models expected loss lines are moved from flops axis to cost axis by baseline models flops & cost
+class CostLoss(FlopsLoss):
+    def __init__(self, args, baselineFlopsDict: dict, baselineCostDict: dict):
+        super(CostLoss, self).__init__(args, baselineFlopsDict)
+
+        self.baselineCost = baselineCostDict.get(args.baseline)
+        # map flops to cost by baseline models flops & cost
+        baselineKeys = sorted(baselineFlopsDict.keys(), key=lambda k: baselineFlopsDict[k])
+        flopsToCost = lambda x: interp(x, [baselineFlopsDict[k] for k in baselineKeys], [baselineCostDict[k] for k in baselineKeys])
+        # homogeneous models (cost, expected loss) points, cost isn't necessarily monotonic in flops
+        pts = sorted([(flopsToCost(x), self._expectedLoss(x)) for x in self._flopsList])
+        # merge points of equal cost, e.g. baseline widths with equal measured latency, into their average expected loss
+        mergedPts = {}
+        for x, y in pts:
+            mergedPts.setdefault(x, []).append(y)
+        pts = [(x, sum(ys) / len(ys)) for x, ys in mergedPts.items()]
+        # all points have equal cost, expected loss is constant
+        if len(pts) == 1:
+            pts.append((pts[0][0] + 1.0, pts[0][1]))
+        # replace flops axis by cost axis
+        self._flopsList = [x for x, _ in pts]
+        self._linearLineParams = {}
+        for (x0, y0), (x1, y1) in zip(pts[:-1], pts[1:]):
+            m = (y1 - y0) / (x1 - x0)
+            self._linearLineParams[(x0, x1)] = (m, y1 - (m * x1))
+
+    @staticmethod
+    @abstractmethod
+    def lossKeys() -> str:
+        raise NotImplementedError('subclasses must override lossKeys()!')
+
+    @staticmethod
+    @abstractmethod
+    def pathCost(model, path):
+        raise NotImplementedError('subclasses must override pathCost()!')
+
+    @staticmethod
+    @abstractmethod
+    def currPathCost(model, flops: float):
+        raise NotImplementedError('subclasses must override currPathCost()!')
+
+    # model current path block cost, path cost is composed of its blocks costs by blocksPathCost()
+    @staticmethod
+    @abstractmethod
+    def blockCost(block):
+        raise NotImplementedError('subclasses must override blockCost()!')
+
+    # path cost, given its blocks costs, i.e. blocks costs can be updated per block instead of counting path cost
+    @staticmethod
+    @abstractmethod
+    def blocksPathCost(model, blocksCosts: list):
+        raise NotImplementedError('subclasses must override blocksPathCost()!')
+
+
+# path cost is its measured latency on local cpu
+class LatencyLoss(CostLoss):
+    _latencyKey = 'Latency'
+    _lossKeys = [FlopsLoss._totalKey, FlopsLoss._crossEntropyKey, _latencyKey]
+    _costKey = _latencyKey
+
+    def __init__(self, args, baselineFlopsDict: dict, baselineLatencyDict: dict):
+        super(LatencyLoss, self).__init__(args, baselineFlopsDict, baselineLatencyDict)
+
+    @staticmethod
+    def lossKeys() -> str:
+        return LatencyLoss._lossKeys
+
+    @staticmethod
+    def pathCost(model, path):
+        return model.pathLatency(path)
+
+    @staticmethod
+    def currPathCost(model, flops: float):
+        return model.countLatency()
+
+    @staticmethod
+    def blockCost(block):
+        return block.countLatency()
+
+    @staticmethod
+    def blocksPathCost(model, blocksCosts: list):
+        return sum(blocksCosts)
+
+
+# path cost is its memory footprint, i.e. parameters & peak activations bytes
+class MemoryLoss(CostLoss):
+    _memoryKey = 'Memory'
+    _lossKeys = [FlopsLoss._totalKey, FlopsLoss._crossEntropyKey, _memoryKey]
+    _costKey = _memoryKey
+
+    def __init__(self, args, baselineFlopsDict: dict, baselineMemoryDict: dict):
+        super(MemoryLoss, self).__init__(args, baselineFlopsDict, baselineMemoryDict)
+
+    @staticmethod
+    def lossKeys() -> str:
+        return MemoryLoss._lossKeys
+
+    @staticmethod
+    def pathCost(model, path):
+        return model.pathMemoryBytes(path)
+
+    @staticmethod
+    def currPathCost(model, flops: float):
+        return model.memoryBytes()
+
+    @staticmethod
+    def blockCost(block):
+        return block.countMemory()
+
+    @staticmethod
+    def blocksPathCost(model, blocksCosts: list):
+        return model.blocksMemoryBytes(blocksCosts)
@@ -0,0 +1,32 @@
+from time import perf_counter
+from statistics import median
+
+from torch import randn, no_grad
+from torch.nn.functional import conv2d
+
+from utils.device import toMemoryFormat
+
+# number of forwards before measuring, i.e. allocations & caches warmup
+_nWarmup = 5
+# number of measured forwards, latency is their median
+_nRepeats = 20
+
+
+# measures latency (seconds) of single image inference of conv on local cpu, conv params are taken from given Conv2d module,
+# where its channels are replaced by (in_channels, out_channels).
+# measures eval mode forward, i.e. bn is folded into conv weights & bias
+def convLatency(conv, in_channels: int, out_channels: int, input_size: int, _memoryFormat=None, nWarmup: int = _nWarmup,
+                nRepeats: int = _nRepeats) -> float:
+    x = toMemoryFormat(randn(1, in_channels, input_size, input_size), _memoryFormat)
+    weights = toMemoryFormat(randn(out_channels, in_channels // conv.groups, *conv.kernel_size), _memoryFormat)
+    bias = randn(out_channels)
+
+    times = []
+    with no_grad():
+        for _ in range(nWarmup + nRepeats):
+            start = perf_counter()
+            conv2d(x, weights, bias=bias, stride=conv.stride, padding=conv.padding, dilation=conv.dilation, groups=conv.groups)
+            times.append(perf_counter() - start)
+
+    # median is robust to scheduling noise
+    return median(times[nWarmup:])
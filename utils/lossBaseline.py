@@ -0,0 +1,147 @@
+from abc import abstractmethod
+
+from torch import tensor, zeros_like, cat
+
+from models.modules.PathSampler import PathSampler
+
+
+# control variate for score function alphas gradient estimators.
+# estimator is the average of score * (loss - baseline) over paths, where score is path score function w.r.t. alphas,
+# e.g. sampled width - alpha mean width. epoch paths are evaluated on every epoch batch, therefore baseline state is updated once per epoch,
+# after all epoch batches gradients have been computed, i.e. batch baseline depends on previous epochs paths only, and estimator remains unbiased.
+# leave-one-out baseline depends on the other batch paths, i.e. it is unbiased for independent paths only
+class LossBaseline:
+    _lossBaselineKey = 'loss_baseline'
+    _noneKey = 'none'
+    _emaKey = 'ema'
+    _leaveOneOutKey = 'loo'
+    _learnedKey = 'learned'
+
+    @staticmethod
+    def lossBaselineKey():
+        return LossBaseline._lossBaselineKey
+
+    @staticmethod
+    def noneKey():
+        return LossBaseline._noneKey
+
+    @staticmethod
+    def methodChoices():
+        return [LossBaseline._noneKey, LossBaseline._emaKey, LossBaseline._leaveOneOutKey, LossBaseline._learnedKey]
+
+    @staticmethod
+    def build(args):
+        method = getattr(args, LossBaseline._lossBaselineKey, LossBaseline._noneKey)
+        # variance reduced path samplers correlate epoch paths, e.g. antithetic pairs, therefore path leave-one-out baseline
+        # contains its correlated paths losses, i.e. estimator is biased
+        pathSampler = getattr(args, PathSampler.pathSamplerKey(), PathSampler.iidKey())
+        if (method == LossBaseline._leaveOneOutKey) and (pathSampler != PathSampler.iidKey()):
+            print('*** WARNING: [{}] baseline is biased under [{}] correlated paths, falling back to [{}] baseline'
+                  .format(LossBaseline._leaveOneOutKey, pathSampler, LossBaseline._emaKey))
+            method = LossBaseline._emaKey
+        baselineClass = {LossBaseline._noneKey: NoBaseline, LossBaseline._emaKey: EMABaseline,
+                         LossBaseline._leaveOneOutKey: LeaveOneOutBaseline, LossBaseline._learnedKey: LearnedBaseline}[method]
+
+        return baselineClass()
+
+    def __init__(self):
+        # current epoch batches (scores, losses), baseline state is updated from them by endEpoch()
+        self._epochBatches = []
+
+    # returns baseline per (path, score variable), or a tensor broadcastable to (nPaths x nVariables)
+    @abstractmethod
+    def _baselines(self, scores: tensor, losses: tensor):
+        raise NotImplementedError('subclasses must override _baselines()!')
+
+    # update baseline state with epoch paths, given (nEpochPaths x nVariables) scores & (nEpochPaths) losses over all epoch batches
+    def _update(self, scores: tensor, losses: tensor):
+        pass
+
+    # update baseline state with current epoch batches, i.e. next epoch baselines don't depend on next epoch paths
+    def endEpoch(self):
+        if len(self._epochBatches) > 0:
+            scores, losses = zip(*self._epochBatches)
+            self._update(cat(scores), cat(losses))
+        self._epochBatches = []
+
+    # returns (nPaths x nVariables) paths gradient contributions, i.e. weighted score * (loss - baseline), where scores is (nPaths x nVariables)
+    # tensor and losses is (nPaths) tensor. weights is (nPaths) tensor of paths importance weights, None if paths are drawn from current alphas.
+    # baseline state isn't updated
+    def contributions(self, scores: tensor, losses: tensor, weights: tensor = None):
+        losses = losses.to(scores.dtype)
+        weightedScores = scores if weights is None else (scores * weights.to(scores.dtype)[:, None])
+        return weightedScores * (losses[:, None] - self._baselines(scores, losses))
+
+    # returns (gradient, gradient variance ratio), i.e. paths contributions mean, batch is added to current epoch batches.
+    # variance ratio is the ratio between baseline paths gradients variance and paths gradients variance without baseline
+    def gradient(self, scores: tensor, losses: tensor, weights: tensor = None):
+        losses = losses.to(scores.dtype)
+        weightedScores = scores if weights is None else (scores * weights.to(scores.dtype)[:, None])
+        contributions = self.contributions(scores, losses, weights)
+        self._epochBatches.append((scores.detach(), losses.detach()))
+
+        varianceRatio = 1.0
+        if len(losses) > 1:
+            rawVariance = (weightedScores * losses[:, None]).var(dim=0).sum().item()
+            if rawVariance > 0:
+                varianceRatio = contributions.var(dim=0).sum().item() / rawVariance
+
+        return contributions.mean(dim=0), varianceRatio
+
+
+class NoBaseline(LossBaseline):
+    def _baselines(self, scores: tensor, losses: tensor):
+        return zeros_like(losses)[:, None]
+
+
+# moving average of previous epochs losses, the 1st epoch has no baseline
+class EMABaseline(LossBaseline):
+    # decay per epoch
+    _decay = 0.5
+
+    def __init__(self):
+        super(EMABaseline, self).__init__()
+        self._avg = None
+
+    def _baselines(self, scores: tensor, losses: tensor):
+        return zeros_like(losses)[:, None] if self._avg is None else self._avg
+
+    def _update(self, scores: tensor, losses: tensor):
+        avg = losses.mean().item()
+        self._avg = avg if self._avg is None else (self._decay * self._avg) + ((1 - self._decay) * avg)
+
+
+# path baseline is the average loss of the other batch paths, unbiased as long as paths are drawn independently
+class LeaveOneOutBaseline(LossBaseline):
+    def _baselines(self, scores: tensor, losses: tensor):
+        if len(losses) < 2:
+            return zeros_like(losses)[:, None]
+
+        return ((losses.sum() - losses) / (len(losses) - 1))[:, None]
+
+
+# baseline per score variable, i.e. per layer (width block, width) alpha.
+# variable baseline minimizes variable gradient variance, i.e. E[score^2 * loss] / E[score^2], estimated by moving averages of previous epochs
+class LearnedBaseline(LossBaseline):
+    # decay per epoch
+    _decay = 0.5
+
+    def __init__(self):
+        super(LearnedBaseline, self).__init__()
+        self._numerator = None
+        self._denominator = None
+
+    def _baselines(self, scores: tensor, losses: tensor):
+        if self._numerator is None:
+            return zeros_like(losses)[:, None]
+
+        return (self._numerator / self._denominator.clamp(min=1e-12))[None, :]
+
+    def _update(self, scores: tensor, losses: tensor):
+        squares = scores * scores
+        numerator, denominator = (squares * losses[:, None]).mean(dim=0), squares.mean(dim=0)
+        if self._numerator is None:
+            self._numerator, self._denominator = numerator, denominator
+        else:
+            self._numerator = (self._decay * self._numerator) + ((1 - self._decay) * numerator)
+            self._denominator = (self._decay * self._denominator) + ((1 - self._decay) * denominator)
@@ -0,0 +1,18 @@
+# closed-form memory footprint of single sample inference, computed from layers shapes only
+
+
+# returns (parameters bytes, input activation bytes, output activation bytes) of conv followed by bn,
+# over input of size input_size x input_size, where conv output is of size output_size x output_size
+def convMemoryBytes(in_channels: int, out_channels: int, kernel_size: tuple, groups: int, bias: bool, input_size: int, output_size: int,
+                    elementSize: int) -> tuple:
+    kernel_height, kernel_width = kernel_size
+    nParams = out_channels * (in_channels // groups) * kernel_height * kernel_width
+    if bias:
+        nParams += out_channels
+    # bn weight, bias, running_mean & running_var
+    nParams += 4 * out_channels
+
+    inputBytes = in_channels * input_size * input_size * elementSize
+    outputBytes = out_channels * output_size * output_size * elementSize
+
+    return nParams * elementSize, inputBytes, outputBytes
@@ -0,0 +1,142 @@
+from numpy import flatnonzero
+from torch import no_grad
+
+from models.BaseNet.BaseNet import BaseNet
+from utils.device import getDevice
+from utils.flopsLoss import CostLoss
+
+
+# local search over paths, starting from alphas partition path.
+# moves are width mutations of a single layer or a width block, i.e. one step up or down in layers widths.
+# move flops are updated by the flops delta of the blocks the move affects, instead of counting path flops,
+# other costs, e.g. latency, are updated by the costs of the blocks the move affects, instead of counting all blocks costs
+class PathRefiner:
+    _refineStepsKey = 'refine_steps'
+    _refineBatchesKey = 'refine_batches'
+    # default number of validation batches we score candidates on
+    _nBatches = 10
+
+    def __init__(self, model: BaseNet, lossFunc, dataQueue, nBatches: int = _nBatches):
+        self._model = model
+        self._lossFunc = lossFunc
+        # cost losses path cost is composed of blocks costs, flops loss path cost is path flops
+        self._blocksCostLoss = isinstance(lossFunc, CostLoss)
+        # all candidates are scored on the same batches
+        self._batches = []
+        for input, target in dataQueue:
+            self._batches.append((input.to(getDevice()), target.to(getDevice(), non_blocking=True)))
+            if len(self._batches) >= nBatches:
+                break
+
+        # layers samples values & their widths, ordered by width
+        self._layersSampleValues = model.layersSampleValues()
+
+    @staticmethod
+    def refineStepsKey():
+        return PathRefiner._refineStepsKey
+
+    @staticmethod
+    def refineBatchesKey():
+        return PathRefiner._refineBatchesKey
+
+    @staticmethod
+    def defaultBatches():
+        return PathRefiner._nBatches
+
+    # converts layers values indices to layers sample
+    def _sample(self, valuesIdx: list) -> list:
+        return [values[idx] for (values, _), idx in zip(self._layersSampleValues, valuesIdx)]
+
+    # converts layers values indices to layers widths
+    def _width(self, valuesIdx: list) -> list:
+        return [widths[idx] for (_, widths), idx in zip(self._layersSampleValues, valuesIdx)]
+
+    # returns model current path blocks costs, given previous path blocks costs, where only blocks blocksIdx costs are counted
+    # returns None under flops loss, i.e. path cost is path flops
+    def _blocksCosts(self, blocksIdx, blocksCosts: list = None):
+        if not self._blocksCostLoss:
+            return None
+
+        blocks = self._model.blocks
+        blocksCosts = [None] * len(blocks) if blocksCosts is None else list(blocksCosts)
+        for blockIdx in blocksIdx:
+            blocksCosts[blockIdx] = self._lossFunc.blockCost(blocks[blockIdx])
+
+        return blocksCosts
+
+    # average model current path loss over batches, given path flops & blocks costs
+    # model is in eval mode, i.e. BNs use their running statistics, as in jobs evaluation,
+    # except for binomial generated BNs, which have no statistics, therefore they are generated in train mode
+    def _score(self, flops: float, blocksCosts: list) -> float:
+        model = self._model
+        cost = self._lossFunc.currPathCost(model, flops) if blocksCosts is None else self._lossFunc.blocksPathCost(model, blocksCosts)
+
+        loss = 0.0
+        with no_grad():
+            for input, target in self._batches:
+                lossDict = self._lossFunc(model(input), target, cost)
+                loss += lossDict[self._lossFunc.totalKey()].item()
+
+        return loss / len(self._batches)
+
+    # yields current path moves, i.e. (group layers indices, group new values indices), one step down & one step up per group
+    def _moves(self, valuesIdx: list, groups: list):
+        for layersIdx in groups:
+            for step in [-1, 1]:
+                newValuesIdx = [min(max(valuesIdx[idx] + step, 0), len(self._layersSampleValues[idx][0]) - 1) for idx in layersIdx]
+                if newValuesIdx != [valuesIdx[idx] for idx in layersIdx]:
+                    yield layersIdx, newValuesIdx
+
+    # hill climbing, applies the best move while it improves loss, for nSteps steps at most
+    # returns (refined path sample, steps table rows), model is set to refined path
+    def refine(self, nSteps: int):
+        model = self._model
+        # save model state, since candidates paths might replace BNs by generated BNs
+        model.restoreOriginalStateDictStructure()
+        stateDict = {k: v.clone() for k, v in model.state_dict().items()}
+        training = model.training
+        # score candidates with BNs running statistics, batch statistics of few batches are too noisy to rank paths
+        model.eval()
+
+        # start from alphas partition path
+        model.choosePathAlphasAsPartition()
+        valuesIdx = [flatnonzero(widths == width)[0] for (_, widths), width in zip(self._layersSampleValues, model.currWidth())]
+        width = self._width(valuesIdx)
+        flops = model.countFlops()
+        model.setSamplePath(self._sample(valuesIdx))
+        blocksCosts = self._blocksCosts(range(len(model.blocks)))
+        loss = self._score(flops, blocksCosts)
+
+        rows = [['Step', 'Layers', 'Width', 'Flops ratio', 'Loss'], [0, '', width, '{:.3f}'.format(flops / model.baselineFlops), '{:.5f}'.format(loss)]]
+        groups = model.mutationGroups()
+        for step in range(1, nSteps + 1):
+            bestMove = None
+            for layersIdx, newValuesIdx in self._moves(valuesIdx, groups):
+                moveFlops = flops + model.pathFlopsDelta(width, layersIdx, [self._layersSampleValues[idx][1][v] for idx, v in zip(layersIdx, newValuesIdx)])
+                moveValuesIdx = list(valuesIdx)
+                for idx, v in zip(layersIdx, newValuesIdx):
+                    moveValuesIdx[idx] = v
+
+                model.setSamplePath(self._sample(moveValuesIdx))
+                moveBlocksCosts = self._blocksCosts(model.layersBlocksIdx(layersIdx), blocksCosts)
+                moveLoss = self._score(moveFlops, moveBlocksCosts)
+                if (bestMove is None) or (moveLoss < bestMove[0]):
+                    bestMove = (moveLoss, moveValuesIdx, moveFlops, moveBlocksCosts, layersIdx)
+
+            # stop in local optimum
+            if (bestMove is None) or (bestMove[0] >= loss):
+                break
+
+            loss, valuesIdx, flops, blocksCosts, layersIdx = bestMove
+            width = self._width(valuesIdx)
+            rows.append([step, layersIdx, width, '{:.3f}'.format(flops / model.baselineFlops), '{:.5f}'.format(loss)])
+
+        # restore model state
+        model.restoreOriginalStateDictStructure()
+        model.load_state_dict(stateDict)
+        model.train(training)
+        # set refined path
+        sample = self._sample(valuesIdx)
+        model.setSamplePath(sample)
+
+        return sample, rows
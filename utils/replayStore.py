@@ -0,0 +1,70 @@
+from collections import OrderedDict
+
+from torch import stack, tensor
+
+
+# bounded store of recent epochs paths evaluations, keyed by (path, weights version).
+# entry holds path sample, path loss per search batch & path draws log probability under alphas each draw has been drawn from.
+# stored draws are reused in later epochs alphas gradient, weighted by truncated importance weights
+class ReplayStore:
+    _replaySizeKey = 'replay_size'
+    _replayTruncationKey = 'replay_truncation'
+
+    def __init__(self, size: int, truncation: float):
+        # max number of stored draws
+        self._size = size
+        self._truncation = truncation
+        self._entries = OrderedDict()
+        self._nDraws = 0
+
+    @staticmethod
+    def replaySizeKey():
+        return ReplayStore._replaySizeKey
+
+    @staticmethod
+    def replayTruncationKey():
+        return ReplayStore._replayTruncationKey
+
+    # returns replay store, None if args store size is 0
+    @staticmethod
+    def build(args):
+        size = getattr(args, ReplayStore._replaySizeKey, 0)
+        if size <= 0:
+            return None
+
+        return ReplayStore(size, getattr(args, ReplayStore._replayTruncationKey))
+
+    def truncation(self) -> float:
+        return self._truncation
+
+    # number of stored draws
+    def __len__(self):
+        return self._nDraws
+
+    # add epoch paths draws, samples is (nPaths x nLayers) tensor, logProb is (nPaths) tensor & losses is (nPaths x nBatches) tensor
+    # paths evaluated under other weights version are dropped, since their losses are stale
+    def add(self, samples, logProb, losses, weightsVersion: int):
+        for key in [key for key in self._entries.keys() if key[-1] != weightsVersion]:
+            self._nDraws -= len(self._entries.pop(key)[-1])
+
+        for sample, sampleLogProb, sampleLosses in zip(samples.cpu(), logProb.detach().cpu(), losses.cpu()):
+            key = (tuple(sample.tolist()), weightsVersion)
+            # repeated path keeps all its draws, since each draw is a sample from the alphas it has been drawn from
+            _, _, drawsLogProb = self._entries.pop(key, (None, None, []))
+            self._entries[key] = (sample, sampleLosses, drawsLogProb + [sampleLogProb.item()])
+            self._nDraws += 1
+
+        # drop oldest paths
+        while self._nDraws > self._size:
+            _, (_, _, drawsLogProb) = self._entries.popitem(last=False)
+            self._nDraws -= len(drawsLogProb)
+
+    # returns (samples, log probability, batch losses) tensors of stored draws, None if store has no draws of batch & weights version
+    def batch(self, batchNum: int, weightsVersion: int):
+        draws = [(sample, logProb, losses[batchNum]) for (_, version), (sample, losses, drawsLogProb) in self._entries.items()
+                 if (version == weightsVersion) and (batchNum < len(losses)) for logProb in drawsLogProb]
+        if len(draws) == 0:
+            return None
+
+        samples, logProb, losses = zip(*draws)
+        return stack(samples), tensor(logProb), stack(losses)
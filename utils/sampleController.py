@@ -0,0 +1,73 @@
+from math import ceil, inf
+
+from torch import tensor
+
+
+# adaptive number of epoch paths samples.
+# epoch starts with min_samples paths, alphas gradient relative standard error is estimated from paths gradient contributions,
+# and more paths are requested until relative standard error reaches samples_rse or the epoch has max_samples paths
+class SampleController:
+    _samplesRSEKey = 'samples_rse'
+    _minSamplesKey = 'min_samples'
+    _maxSamplesKey = 'max_samples'
+
+    def __init__(self, targetRSE: float, minSamples: int, maxSamples: int):
+        self._targetRSE = targetRSE
+        # relative standard error requires at least 2 paths
+        self._minSamples = max(minSamples, 2)
+        self._maxSamples = max(maxSamples, self._minSamples)
+
+    @staticmethod
+    def samplesRSEKey():
+        return SampleController._samplesRSEKey
+
+    @staticmethod
+    def minSamplesKey():
+        return SampleController._minSamplesKey
+
+    @staticmethod
+    def maxSamplesKey():
+        return SampleController._maxSamplesKey
+
+    # returns samples controller, None if args target relative standard error is 0, i.e. epoch samples number is gpus data nSamples
+    @staticmethod
+    def build(args):
+        targetRSE = getattr(args, SampleController._samplesRSEKey, 0.0)
+        if targetRSE <= 0:
+            return None
+
+        return SampleController(targetRSE, getattr(args, SampleController._minSamplesKey), getattr(args, SampleController._maxSamplesKey))
+
+    def minSamples(self) -> int:
+        return self._minSamples
+
+    def maxSamples(self) -> int:
+        return self._maxSamples
+
+    def targetRSE(self) -> float:
+        return self._targetRSE
+
+    # returns alphas gradient relative standard error, averaged over batches,
+    # given list of (nPaths x nVariables) paths gradient contributions per batch, i.e. batch gradient is contributions mean
+    @staticmethod
+    def relativeStandardError(batchesContributions: list) -> float:
+        errors = []
+        for contributions in batchesContributions:
+            nPaths = len(contributions)
+            gradientNorm = contributions.mean(dim=0).norm().item()
+            if (nPaths < 2) or (gradientNorm == 0):
+                return inf
+
+            standardError = (contributions.var(dim=0).sum().item() / nPaths) ** 0.5
+            errors.append(standardError / gradientNorm)
+
+        return tensor(errors).mean().item()
+
+    # returns number of additional paths to draw, given current number of paths & their relative standard error.
+    # standard error decreases as 1 / sqrt(nPaths), therefore target requires nPaths * (rse / target)^2 paths
+    def nextSamples(self, nSamples: int, rse: float) -> int:
+        if (rse <= self._targetRSE) or (nSamples >= self._maxSamples):
+            return 0
+
+        nRequired = self._maxSamples if rse == inf else ceil(nSamples * ((rse / self._targetRSE) ** 2))
+        return min(max(nRequired, nSamples + 1), self._maxSamples) - nSamples
@@ -12,6 +12,7 @@ from torch.optim.lr_scheduler import ReduceLROnPlateau
 from models.BaseNet.BaseNet import BaseNet
 from utils.training import TrainingStats
 from utils.HtmlLogger import HtmlLogger
+from utils.device import getDevice
 
 
 class EpochData:
@@ -40,12 +41,14 @@ class TrainWeights:
     validLossKey = 'Validation loss'
     validAccKey = 'Validation acc'
     flopsRatioKey = 'Flops ratio'
+    memoryKey = 'Memory (MB)'
     epochNumKey = 'Epoch #'
     batchNumKey = 'Batch #'
     timeKey = 'Time'
     lrKey = 'Optimizer lr'
     widthKey = 'Width'
     forwardCountersKey = 'Forward counters'
+    tracedPathsKey = 'Traced paths'
 
     # init formats for keys
     formats = {
@@ -55,7 +58,8 @@ class TrainWeights:
         trainAccKey: lambda x: HtmlLogger.dictToRows(x, nElementPerRow=1),
         validLossKey: lambda x: HtmlLogger.dictToRows(x, nElementPerRow=1),
         validAccKey: lambda x: HtmlLogger.dictToRows(x, nElementPerRow=1),
-        flopsRatioKey: lambda x: '{:.3f}'.format(x)
+        flopsRatioKey: lambda x: '{:.3f}'.format(x),
+        memoryKey: lambda x: '{:.3f}'.format(x / (2 ** 20))
     }
 
     # init tables columns
@@ -75,7 +79,7 @@ class TrainWeights:
 
         # self.regime = regime
         # init cross entropy loss
-        self.cross_entropy = CrossEntropyLoss().cuda()
+        self.cross_entropy = CrossEntropyLoss().to(getDevice())
 
         # load pre-trained model & optimizer
         self.optimizerStateDict = self.loadPreTrained(self.getModel(), self.getArgs().pre_trained, self.getLogger())
@@ -124,8 +128,8 @@ class TrainWeights:
         for batchNum, (input, target) in enumerate(data_queue):
             startTime = time()
 
-            input = input.cuda().clone().detach().requires_grad_(False)
-            target = target.cuda(async=True).clone().detach().requires_grad_(False)
+            input = input.to(getDevice()).clone().detach().requires_grad_(False)
+            target = target.to(getDevice(), non_blocking=True).clone().detach().requires_grad_(False)
 
             # do forward
             forwardFunc(input, target, trainStats)
@@ -158,12 +162,14 @@ class TrainWeights:
         # log forward counters. if loggerFuncs==[] then it is just resets counters
         func = [lambda rows: trainLogger.addInfoTable(title=forwardCountersTitle, rows=rows)] if trainLogger else []
         self.getModel().logForwardCounters(loggerFuncs=func)
+        # log traced paths cache statistics
+        func = [lambda rows: trainLogger.addInfoTable(title=self.tracedPathsKey, rows=rows)] if trainLogger else []
+        self.getModel().logTracedPaths(loggerFuncs=func)
 
         return EpochData(epochLossDict, epochAccDict, summaryData)
 
-    def _slimForward(self, input, target, trainStats):
+    def _slimForward(self, input, target, trainStats, modelForward):
         model = self.getModel()
-        modelParallel = self.getModelParallel()
         crit = self.cross_entropy
         # init loss list
         lossList = []
@@ -172,7 +178,7 @@ class TrainWeights:
             # set model layers current width index
             model.setCurrWidthIdx(idxList)
             # forward
-            logits = modelParallel(input)
+            logits = modelForward(input)
             # calc loss
             loss = crit(logits, target)
             # add to loss list
@@ -195,7 +201,7 @@ class TrainWeights:
             # optimize model weights
             optimizer.zero_grad()
             # forward
-            lossList = self._slimForward(input, target, trainStats)
+            lossList = self._slimForward(input, target, trainStats, modelParallel)
             # back propagate
             for loss in lossList:
                 loss.backward()
@@ -218,7 +224,8 @@ class TrainWeights:
 
         def forwardFunc(input, target, trainStats):
             with no_grad():
-                self._slimForward(input, target, trainStats)
+                # forward through traced paths, if model caches them
+                self._slimForward(input, target, trainStats, model.tracedForward)
 
         tableTitle = 'Epoch:[{}] - Validation'.format(nEpoch)
         forwardCountersTitle = '{} - Validation'.format(self.forwardCountersKey)
@@ -287,7 +294,7 @@ class TrainWeights:
         if path is not None:
             if exists(path):
                 # load checkpoint
-                checkpoint = loadModel(path, map_location=lambda storage, loc: storage.cuda())
+                checkpoint = loadModel(path, map_location=getDevice())
                 # load weights
                 model.loadPreTrained(checkpoint['state_dict'])
                 # # load optimizer state dict